@@ -0,0 +1,546 @@
+"""Admission control in front of course generation.
+
+Один сервер модели обслуживает всех, поэтому перед генерацией стоят:
+  * токен-бакет на пользователя (частота запросов),
+  * лимит одновременных задач на пользователя,
+  * глобальный лимит задач у модели с очередью, которая обслуживает
+    пользователей по кругу (round-robin), а не в порядке поступления.
+Если запрос всё равно не пройдёт, он сразу получает AdmissionRejected
+с оценкой Retry-After.
+
+Бакеты и задачи хранятся в SQLite (таблицы rate_limits и generation_jobs),
+поэтому лимиты и очередь общие для всех воркеров сервера. Воркер
+периодически обновляет heartbeat своих задач; задачи упавшего воркера
+считаются брошенными и перестают занимать слоты.
+
+Задачу можно отменить: клиент отключился (если admit получил ASGI
+receive запроса) или вызвал DELETE /api/jobs/<id>. Отмена прерывает
+ожидание в очереди и запрос к модели, а обработчик получает
+GenerationCancelled и ничего не сохраняет. Отмену из другого воркера
+владелец задачи замечает за GEN_CANCEL_POLL_SECONDS.
+"""
+import asyncio
+import logging
+import math
+import os
+import socket
+import time
+from contextlib import asynccontextmanager, closing
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+import anyio
+
+from .cancellation import CancelToken, GenerationCancelled, current_token
+from .metrics import GENERATIONS_CANCELLED
+from .write_batcher import open_connection
+
+logger = logging.getLogger(__name__)
+
+GEN_MAX_IN_FLIGHT = int(os.getenv("GEN_MAX_IN_FLIGHT", "1"))
+GEN_MAX_QUEUED = int(os.getenv("GEN_MAX_QUEUED", "32"))
+GEN_USER_MAX_CONCURRENT = int(os.getenv("GEN_USER_MAX_CONCURRENT", "2"))
+GEN_USER_BURST = float(os.getenv("GEN_USER_BURST", "5"))
+GEN_USER_RATE_PER_MIN = float(os.getenv("GEN_USER_RATE_PER_MIN", "6"))
+# Начальная оценка длительности одной генерации, уточняется по факту
+GEN_EXPECTED_SECONDS = float(os.getenv("GEN_EXPECTED_SECONDS", "60"))
+# Как часто ожидающая задача перепроверяет очередь (освобождение слота
+# в этом же процессе будит её сразу, в другом — не позже чем через интервал)
+GEN_QUEUE_POLL_SECONDS = float(os.getenv("GEN_QUEUE_POLL_SECONDS", "0.5"))
+GEN_HEARTBEAT_SECONDS = float(os.getenv("GEN_HEARTBEAT_SECONDS", "10"))
+GEN_STALE_SECONDS = float(os.getenv("GEN_STALE_SECONDS", "60"))
+# Как быстро задача замечает отмену, сделанную через другой воркер
+GEN_CANCEL_POLL_SECONDS = float(os.getenv("GEN_CANCEL_POLL_SECONDS", "1"))
+# Завершённые задачи нужны для оценки длительности и порядка обхода
+GEN_HISTORY_SECONDS = float(os.getenv("GEN_HISTORY_SECONDS", "86400"))
+
+_ACTIVE = "('admitted', 'queued', 'running')"
+
+# Следующая задача: пользователи, давно не получавшие слот, идут первыми
+_NEXT_QUEUED_SQL = """
+    SELECT j.id FROM generation_jobs AS j
+    LEFT JOIN (
+        SELECT user_id, MAX(started_at) AS last_started
+        FROM generation_jobs
+        WHERE started_at IS NOT NULL
+          AND user_id IN (SELECT user_id FROM generation_jobs WHERE status = 'queued')
+        GROUP BY user_id
+    ) AS s ON s.user_id = j.user_id
+    WHERE j.status = 'queued'
+    ORDER BY s.last_started IS NOT NULL, s.last_started, j.id
+    LIMIT 1
+"""
+
+
+class AdmissionRejected(Exception):
+    """Raised when a generation request must be answered with 429."""
+
+    def __init__(self, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+def refill_tokens(
+    tokens: float, updated_at: float, now: float, capacity: float, refill_per_second: float
+) -> float:
+    elapsed = max(0.0, now - updated_at)
+    return min(capacity, tokens + elapsed * refill_per_second)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        db_path: str,
+        max_in_flight: int = GEN_MAX_IN_FLIGHT,
+        max_queued: int = GEN_MAX_QUEUED,
+        user_max_concurrent: int = GEN_USER_MAX_CONCURRENT,
+        user_burst: float = GEN_USER_BURST,
+        user_rate_per_min: float = GEN_USER_RATE_PER_MIN,
+        expected_seconds: float = GEN_EXPECTED_SECONDS,
+        poll_interval: float = GEN_QUEUE_POLL_SECONDS,
+        heartbeat_interval: float = GEN_HEARTBEAT_SECONDS,
+        stale_after: float = GEN_STALE_SECONDS,
+        cancel_poll_interval: float = GEN_CANCEL_POLL_SECONDS,
+    ):
+        self.db_path = db_path
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queued = max(0, max_queued)
+        self.user_max_concurrent = max(1, user_max_concurrent)
+        self.user_burst = user_burst
+        self.user_rate_per_second = user_rate_per_min / 60.0
+        self.expected_seconds = expected_seconds
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = max(stale_after, 2 * heartbeat_interval)
+        self.cancel_poll_interval = min(cancel_poll_interval, heartbeat_interval)
+        self.rejected = 0
+        self.cancelled = 0
+        self.draining = False
+        # Задачи этого процесса: id -> статус
+        self._local_jobs: Dict[int, str] = {}
+        self._tokens: Dict[int, CancelToken] = {}
+        self._changed: Optional[asyncio.Event] = None
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    @property
+    def worker_id(self) -> str:
+        # Берём pid при каждом обращении: контроллер создаётся до fork воркеров
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    @asynccontextmanager
+    async def admit(self, user_id: Hashable, receive: Optional[Callable[[], Awaitable[dict]]] = None):
+        """Admit a request or raise AdmissionRejected immediately.
+
+        ``receive`` is the ASGI receive of the request (its body already read):
+        when the client disconnects, the job is cancelled. A cancelled block
+        is interrupted and GenerationCancelled is raised instead.
+        """
+        if self.draining:
+            self.rejected += 1
+            raise AdmissionRejected("Сервер перезапускается, повторите запрос чуть позже", 5)
+        self._ensure_heartbeat()
+        try:
+            job_id = await self._run(self._admit_sync, user_id)
+        except AdmissionRejected:
+            self.rejected += 1
+            raise
+        self._local_jobs[job_id] = "admitted"
+        token = self._tokens[job_id] = CancelToken()
+        loop = asyncio.get_running_loop()
+        watcher = loop.create_task(self._watch_disconnect(receive, token)) if receive is not None else None
+        context = current_token.set(token)
+        completed = False
+        try:
+            with anyio.CancelScope() as scope:
+                # Поток с запросом к модели прерывается закрытием сокета, а ожидание здесь — отменой scope
+                token.on_cancel(lambda: loop.call_soon_threadsafe(scope.cancel))
+                yield _Ticket(self, job_id, token)
+                completed = True
+            if not completed:
+                raise GenerationCancelled(token.reason)
+        except GenerationCancelled as e:
+            self.cancelled += 1
+            GENERATIONS_CANCELLED.inc(reason=e.reason)
+            logger.info("Генерация отменена", extra={"job_id": job_id, "reason": e.reason})
+            raise
+        finally:
+            current_token.reset(context)
+            if watcher is not None:
+                watcher.cancel()
+            self._tokens.pop(job_id, None)
+            self._local_jobs.pop(job_id, None)
+            # Задача, так и не дошедшая до модели (ошибка, отмена), снимается с очереди
+            await self._run(self._finish_sync, job_id, "cancelled")
+            self._notify()
+
+    async def cancel(self, job_id: int, user_id: Hashable, reason: str = "client") -> bool:
+        """Cancel an active job of the user in any worker; False if there is no such job."""
+        found = await self._run(self._cancel_sync, job_id, user_id)
+        token = self._tokens.get(job_id)
+        if found and token is not None:
+            token.cancel(reason)
+        if found:
+            self._notify()
+        return found
+
+    def jobs(self, user_id: Hashable) -> List[dict]:
+        """Active generation jobs of a user, oldest first."""
+        with closing(open_connection(self.db_path)) as conn:
+            rows = conn.execute(
+                f"""
+                SELECT id, status, created_at, started_at FROM generation_jobs
+                WHERE user_id = ? AND status IN {_ACTIVE} ORDER BY id
+                """,
+                (user_id,),
+            ).fetchall()
+        return [
+            {"job_id": job_id, "status": status, "created_at": created_at, "started_at": started_at}
+            for job_id, status, created_at, started_at in rows
+        ]
+
+    async def drain(self, timeout: float) -> int:
+        """Stop admitting work and wait for this worker's jobs; returns how many were left."""
+        self.draining = True
+        deadline = time.monotonic() + timeout
+        while self._local_jobs and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        left = list(self._local_jobs)
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        for job_id in left:
+            await self._run(self._finish_sync, job_id, "abandoned")
+        return len(left)
+
+    def idle(self) -> bool:
+        """No queued jobs and a free model slot: background work would not delay anyone."""
+        if self.draining:
+            return False
+        with closing(open_connection(self.db_path)) as conn:
+            running, queued = conn.execute(
+                """
+                SELECT COALESCE(SUM(status = 'running'), 0), COALESCE(SUM(status = 'queued'), 0)
+                FROM generation_jobs WHERE status IN ('queued', 'running')
+                """
+            ).fetchone()
+        return queued == 0 and running < self.max_in_flight
+
+    def stats(self) -> dict:
+        with closing(open_connection(self.db_path)) as conn:
+            counts = dict(
+                conn.execute(
+                    f"SELECT status, COUNT(*) FROM generation_jobs WHERE status IN {_ACTIVE} GROUP BY status"
+                ).fetchall()
+            )
+            users = conn.execute(
+                f"SELECT COUNT(DISTINCT user_id) FROM generation_jobs WHERE status IN {_ACTIVE}"
+            ).fetchone()[0]
+            avg_job_seconds = self._avg_job_seconds(conn)
+        return {
+            "running": counts.get("running", 0),
+            "queued": counts.get("queued", 0),
+            "max_in_flight": self.max_in_flight,
+            "users_active": users,
+            "worker": self.worker_id,
+            "worker_jobs": len(self._local_jobs),
+            "worker_rejected": self.rejected,
+            "worker_cancelled": self.cancelled,
+            "draining": self.draining,
+            "avg_job_seconds": round(avg_job_seconds, 2),
+        }
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def _changed_event(self) -> asyncio.Event:
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        return self._changed
+
+    def _notify(self):
+        # Будим всех ожидающих этого процесса и заводим новое событие
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    def _ensure_heartbeat(self):
+        if self._heartbeat_task is None or self._heartbeat_task.done():
+            self._heartbeat_task = asyncio.get_running_loop().create_task(self._heartbeat())
+
+    async def _watch_disconnect(self, receive, token: CancelToken):
+        try:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    token.cancel("disconnect")
+                    return
+        except Exception as e:
+            logger.debug("Не удалось следить за отключением клиента: %s", e)
+
+    async def _heartbeat(self):
+        beat_at = time.monotonic() + self.heartbeat_interval
+        while True:
+            await asyncio.sleep(self.cancel_poll_interval)
+            if self._tokens:
+                try:
+                    cancelled = await self._run(self._cancelled_sync, list(self._tokens))
+                except Exception as e:
+                    logger.warning("Не удалось проверить отмену задач генерации: %s", e)
+                    cancelled = []
+                for job_id in cancelled:
+                    token = self._tokens.get(job_id)
+                    if token is not None:
+                        token.cancel("client")
+            if time.monotonic() < beat_at:
+                continue
+            beat_at = time.monotonic() + self.heartbeat_interval
+            try:
+                expired = await self._run(self._heartbeat_sync, list(self._local_jobs))
+            except Exception as e:
+                logger.warning("Не удалось обновить heartbeat задач генерации: %s", e)
+                continue
+            if expired:
+                logger.info("Сняты брошенные задачи генерации: %s", expired)
+                self._notify()
+
+    async def _acquire(self, job_id: int):
+        await self._run(self._set_status_sync, job_id, "admitted", "queued")
+        self._local_jobs[job_id] = "queued"
+        while True:
+            changed = self._changed_event()
+            claimed = await self._run(self._try_claim_sync, job_id)
+            if claimed is None:
+                token = self._tokens.get(job_id)
+                if token is not None and (token.cancelled or await self._run(self._cancelled_sync, [job_id])):
+                    raise GenerationCancelled(token.reason or "client")
+                raise AdmissionRejected(
+                    "Задача генерации была снята с очереди, повторите запрос", 1
+                )
+            if claimed:
+                self._local_jobs[job_id] = "running"
+                return
+            try:
+                await asyncio.wait_for(changed.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _release(self, job_id: int, status: str):
+        await self._run(self._finish_sync, job_id, status)
+        if job_id in self._local_jobs:
+            self._local_jobs[job_id] = status
+        self._notify()
+
+    # --- Работа с базой, выполняется в потоках ---
+
+    def _avg_job_seconds(self, conn) -> float:
+        row = conn.execute(
+            """
+            SELECT AVG(finished_at - started_at) FROM (
+                SELECT started_at, finished_at FROM generation_jobs
+                WHERE status = 'done' ORDER BY id DESC LIMIT 20
+            )
+            """
+        ).fetchone()
+        return row[0] if row and row[0] is not None else self.expected_seconds
+
+    def _expire_stale(self, conn, now: float) -> int:
+        cursor = conn.execute(
+            f"""
+            UPDATE generation_jobs SET status = 'abandoned', finished_at = ?
+            WHERE status IN {_ACTIVE} AND heartbeat_at < ?
+            """,
+            (now, now - self.stale_after),
+        )
+        return cursor.rowcount
+
+    def _admit_sync(self, user_id: Hashable) -> int:
+        now = time.time()
+        with closing(open_connection(self.db_path)) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._expire_stale(conn, now)
+                active = conn.execute(
+                    f"SELECT COUNT(*) FROM generation_jobs WHERE user_id = ? AND status IN {_ACTIVE}",
+                    (user_id,),
+                ).fetchone()[0]
+                if active >= self.user_max_concurrent:
+                    raise AdmissionRejected(
+                        "Слишком много одновременных генераций, дождитесь завершения текущих",
+                        self._avg_job_seconds(conn),
+                    )
+                running, queued = conn.execute(
+                    """
+                    SELECT COALESCE(SUM(status = 'running'), 0), COALESCE(SUM(status = 'queued'), 0)
+                    FROM generation_jobs WHERE status IN ('queued', 'running')
+                    """
+                ).fetchone()
+                if running >= self.max_in_flight and queued >= self.max_queued:
+                    raise AdmissionRejected(
+                        "Сервер генерации перегружен, попробуйте позже",
+                        self._avg_job_seconds(conn) * (queued / self.max_in_flight + 1),
+                    )
+                row = conn.execute(
+                    "SELECT tokens, updated_at FROM rate_limits WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                tokens = self.user_burst
+                if row is not None:
+                    tokens = refill_tokens(
+                        row[0], row[1], now, self.user_burst, self.user_rate_per_second
+                    )
+                if tokens < 1:
+                    wait = (
+                        (1 - tokens) / self.user_rate_per_second
+                        if self.user_rate_per_second > 0
+                        else float("inf")
+                    )
+                    raise AdmissionRejected("Превышен лимит запросов на генерацию", min(wait, 3600))
+                conn.execute(
+                    "INSERT OR REPLACE INTO rate_limits (user_id, tokens, updated_at) VALUES (?, ?, ?)",
+                    (user_id, tokens - 1, now),
+                )
+                cursor = conn.execute(
+                    """
+                    INSERT INTO generation_jobs (user_id, status, worker, created_at, heartbeat_at)
+                    VALUES (?, 'admitted', ?, ?, ?)
+                    """,
+                    (user_id, self.worker_id, now, now),
+                )
+                conn.execute("COMMIT")
+                return cursor.lastrowid
+            finally:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+
+    def _set_status_sync(self, job_id: int, current: str, status: str):
+        with closing(open_connection(self.db_path)) as conn:
+            conn.execute(
+                "UPDATE generation_jobs SET status = ?, heartbeat_at = ? WHERE id = ? AND status = ?",
+                (status, time.time(), job_id, current),
+            )
+
+    def _finish_sync(self, job_id: int, status: str):
+        with closing(open_connection(self.db_path)) as conn:
+            conn.execute(
+                f"""
+                UPDATE generation_jobs SET status = ?, finished_at = ?
+                WHERE id = ? AND status IN {_ACTIVE}
+                """,
+                (status, time.time(), job_id),
+            )
+
+    def _cancel_sync(self, job_id: int, user_id: Hashable) -> bool:
+        with closing(open_connection(self.db_path)) as conn:
+            cursor = conn.execute(
+                f"""
+                UPDATE generation_jobs SET status = 'cancelled', finished_at = ?
+                WHERE id = ? AND user_id = ? AND status IN {_ACTIVE}
+                """,
+                (time.time(), job_id, user_id),
+            )
+            return cursor.rowcount > 0
+
+    def _cancelled_sync(self, job_ids) -> List[int]:
+        """Which of these jobs were cancelled through another worker."""
+        placeholders = ",".join("?" * len(job_ids))
+        with closing(open_connection(self.db_path)) as conn:
+            rows = conn.execute(
+                f"SELECT id FROM generation_jobs WHERE status = 'cancelled' AND id IN ({placeholders})",
+                list(job_ids),
+            ).fetchall()
+        return [job_id for (job_id,) in rows]
+
+    def _try_claim_sync(self, job_id: int) -> Optional[bool]:
+        """True if the job got a model slot, False to keep waiting, None if it is gone."""
+        with closing(open_connection(self.db_path)) as conn:
+            # Сначала дешёвая проверка без блокировки записи
+            status, running = conn.execute(
+                """
+                SELECT (SELECT status FROM generation_jobs WHERE id = ?),
+                       (SELECT COUNT(*) FROM generation_jobs WHERE status = 'running')
+                """,
+                (job_id,),
+            ).fetchone()
+            if status != "queued":
+                return None
+            if running >= self.max_in_flight:
+                return False
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                status, running = conn.execute(
+                    """
+                    SELECT (SELECT status FROM generation_jobs WHERE id = ?),
+                           (SELECT COUNT(*) FROM generation_jobs WHERE status = 'running')
+                    """,
+                    (job_id,),
+                ).fetchone()
+                if status != "queued":
+                    return None
+                if running >= self.max_in_flight:
+                    return False
+                next_job = conn.execute(_NEXT_QUEUED_SQL).fetchone()
+                if next_job is None or next_job[0] != job_id:
+                    return False
+                now = time.time()
+                conn.execute(
+                    """
+                    UPDATE generation_jobs SET status = 'running', started_at = ?, heartbeat_at = ?
+                    WHERE id = ?
+                    """,
+                    (now, now, job_id),
+                )
+                conn.execute("COMMIT")
+                return True
+            finally:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+
+    def _heartbeat_sync(self, job_ids) -> int:
+        now = time.time()
+        with closing(open_connection(self.db_path)) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.executemany(
+                    "UPDATE generation_jobs SET heartbeat_at = ? WHERE id = ?",
+                    [(now, job_id) for job_id in job_ids],
+                )
+                expired = self._expire_stale(conn, now)
+                conn.execute(
+                    f"DELETE FROM generation_jobs WHERE status NOT IN {_ACTIVE} AND created_at < ?",
+                    (now - GEN_HISTORY_SECONDS,),
+                )
+                # Полностью восстановившиеся бакеты хранить незачем
+                if self.user_rate_per_second > 0:
+                    conn.execute(
+                        "DELETE FROM rate_limits WHERE updated_at < ?",
+                        (now - self.user_burst / self.user_rate_per_second,),
+                    )
+                conn.execute("COMMIT")
+                return expired
+            finally:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+
+
+class _Ticket:
+    def __init__(self, controller: AdmissionController, job_id: int, token: CancelToken):
+        self._controller = controller
+        self.job_id = job_id
+        self.token = token
+
+    def cancel(self, reason: str = "client") -> bool:
+        return self.token.cancel(reason)
+
+    @asynccontextmanager
+    async def model_slot(self):
+        """Wait for a model-server slot, fairly shared between users and workers."""
+        await self._controller._acquire(self.job_id)
+        status = "failed"
+        try:
+            yield
+            status = "done"
+        finally:
+            if self.token.cancelled:
+                status = "cancelled"
+            # Слот освобождается и при отмене, иначе он занят до истечения heartbeat
+            with anyio.CancelScope(shield=True):
+                await self._controller._release(self.job_id, status)
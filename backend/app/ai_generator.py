@@ -1,62 +1,67 @@
 import json
-import os
-from datetime import datetime
-import requests
-from typing import Dict, Any
-import pdfkit
+import logging
+from typing import Dict, Any, Optional
+
+from .cancellation import GenerationCancelled
+from .llm import LLMError, extract_json_object
+from .logs import log_payload
+from .metrics import LLM_PARSE, LLM_REQUESTS, stage_timer
+from .passages import select_passages
+from .routing import ModelRouter, model_router
+
+logger = logging.getLogger(__name__)
 
 class QwenAIClient:
-    def __init__(self, base_url: str = "http://127.0.0.1:1234/v1"):
-        self.base_url = base_url
+    def __init__(self, router: Optional[ModelRouter] = None):
+        self.router = router or model_router
     
     def generate_course_content(self, video_title: str, transcript: str, video_description: str = "") -> dict:
         """Generate structured course content using Qwen3-VL-4B"""
         
-        # Ограничиваем длину транскрипта
-        truncated_transcript = transcript[:2500] if len(transcript) > 2500 else transcript
+        # Ограничиваем длину транскрипта, выбирая фрагменты по всему тексту
+        truncated_transcript = select_passages(transcript, 2500, query=video_title)
         
-        prompt = self._create_optimized_prompt(video_title, truncated_transcript, video_description)
+        with stage_timer("prompt"):
+            prompt = self._create_optimized_prompt(video_title, truncated_transcript, video_description)
+        import requests  # лениво: нужен только при обращении к модели
         
         try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                json={
-                    "model": "local-model",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": """Ты - эксперт по созданию образовательных курсов. 
-                            Твоя задача - создавать структурированные, информативные учебные материалы на русском языке.
-                            ВСЕГДА возвращай ПОЛНЫЙ ответ в формате JSON без обрезания.
-                            Убедись что JSON валидный и содержит все необходимые поля."""
-                        },
-                        {
-                            "role": "user", 
-                            "content": prompt
-                        }
-                    ],
-                    "max_tokens": 3000,  # Увеличили с 2000 до 3000
-                    "temperature": 0.5,  # Уменьшили температуру для более стабильного вывода
-                    "top_p": 0.9,
-                    "stream": False
-                },
-                timeout=120  # Увеличили таймаут
+            completion = self.router.chat(
+                "course",
+                [
+                    {
+                        "role": "system",
+                        "content": """Ты - эксперт по созданию образовательных курсов. 
+                        Твоя задача - создавать структурированные, информативные учебные материалы на русском языке.
+                        ВСЕГДА возвращай ПОЛНЫЙ ответ в формате JSON без обрезания.
+                        Убедись что JSON валидный и содержит все необходимые поля."""
+                    },
+                    {
+                        "role": "user", 
+                        "content": prompt
+                    }
+                ],
+                max_tokens=3000,  # Увеличили с 2000 до 3000
+                timeout=120,  # Увеличили таймаут
+                temperature=0.5,  # Уменьшили температуру для более стабильного вывода
+                top_p=0.9,
             )
-            
-            if response.status_code == 200:
-                return self._parse_ai_response(response.json(), video_title)
-            else:
-                print(f"❌ Ошибка API: {response.status_code}")
-                return self._get_fallback_content(video_title)
+            return self._parse_ai_response(completion.as_response(), video_title)
                 
+        except LLMError as e:
+            logger.error("Ошибка API модели: %s", e)
+            return self._get_fallback_content(video_title)
         except requests.exceptions.Timeout:
-            print("❌ Таймаут запроса к LM Studio")
+            logger.error("Таймаут запроса к LM Studio")
             return self._get_fallback_content(video_title)
         except requests.exceptions.ConnectionError:
-            print("❌ Не могу подключиться к LM Studio")
+            logger.error("Не могу подключиться к LM Studio")
             return self._get_fallback_content(video_title)
+        except GenerationCancelled:
+            raise
         except Exception as e:
-            print(f"❌ Неожиданная ошибка: {e}")
+            LLM_REQUESTS.inc(result="error")
+            logger.exception("Неожиданная ошибка генерации: %s", e)
             return self._get_fallback_content(video_title)
     
     def _create_optimized_prompt(self, video_title: str, transcript: str, description: str) -> str:
@@ -112,40 +117,33 @@ JSON ФОРМАТ:
         try:
             content = response_data["choices"][0]["message"]["content"]
             usage = response_data.get("usage", {})
-            print(f"📊 Использовано токенов: {usage.get('completion_tokens', 0)}")
+            logger.debug("Использовано токенов: %s", usage.get("completion_tokens", 0))
             
             # Очищаем ответ
             content = content.strip()
-            print(f"📝 Ответ ИИ (первые 500 символов): {content[:500]}...")
+            log_payload(logger, "Ответ ИИ", content, usage=usage)
             
-            # Ищем JSON в ответе
-            start_idx = content.find('{')
-            end_idx = content.rfind('}') + 1
+            # Ищем JSON в ответе, при необходимости чиним оборванный ответ
+            course_data, outcome = extract_json_object(content)
             
-            if start_idx != -1 and end_idx != 0:
-                json_str = content[start_idx:end_idx]
-                print(f"🔍 Найден JSON длиной: {len(json_str)} символов")
-                
-                try:
-                    course_data = json.loads(json_str)
-                    
-                    # Базовая валидация
-                    if self._validate_course_data(course_data):
-                        print("✅ Курс успешно создан с помощью Qwen3-VL-4B!")
-                        return course_data
-                    else:
-                        print("⚠️  JSON не прошел валидацию")
-                        
-                except json.JSONDecodeError as e:
-                    print(f"❌ Ошибка парсинга JSON: {e}")
-                    print(f"🔍 Проблемный JSON: {json_str[:200]}...")
+            if course_data is not None:
+                if self._validate_course_data(course_data):
+                    LLM_PARSE.inc(outcome=outcome)
+                    if outcome == "repaired":
+                        logger.info("Ответ модели починен при разборе JSON")
+                    logger.info("Курс успешно создан с помощью Qwen3-VL-4B", extra={"parse": outcome})
+                    return course_data
+                else:
+                    logger.warning("JSON не прошел валидацию")
             
             # Если JSON не найден или невалиден
-            print("⚠️  ИИ вернул некорректный формат, используем fallback")
+            LLM_PARSE.inc(outcome="fallback")
+            logger.warning("ИИ вернул некорректный формат, используем fallback")
             return self._get_fallback_content(video_title)
             
         except Exception as e:
-            print(f"❌ Ошибка обработки ответа: {e}")
+            LLM_PARSE.inc(outcome="fallback")
+            logger.exception("Ошибка обработки ответа модели: %s", e)
             return self._get_fallback_content(video_title)
     
     def _validate_course_data(self, course_data: dict) -> bool:
@@ -170,6 +168,8 @@ JSON ФОРМАТ:
         """Fallback content if AI fails"""
         return {
             "title": f"Курс: {video_title}",
+            # Шаблон, а не ответ модели: такой курс не годится как образец для копий
+            "is_fallback": True,
             "description": f"Автоматически сгенерированный курс на основе видео '{video_title}' с использованием Qwen3-VL-4B",
             "sections": [
                 {
@@ -208,15 +208,16 @@ JSON ФОРМАТ:
     
 def is_lm_studio_available():
     """Check if LM Studio is running"""
+    import requests
     try:
-        response = requests.get("http://127.0.0.1:1234/v1/models", timeout=10)
+        response = requests.get(f"{model_router.route('course').url}/models", timeout=10)
         if response.status_code == 200:
             models = response.json().get("data", [])
-            print(f"📋 Доступные модели в LM Studio: {[m['id'] for m in models]}")
+            logger.debug("Доступные модели в LM Studio: %s", [m["id"] for m in models])
             return True
         return False
     except Exception as e:
-        print(f"❌ Ошибка проверки LM Studio: {e}")
+        logger.warning("Ошибка проверки LM Studio: %s", e)
         return False
 
 # Основная функция генерации
@@ -224,98 +225,11 @@ def generate_course_content(video_title: str, transcript: str, video_description
     """Generate course content using Qwen2.5-4B via LM Studio"""
     
     if is_lm_studio_available():
-        print("🎯 Используем Qwen2.5-4B для создания курса...")
+        logger.info("Используем Qwen2.5-4B для создания курса")
         ai_client = QwenAIClient()
         return ai_client.generate_course_content(video_title, transcript, video_description)
     else:
-        print("⚠️  LM Studio недоступен, используем базовый шаблон")
+        LLM_REQUESTS.inc(result="unavailable")
+        logger.warning("LM Studio недоступен, используем базовый шаблон")
         ai_client = QwenAIClient()
         return ai_client._get_fallback_content(video_title)
-
-# Остальные функции (generate_pdf и т.д.) остаются без изменений
-def generate_pdf(course_content: dict, course_id: int) -> str:
-    """Generate PDF from course content"""
-    
-    # Create courses directory if not exists
-    os.makedirs("courses", exist_ok=True)
-    
-    # HTML template for PDF
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <title>{course_content['title']}</title>
-        <style>
-            body {{ font-family: Arial, sans-serif; line-height: 1.6; margin: 40px; }}
-            h1 {{ color: #2C3E50; border-bottom: 2px solid #a3ff00; }}
-            h2 {{ color: #2C3E50; margin-top: 30px; }}
-            .section {{ margin-bottom: 30px; }}
-            .key-points {{ background: #f8f9fa; padding: 15px; border-radius: 5px; }}
-            .quiz {{ border: 1px solid #ddd; padding: 15px; margin: 10px 0; }}
-        </style>
-    </head>
-    <body>
-        <h1>{course_content['title']}</h1>
-        <p><strong>Описание:</strong> {course_content['description']}</p>
-        <p><em>Сгенерировано с помощью Qwen2.5-4B: {datetime.now().strftime('%Y-%m-%d %H:%M')}</em></p>
-        
-        <div class="content">
-    """
-    
-    # Add sections
-    for i, section in enumerate(course_content.get('sections', []), 1):
-        html_content += f"""
-            <div class="section">
-                <h2>{i}. {section['title']}</h2>
-                <p>{section['content']}</p>
-                <div class="key-points">
-                    <h3>Ключевые моменты:</h3>
-                    <ul>
-                        {"".join(f'<li>{point}</li>' for point in section.get('key_points', []))}
-                    </ul>
-                </div>
-            </div>
-        """
-    
-    # Add quizzes
-    if course_content.get('quizzes'):
-        html_content += '<h2>Тесты для проверки знаний</h2>'
-        for i, quiz in enumerate(course_content['quizzes'], 1):
-            html_content += f"""
-                <div class="quiz">
-                    <h3>Вопрос {i}: {quiz['question']}</h3>
-                    <ol>
-                        {"".join(f'<li>{option}</li>' for option in quiz['options'])}
-                    </ol>
-                </div>
-            """
-    
-    # Add summary
-    if course_content.get('summary'):
-        html_content += f"""
-            <div class="section">
-                <h2>Итоговое резюме</h2>
-                <p>{course_content['summary']}</p>
-            </div>
-        """
-    
-    html_content += """
-        </div>
-    </body>
-    </html>
-    """
-    
-    # Generate PDF
-    pdf_path = f"courses/course_{course_id}.pdf"
-    
-    try:
-        # You'll need to install wkhtmltopdf for this to work
-        # On Ubuntu: sudo apt-get install wkhtmltopdf
-        pdfkit.from_string(html_content, pdf_path)
-    except:
-        # Fallback: create HTML file if PDF generation fails
-        with open(pdf_path.replace('.pdf', '.html'), 'w', encoding='utf-8') as f:
-            f.write(html_content)
-    
-    return pdf_path
\ No newline at end of file
@@ -1,38 +1,42 @@
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from . import models, database
+from . import models, database, passwords
+from .token_cache import TokenCache
 
 # Security
 SECRET_KEY = "your-secret-key-here-change-in-production"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
+token_cache = TokenCache()
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return passwords.get_pwd_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return passwords.get_pwd_context().hash(password)
 
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def authenticate_user(db: Session, email: str, password: str):
+async def authenticate_user(db: Session, email: str, password: str):
     user = get_user_by_email(db, email)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    password_ok, upgraded_hash = await passwords.verify_password_async(password, user.hashed_password)
+    if not password_ok:
         return False
+    if upgraded_hash:
+        user.hashed_password = upgraded_hash
+        db.commit()
     return user
 
-def create_user(db: Session, email: str, password: str, first_name: str, last_name: str):
-    hashed_password = get_password_hash(password)
+async def create_user(db: Session, email: str, password: str, first_name: str, last_name: str):
+    hashed_password = await passwords.hash_password_async(password)
     db_user = models.User(
         email=email,
         hashed_password=hashed_password,
@@ -42,6 +46,7 @@ def create_user(db: Session, email: str, password: str, first_name: str, last_na
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
+    token_cache.invalidate_user(email)
     return db_user
 
 def create_access_token(data: dict):
@@ -60,6 +65,10 @@ async def get_current_user(
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    cached_user = token_cache.get(token)
+    if cached_user is not None:
+        return _attach_cached_user(db, cached_user)
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -71,4 +80,15 @@ async def get_current_user(
     user = get_user_by_email(db, email=email)
     if user is None:
         raise credentials_exception
-    return user
\ No newline at end of file
+    token_cache.put(token, email, _user_snapshot(user), payload.get("exp"))
+    return user
+
+def _user_snapshot(user: models.User) -> dict:
+    """Plain column values, safe to keep after the session is closed"""
+    return {column.name: getattr(user, column.name) for column in models.User.__table__.columns}
+
+def _attach_cached_user(db: Session, snapshot: dict) -> models.User:
+    """Rebuild a cached user and attach it to the session without a SELECT"""
+    user = models.User(**snapshot)
+    make_transient_to_detached(user)
+    return db.merge(user, load=False)
\ No newline at end of file
@@ -0,0 +1,115 @@
+"""Cache invalidation shared between worker processes.
+
+У каждого воркера свои кеши в памяти (токены, экспорт). Когда данные
+меняются, воркер пишет запись в таблицу cache_invalidations, а все
+воркеры раз в CACHE_SYNC_INTERVAL секунд читают новые записи и
+сбрасывают у себя соответствующие ключи. Свой кеш сбрасывается сразу.
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import closing
+from typing import Callable, Dict, List, Optional
+
+from .write_batcher import open_connection
+
+logger = logging.getLogger(__name__)
+
+CACHE_SYNC_INTERVAL = float(os.getenv("CACHE_SYNC_INTERVAL", "1"))
+# Дольше этого записи не нужны: все живые воркеры их уже прочитали
+CACHE_SYNC_RETENTION = float(os.getenv("CACHE_SYNC_RETENTION", "3600"))
+
+
+class InvalidationLog:
+    def __init__(self, db_path: str, interval: float = CACHE_SYNC_INTERVAL):
+        self.db_path = db_path
+        self.interval = interval
+        self.published = 0
+        self.applied = 0
+        self._handlers: Dict[str, List[Callable[[str], None]]] = {}
+        self._last_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, cache: str, handler: Callable[[str], None]):
+        self._handlers.setdefault(cache, []).append(handler)
+
+    async def publish(self, cache: str, key):
+        """Invalidate ``key`` here right away and in other workers on their next poll."""
+        key = str(key)
+        self._apply(cache, key)
+        await asyncio.get_running_loop().run_in_executor(None, self._insert, cache, key)
+        self.published += 1
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            loop = asyncio.get_running_loop()
+            # Всё, что записано до старта воркера, к его пустым кешам не относится
+            self._last_id = await loop.run_in_executor(None, self._max_id)
+            self._task = loop.create_task(self._poll_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def poll(self) -> int:
+        rows = await asyncio.get_running_loop().run_in_executor(None, self._fetch)
+        for row_id, cache, key in rows:
+            self._apply(cache, key)
+            self._last_id = row_id
+        return len(rows)
+
+    def stats(self) -> dict:
+        return {
+            "published": self.published,
+            "applied": self.applied,
+            "last_id": self._last_id,
+            "interval": self.interval,
+        }
+
+    async def _poll_forever(self):
+        polls = 0
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+                polls += 1
+                if polls % 600 == 0:
+                    await asyncio.get_running_loop().run_in_executor(None, self._prune)
+            except Exception as e:
+                logger.warning("Ошибка синхронизации кешей: %s", e)
+
+    def _apply(self, cache: str, key: str):
+        for handler in self._handlers.get(cache, ()):
+            handler(key)
+        self.applied += 1
+
+    def _insert(self, cache: str, key: str):
+        with closing(open_connection(self.db_path)) as conn:
+            conn.execute(
+                "INSERT INTO cache_invalidations (cache, key, created_at) VALUES (?, ?, ?)",
+                (cache, key, time.time()),
+            )
+
+    def _max_id(self) -> int:
+        with closing(open_connection(self.db_path)) as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM cache_invalidations").fetchone()[0]
+
+    def _fetch(self):
+        with closing(open_connection(self.db_path)) as conn:
+            return conn.execute(
+                "SELECT id, cache, key FROM cache_invalidations WHERE id > ? ORDER BY id",
+                (self._last_id or 0,),
+            ).fetchall()
+
+    def _prune(self):
+        with closing(open_connection(self.db_path)) as conn:
+            conn.execute(
+                "DELETE FROM cache_invalidations WHERE created_at < ?",
+                (time.time() - CACHE_SYNC_RETENTION,),
+            )
@@ -0,0 +1,90 @@
+"""Cancellation of generations nobody waits for anymore.
+
+Каждая задача генерации получает CancelToken. Токен лежит в contextvar,
+а anyio копирует контекст в потоки пула, поэтому запрос к модели в
+run_in_threadpool видит токен своей задачи без передачи параметров.
+Отмена (клиент закрыл вкладку или вызвал DELETE /api/jobs/<id>)
+закрывает сокет текущего запроса к серверу модели — тот прекращает
+генерацию и освобождает слот сразу, а не через несколько минут.
+"""
+import logging
+import socket
+import threading
+from contextvars import ContextVar
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GenerationCancelled(Exception):
+    """The generation was cancelled by its client."""
+
+    def __init__(self, reason: str = "client"):
+        super().__init__(f"generation cancelled ({reason})")
+        self.reason = reason
+
+
+class CancelToken:
+    """Thread-safe cancellation flag with callbacks that abort blocking work."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str = "client") -> bool:
+        """Cancel once; returns False if the token was already cancelled."""
+        with self._lock:
+            if self.reason is not None:
+                return False
+            self.reason = reason
+            callbacks, self._callbacks = self._callbacks, []
+        self._event.set()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug("Ошибка при отмене задачи: %s", e)
+        return True
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Register a callback (run at once if already cancelled); returns a function that unregisters it."""
+        with self._lock:
+            if self.reason is None:
+                self._callbacks.append(callback)
+                return lambda: self._discard(callback)
+        callback()
+        return lambda: None
+
+    def wait(self, seconds: float) -> bool:
+        """Sleep up to ``seconds``; True if the token was cancelled meanwhile."""
+        return self._event.wait(seconds)
+
+    def check(self):
+        if self.reason is not None:
+            raise GenerationCancelled(self.reason)
+
+    def _discard(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+current_token: ContextVar[Optional[CancelToken]] = ContextVar("generation_cancel_token", default=None)
+
+
+def abort_socket(sock: socket.socket) -> Callable[[], None]:
+    """Callback that interrupts a thread blocked on ``sock``."""
+
+    def abort():
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # уже закрыт
+
+    return abort
@@ -0,0 +1,172 @@
+"""Near-duplicate source detection with MinHash and LSH.
+
+Тот же конспект, пересохранённый другим PDF-генератором, или повторно
+загруженное видео со слегка другими субтитрами дают почти тот же текст.
+По словесным шинглам текста считается MinHash-подпись, она делится на
+полосы (LSH), и ключи полос хранятся в SQLite рядом с курсами: индекс
+общий для воркеров и переживает перезапуск. Поиск — один запрос по
+индексу ключей и сравнение подписей нескольких кандидатов.
+
+Если параметры подписи поменять, старые записи просто перестанут
+находиться.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import time
+import zlib
+from contextlib import closing
+from typing import NamedTuple, Optional
+
+from .metrics import DEDUP_LOOKUPS, stage_timer
+
+try:
+    import numpy as np
+except ImportError:  # без numpy поиск дубликатов отключён
+    np = None
+
+# off — не искать, suggest — вернуть найденный курс клиенту, clone — сразу скопировать.
+# По умолчанию suggest: исправленная версия лекции похожа на старую, и молча
+# подставлять старый курс вместо новой генерации нельзя
+DEDUP_MODE = os.getenv("DEDUP_MODE", "suggest")
+DEDUP_MODES = ("off", "suggest", "clone")
+# user — искать только среди своих курсов, all — среди курсов всех пользователей
+# (чужие совпадения только сообщаются, без id и названия; копируются всегда только свои курсы)
+DEDUP_SCOPE = os.getenv("DEDUP_SCOPE", "user")
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.85"))
+DEDUP_MIN_WORDS = int(os.getenv("DEDUP_MIN_WORDS", "50"))
+DEDUP_SHINGLE_WORDS = int(os.getenv("DEDUP_SHINGLE_WORDS", "5"))
+DEDUP_PERMUTATIONS = int(os.getenv("DEDUP_PERMUTATIONS", "128"))
+# 16 полос по 8 строк: пары с похожестью от ~0.7 почти наверняка попадут в кандидаты
+DEDUP_BANDS = int(os.getenv("DEDUP_BANDS", "16"))
+
+_WORD_RE = re.compile(r"\w+")
+_MASK32 = 0xFFFFFFFF
+# Шинглы обрабатываются блоками, чтобы матрица блок x перестановки была небольшой
+_BLOCK = 4096
+
+
+class Duplicate(NamedTuple):
+    course_id: int
+    user_id: int
+    title: str
+    similarity: float
+
+
+class SourceIndex:
+    """MinHash signatures of course sources with an LSH lookup table in SQLite."""
+
+    def __init__(self, db_path: str, permutations: int = DEDUP_PERMUTATIONS, bands: int = DEDUP_BANDS):
+        if permutations % bands:
+            raise ValueError("permutations must be a multiple of bands")
+        self.db_path = db_path
+        self.permutations = permutations
+        self.bands = bands
+        self.rows = permutations // bands
+        self.lookups = 0
+        self.hits = 0
+        if np is not None:
+            # Фиксированное зерно: подписи сравниваются между процессами и перезапусками.
+            # Перестановки — multiply-shift: старшие 32 бита (a * x + b) mod 2**64, a нечётное
+            rng = np.random.default_rng(20240611)
+            self._a = rng.integers(0, 2**63, size=permutations, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+            self._b = rng.integers(0, 2**63, size=permutations, dtype=np.uint64)
+
+    def available(self) -> bool:
+        return np is not None
+
+    def signature(self, text: str) -> Optional[bytes]:
+        """MinHash of the text's word shingles, or None when the text is too short to compare."""
+        if np is None:
+            return None
+        with stage_timer("dedup_signature"):
+            return self._signature(text)
+
+    def _signature(self, text: str) -> Optional[bytes]:
+        words = _WORD_RE.findall(text.lower())
+        if len(words) < max(DEDUP_MIN_WORDS, DEDUP_SHINGLE_WORDS):
+            return None
+        codes = {word: zlib.crc32(word.encode("utf-8")) for word in set(words)}
+        hashes = np.fromiter(map(codes.__getitem__, words), dtype=np.uint64, count=len(words))
+        count = len(hashes) - DEDUP_SHINGLE_WORDS + 1
+        shingles = hashes[:count].copy()
+        for offset in range(1, DEDUP_SHINGLE_WORDS):
+            shingles = (shingles * np.uint64(1000003) + hashes[offset:offset + count]) & np.uint64(_MASK32)
+
+        minimum = np.full(self.permutations, _MASK32, dtype=np.uint64)
+        for start in range(0, len(shingles), _BLOCK):
+            block = shingles[start:start + _BLOCK, None]
+            values = (self._a * block + self._b) >> np.uint64(32)
+            np.minimum(minimum, values.min(axis=0), out=minimum)
+        return minimum.astype("<u4").tobytes()
+
+    def band_keys(self, signature: bytes):
+        """One signed 64-bit key per LSH band."""
+        width = self.rows * 4
+        return [
+            int.from_bytes(
+                hashlib.blake2b(bytes([band]) + signature[band * width:(band + 1) * width], digest_size=8).digest(),
+                "big",
+                signed=True,
+            )
+            for band in range(self.bands)
+        ]
+
+    def find(self, signature: bytes, user_id: Optional[int] = None) -> Optional[Duplicate]:
+        """Most similar stored course above DEDUP_THRESHOLD; user_id limits the search to one owner."""
+        keys = self.band_keys(signature)
+        placeholders = ",".join("?" * len(keys))
+        query = f"""
+            SELECT s.course_id, s.signature, c.user_id, c.title
+            FROM source_signatures s JOIN courses c ON c.id = s.course_id
+            WHERE s.course_id IN (SELECT course_id FROM source_lsh WHERE key IN ({placeholders}))
+        """
+        params = list(keys)
+        if user_id is not None:
+            query += " AND c.user_id = ?"
+            params.append(user_id)
+        with stage_timer("dedup_lookup"):
+            with closing(sqlite3.connect(self.db_path)) as conn:
+                candidates = conn.execute(query, params).fetchall()
+            best = None
+            mine = np.frombuffer(signature, dtype="<u4")
+            for course_id, stored, owner, title in candidates:
+                if len(stored) != len(signature):
+                    continue
+                similarity = float(np.mean(np.frombuffer(stored, dtype="<u4") == mine))
+                if similarity >= DEDUP_THRESHOLD and (best is None or similarity > best.similarity):
+                    best = Duplicate(course_id, owner, title, round(similarity, 3))
+        self.lookups += 1
+        self.hits += best is not None
+        DEDUP_LOOKUPS.inc(result="hit" if best else "miss")
+        return best
+
+    def add_statements(self, course_id: int, signature: bytes):
+        """(sql, params) pairs that index a stored course; run them through the shared writer."""
+        keys = self.band_keys(signature)
+        return [
+            (
+                "INSERT OR REPLACE INTO source_signatures (course_id, signature, created_at) VALUES (?, ?, ?)",
+                (course_id, signature, time.time()),
+            ),
+            (
+                "INSERT INTO source_lsh (key, course_id) VALUES " + ",".join("(?, ?)" for _ in keys),
+                [value for key in keys for value in (key, course_id)],
+            ),
+        ]
+
+    def remove(self, conn: sqlite3.Connection, course_id: int):
+        """Drop a deleted course from the index inside the caller's transaction."""
+        conn.execute("DELETE FROM source_lsh WHERE course_id = ?", (course_id,))
+        conn.execute("DELETE FROM source_signatures WHERE course_id = ?", (course_id,))
+
+    def stats(self) -> dict:
+        return {
+            "available": self.available(),
+            "mode": DEDUP_MODE,
+            "scope": DEDUP_SCOPE,
+            "threshold": DEDUP_THRESHOLD,
+            "lookups": self.lookups,
+            "hits": self.hits,
+        }
@@ -0,0 +1,179 @@
+"""HTML export of a course.
+
+Шаблон компилируется один раз, значения экранируются автоматически, а
+готовый HTML кешируется по (id курса, версия содержимого), так что
+повторное скачивание не требует повторного рендера.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Optional, Tuple
+from urllib.parse import quote
+
+from .metrics import stage_timer
+from .profiling import profiled_thread
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "templates")
+# Меняйте при правке шаблона, чтобы сбросить ETag у клиентов
+TEMPLATE_VERSION = "1"
+EXPORT_CACHE_MAX_ENTRIES = int(os.getenv("EXPORT_CACHE_MAX_ENTRIES", "256"))
+
+_env = None
+_env_lock = threading.Lock()
+
+
+def _template_env():
+    # jinja2 импортируется при первом экспорте, а не при старте сервера
+    global _env
+    with _env_lock:
+        if _env is None:
+            from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+            _env = Environment(
+                loader=FileSystemLoader(TEMPLATE_DIR),
+                autoescape=select_autoescape(["html"]),
+                trim_blocks=True,
+                lstrip_blocks=True,
+                auto_reload=False,
+            )
+        return _env
+
+
+def parse_course_content(raw_content: Any, course_title: str) -> dict:
+    """Stored content is a JSON string; fall back to a stub if it is broken"""
+    if isinstance(raw_content, dict):
+        return raw_content
+    try:
+        content = json.loads(raw_content)
+        if isinstance(content, dict):
+            return content
+    except (TypeError, ValueError):
+        pass
+    return {
+        "title": course_title,
+        "description": "Автоматически сгенерированный курс",
+        "sections": [],
+        "summary": "Курс создан на основе видео материала",
+    }
+
+
+def _as_list(value: Any) -> list:
+    return value if isinstance(value, list) else []
+
+
+def _normalize(content: dict, course_title: str) -> dict:
+    """Give the template a predictable shape whatever the model returned"""
+    sections = []
+    for section in _as_list(content.get("sections")):
+        if not isinstance(section, dict):
+            section = {"content": str(section)}
+        sections.append(
+            {
+                "title": section.get("title"),
+                "content": section.get("content"),
+                "key_points": _as_list(section.get("key_points")),
+            }
+        )
+    quizzes = []
+    for quiz in _as_list(content.get("quizzes")):
+        if not isinstance(quiz, dict):
+            continue
+        quizzes.append(
+            {"question": quiz.get("question"), "options": _as_list(quiz.get("options"))}
+        )
+    return {
+        "title": content.get("title") or course_title,
+        "description": content.get("description") or "Автоматически сгенерированный курс",
+        "sections": sections,
+        "quizzes": quizzes,
+        "summary": content.get("summary"),
+    }
+
+
+def render_course_html(
+    course_content: dict, course_title: str = "", generated_at: Optional[str] = None
+) -> str:
+    template = _template_env().get_template("course_export.html")
+    return template.render(
+        course=_normalize(course_content, course_title),
+        generated_at=generated_at or datetime.now().strftime("%Y-%m-%d %H:%M"),
+    )
+
+
+def render_stored_course(title: str, raw_content: Any, created_at: Any) -> str:
+    """Render a course exactly as it is stored in the courses table"""
+    return render_course_html(
+        parse_course_content(raw_content, title),
+        title,
+        generated_at=str(created_at)[:16] if created_at else None,
+    )
+
+
+def content_version(*parts: Any) -> str:
+    digest = hashlib.blake2b(digest_size=12)
+    digest.update(TEMPLATE_VERSION.encode())
+    for part in parts:
+        if isinstance(part, (dict, list)):
+            part = json.dumps(part, ensure_ascii=False, sort_keys=True)
+        digest.update(b"\x00")
+        digest.update(str(part).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def attachment_header(filename: str) -> str:
+    """Content-Disposition that survives non-ASCII course titles"""
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+class ExportCache:
+    """LRU of rendered exports keyed by (course id, content version)."""
+
+    def __init__(self, max_entries: int = EXPORT_CACHE_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, Tuple[str, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def etag_for(self, course_id: int, title: str, raw_content: Any, created_at: Any) -> str:
+        return '"%s"' % content_version(course_id, title, raw_content, created_at)
+
+    @profiled_thread
+    def get_or_render(
+        self, course_id: int, title: str, raw_content: Any, created_at: Any
+    ) -> Tuple[str, bytes]:
+        etag = self.etag_for(course_id, title, raw_content, created_at)
+        with self._lock:
+            entry = self._entries.get(course_id)
+            if entry is not None and entry[0] == etag:
+                self._entries.move_to_end(course_id)
+                self.hits += 1
+                return entry
+        self.misses += 1
+        with stage_timer("export_render"):
+            body = render_stored_course(title, raw_content, created_at).encode("utf-8")
+        with self._lock:
+            self._entries[course_id] = (etag, body)
+            self._entries.move_to_end(course_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return etag, body
+
+    def invalidate(self, course_id: int):
+        with self._lock:
+            self._entries.pop(course_id, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
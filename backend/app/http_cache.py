@@ -0,0 +1,44 @@
+"""Validators for conditional GET (ETag / If-None-Match)."""
+import hashlib
+from typing import Any, Optional
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from .fast_json import JSONResponse
+
+
+def strong_etag(data: bytes) -> str:
+    return '"%s"' % hashlib.blake2b(data, digest_size=12).hexdigest()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison as required for If-None-Match (RFC 9110, 13.1.2)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/").strip('"')
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag.removeprefix("W/").strip('"') == bare for tag in candidates)
+
+
+def not_modified(request: Request, etag: str, cache_control: str = "private, no-cache") -> Optional[Response]:
+    """304 response if the client already has ``etag``, otherwise None."""
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+    return None
+
+
+def json_response_with_etag(
+    request: Request, content: Any, cache_control: str = "private, no-cache"
+) -> Response:
+    """JSON response validated by a hash of its own body."""
+    response = JSONResponse(content)
+    etag = strong_etag(response.body)
+    cached = not_modified(request, etag, cache_control)
+    if cached is not None:
+        return cached
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+    return response
@@ -0,0 +1,224 @@
+"""Streaming chat completions against the OpenAI-compatible model server.
+
+Ответ читается потоком (SSE), поэтому видно время до первого токена и
+скорость генерации; числа попадают в метрики. Здесь же — извлечение JSON
+курса из ответа модели с починкой типичных поломок (markdown-обёртка,
+текст вокруг JSON, оборванный по max_tokens ответ).
+"""
+import functools
+import json
+import os
+import time
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from .cancellation import CancelToken, GenerationCancelled, abort_socket, current_token
+from .metrics import LLM_REQUESTS, LLM_TOKENS, LLM_TOKENS_PER_SECOND, STAGE_SECONDS
+
+LLM_API_URL = os.getenv("QWEN_API_URL", "http://127.0.0.1:1234/v1")
+
+
+class LLMError(Exception):
+    """The model server answered with an error status or a malformed stream."""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class Completion(NamedTuple):
+    text: str
+    usage: Dict[str, Any]
+    ttft: Optional[float]
+    total: float
+    finish_reason: Optional[str]
+
+    def as_response(self) -> dict:
+        """Same shape as a non-streaming /chat/completions response."""
+        return {
+            "choices": [{"message": {"content": self.text}, "finish_reason": self.finish_reason}],
+            "usage": self.usage,
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def _abortable_pools() -> dict:
+    """urllib3 pool classes whose connections register their socket with the current CancelToken."""
+    from urllib3.connection import HTTPConnection, HTTPSConnection
+    from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+    def abortable(connection_cls):
+        class AbortableConnection(connection_cls):
+            def connect(self):
+                super().connect()
+                token = current_token.get()
+                if token is not None:
+                    token.on_cancel(abort_socket(self.sock))
+
+        return AbortableConnection
+
+    class Pool(HTTPConnectionPool):
+        ConnectionCls = abortable(HTTPConnection)
+
+    class SecurePool(HTTPSConnectionPool):
+        ConnectionCls = abortable(HTTPSConnection)
+
+    return {"http": Pool, "https": SecurePool}
+
+
+def _session(token: Optional[CancelToken]):
+    import requests
+
+    session = requests.Session()
+    if token is not None:
+        # Отмена закрывает сокет даже до заголовков ответа, пока сервер читает промпт
+        adapter = requests.adapters.HTTPAdapter()
+        adapter.poolmanager.pool_classes_by_scheme = _abortable_pools()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+    return session
+
+
+def stream_chat(base_url: str, payload: dict, timeout: float) -> Completion:
+    """POST /chat/completions with stream=True and collect the answer.
+
+    ``timeout`` limits the whole generation, not only the wait for each chunk.
+    Network errors are raised as the usual ``requests`` exceptions; a request
+    aborted through the current CancelToken raises GenerationCancelled.
+    """
+    import requests
+
+    token = current_token.get()
+    if token is not None:
+        token.check()
+    body = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+    started = time.perf_counter()
+    deadline = started + timeout
+    ttft = None
+    parts = []
+    usage: Dict[str, Any] = {}
+    finish_reason = None
+    chunks = 0
+    try:
+        with _session(token) as session, session.post(
+            f"{base_url}/chat/completions", json=body, stream=True, timeout=(5, timeout)
+        ) as response:
+            if response.status_code != 200:
+                raise LLMError(f"HTTP {response.status_code}", status=response.status_code)
+            for line in response.iter_lines():
+                if token is not None and token.cancelled:
+                    break
+                if time.perf_counter() > deadline:
+                    raise requests.exceptions.Timeout(f"generation exceeded {timeout} s")
+                if not line or not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                try:
+                    event = json.loads(data)
+                except ValueError:
+                    raise LLMError("malformed stream chunk")
+                if event.get("usage"):
+                    usage = event["usage"]
+                for choice in event.get("choices") or ():
+                    delta = choice.get("delta") or {}
+                    text = delta.get("content")
+                    if text:
+                        if ttft is None:
+                            ttft = time.perf_counter() - started
+                        parts.append(text)
+                        chunks += 1
+                    if choice.get("finish_reason"):
+                        finish_reason = choice["finish_reason"]
+        # Закрытый при отмене сокет может выглядеть как обычный конец потока
+        if token is not None:
+            token.check()
+    except GenerationCancelled:
+        LLM_REQUESTS.inc(result="cancelled")
+        raise
+    except (LLMError, requests.exceptions.RequestException) as e:
+        if token is not None and token.cancelled:
+            LLM_REQUESTS.inc(result="cancelled")
+            raise GenerationCancelled(token.reason) from None
+        if isinstance(e, LLMError):
+            LLM_REQUESTS.inc(result="http_error")
+        elif isinstance(e, requests.exceptions.Timeout):
+            LLM_REQUESTS.inc(result="timeout")
+        elif isinstance(e, requests.exceptions.ConnectionError):
+            LLM_REQUESTS.inc(result="connection_error")
+        raise
+    total = time.perf_counter() - started
+    LLM_REQUESTS.inc(result="ok")
+    STAGE_SECONDS.observe(total, stage="llm_total")
+    if ttft is not None:
+        STAGE_SECONDS.observe(ttft, stage="llm_ttft")
+    # Без usage в потоке считаем по чанкам: обычно один чанк — один токен
+    completion_tokens = usage.get("completion_tokens") or chunks
+    if usage.get("prompt_tokens"):
+        LLM_TOKENS.inc(usage["prompt_tokens"], kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, kind="completion")
+    if ttft is not None and total - ttft > 0 and completion_tokens > 1:
+        LLM_TOKENS_PER_SECOND.observe((completion_tokens - 1) / (total - ttft))
+    return Completion("".join(parts), usage, ttft, total, finish_reason)
+
+
+def _close_truncated(text: str) -> Optional[str]:
+    """Close strings and brackets of a JSON document cut off mid-way."""
+    stack = []
+    in_string = False
+    escaped = False
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]":
+            if not stack:
+                return None
+            stack.pop()
+    if not stack and not in_string:
+        return None
+    repaired = text + ('"' if in_string else "")
+    repaired = repaired.rstrip().rstrip(",")
+    if repaired.endswith(":"):
+        repaired += " null"
+    return repaired + "".join(reversed(stack))
+
+
+def extract_json_object(text: str) -> Tuple[Optional[dict], str]:
+    """Parse the model answer; returns (data, outcome) with outcome ok/repaired/fallback."""
+    text = (text or "").strip()
+    try:
+        data = json.loads(text)
+        if isinstance(data, dict):
+            return data, "ok"
+    except ValueError:
+        pass
+    start = text.find("{")
+    if start == -1:
+        return None, "fallback"
+    end = text.rfind("}") + 1
+    if end > start:
+        try:
+            data = json.loads(text[start:end])
+            if isinstance(data, dict):
+                return data, "repaired"
+        except ValueError:
+            pass
+    # Ответ оборван по max_tokens: закрываем строки и скобки
+    closed = _close_truncated(text[start:])
+    if closed is not None:
+        try:
+            data = json.loads(closed)
+            if isinstance(data, dict):
+                return data, "repaired"
+        except ValueError:
+            pass
+    return None, "fallback"
@@ -0,0 +1,218 @@
+"""Structured logging through a background queue.
+
+Обработчик в горячем пути только кладёт запись в ограниченную очередь;
+форматирование и запись в stdout делает отдельный поток. Если очередь
+переполнена, запись отбрасывается, а не блокирует event loop. К каждой
+записи добавляется request_id текущего запроса (contextvar переживает
+run_in_threadpool, поэтому виден и на этапах генерации). Большие
+payload-логи (ответы модели) пишутся на уровне DEBUG и только для доли
+запросов LOG_PAYLOAD_SAMPLE_RATE.
+"""
+import atexit
+import contextvars
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import uuid
+from logging.handlers import QueueListener
+from typing import Any, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json — для сборщиков логов, text — для чтения в консоли
+LOG_FORMAT = os.getenv(
+    "LOG_FORMAT", "text" if os.getenv("COURSEGEN_ENV") == "development" else "json"
+)
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", "2000"))
+# LOG_LEVEL относится к логгерам приложения; библиотеки не ниже INFO
+APP_LOGGERS = ("coursegen", "backend")
+
+request_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+# Стандартные атрибуты LogRecord; всё остальное из extra= попадает в поля
+_RESERVED = set(logging.LogRecord("", 0, "", 0, "", (), None).__dict__) | {"message", "asctime", "request_id"}
+
+
+def _fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in record.__dict__.items() if key not in _RESERVED}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+            "pid": record.process,
+        }
+        entry.update(_fields(record))
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s [%(request_id)s] %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class AsyncQueueHandler(logging.Handler):
+    """Puts records on a bounded queue; a listener thread writes them out.
+
+    Поток-писатель запускается при первой записи в каждом процессе: после
+    fork (gunicorn с preload) потоки родителя в воркере не существуют.
+    """
+
+    def __init__(self, target: logging.Handler, maxsize: int = LOG_QUEUE_SIZE):
+        super().__init__()
+        self.target = target
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._pid: Optional[int] = None
+        self._queue: Optional[queue.Queue] = None
+        self._listener: Optional[QueueListener] = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self) -> queue.Queue:
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._start_lock:
+                if self._pid != pid:
+                    # Очередь родителя (и её содержимое) в воркере не нужна
+                    self._queue = queue.Queue(self.maxsize)
+                    self._listener = QueueListener(self._queue, self.target)
+                    self._listener.start()
+                    self._pid = pid
+        return self._queue
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            record.request_id = request_id_var.get()
+            # Аргументы подставляем сразу: объекты могут измениться до записи
+            record.msg = record.getMessage()
+            record.args = None
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+            self._ensure_listener().put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    def stop(self):
+        """Flush queued records; called on worker shutdown."""
+        with self._start_lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+
+_handler: Optional[AsyncQueueHandler] = None
+
+
+def configure_logging(level: str = LOG_LEVEL, fmt: str = LOG_FORMAT) -> AsyncQueueHandler:
+    """Install the queue handler on the root logger (idempotent)."""
+    global _handler
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)
+        _handler.stop()
+    stream = logging.StreamHandler()
+    stream.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+    _handler = AsyncQueueHandler(stream)
+    root.addHandler(_handler)
+    levelno = logging.getLevelName(level.upper()) if isinstance(level, str) else level
+    if not isinstance(levelno, int):
+        # Неизвестное имя уровня: getLevelName вернул строку "Level ...", сервер всё равно должен стартовать
+        levelno = logging.INFO
+        logging.getLogger(__name__).warning("Неизвестный LOG_LEVEL %r, используется INFO", level)
+    root.setLevel(max(levelno, logging.INFO))
+    for name in APP_LOGGERS:
+        logging.getLogger(name).setLevel(levelno)
+    return _handler
+
+
+def shutdown_logging():
+    if _handler is not None:
+        _handler.stop()
+
+
+# Дописываем очередь при обычном завершении процесса
+atexit.register(shutdown_logging)
+
+
+def stats() -> dict:
+    if _handler is None:
+        return {"configured": False}
+    return {
+        "configured": True,
+        "level": logging.getLevelName(logging.getLogger(APP_LOGGERS[0]).level),
+        "queued": _handler._queue.qsize() if _handler._queue is not None else 0,
+        "dropped": _handler.dropped,
+        "payload_sample_rate": LOG_PAYLOAD_SAMPLE_RATE,
+    }
+
+
+def log_payload(logger: logging.Logger, message: str, payload: Any, **fields):
+    """DEBUG log of a large payload for a sampled fraction of calls."""
+    if not logger.isEnabledFor(logging.DEBUG) or random.random() >= LOG_PAYLOAD_SAMPLE_RATE:
+        return
+    text = payload if isinstance(payload, str) else repr(payload)
+    if len(text) > LOG_PAYLOAD_MAX_CHARS:
+        fields["payload_chars"] = len(text)
+        text = text[:LOG_PAYLOAD_MAX_CHARS]
+    logger.debug(message, extra={**fields, "payload": text})
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class RequestIdMiddleware:
+    """Binds X-Request-ID (or a fresh id) to the request and echoes it back."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = None
+        for name, value in scope.get("headers", ()):
+            if name == b"x-request-id":
+                # Чужой id берём только если он короткий и печатный
+                candidate = value.decode("latin-1")
+                if 0 < len(candidate) <= 64 and candidate.isprintable():
+                    request_id = candidate
+                break
+        request_id = request_id or new_request_id()
+        token = request_id_var.set(request_id)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", request_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_id_var.reset(token)
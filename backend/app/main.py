@@ -1,17 +1,19 @@
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse,FileResponse 
+from fastapi.responses import FileResponse,Response
 from sqlalchemy.orm import Session
 from typing import List
 import os
 
-from . import models, database, auth, youtube, ai_generator
+from . import models, database, auth, youtube, ai_generator, export
 from .models import User, Course
 from .auth import get_current_user, create_access_token
 from .database import get_db
+from .pdf_renderer import PdfRenderer, PdfUnavailable
+from .fast_json import JSONResponse
 
-app = FastAPI(title="CourseGen API", version="1.0.0")
+app = FastAPI(title="CourseGen API", version="1.0.0", default_response_class=JSONResponse)
 
 # CORS middleware
 app.add_middleware(
@@ -29,6 +31,12 @@ app.mount("/static", StaticFiles(directory=static_dir), name="static")
 # Create database tables
 models.Base.metadata.create_all(bind=database.engine)
 
+pdf_renderer = PdfRenderer()
+
+@app.on_event("shutdown")
+async def stop_pdf_renderer():
+    pdf_renderer.shutdown()
+
 @app.post("/api/register", response_model=dict)
 async def register(
     email: str,
@@ -47,7 +55,7 @@ async def register(
         )
     
     # Create user
-    user = auth.create_user(db, email, password, first_name, last_name)
+    user = await auth.create_user(db, email, password, first_name, last_name)
     
     # Generate token
     access_token = create_access_token(data={"sub": user.email})
@@ -68,7 +76,7 @@ async def login(
     db: Session = Depends(get_db)
 ):
     """Вход пользователя"""
-    user = auth.authenticate_user(db, email, password)
+    user = await auth.authenticate_user(db, email, password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -121,8 +129,11 @@ async def generate_course(
         db.commit()
         db.refresh(course)
         
-        # Generate PDF
-        pdf_path = ai_generator.generate_pdf(course_content, course.id)
+        # PDF рендерится в фоне, скачивание дождётся готового файла
+        try:
+            pdf_renderer.schedule(course.id, course.title, course.content, course.created_at)
+        except PdfUnavailable:
+            pass
         
         return {
             "success": True,
@@ -197,10 +208,15 @@ async def get_course_pdf(
             detail="Course not found"
         )
     
-    pdf_path = f"courses/course_{course_id}.pdf"
-    
-    if not os.path.exists(pdf_path):
-        pdf_path = ai_generator.generate_pdf(course.content, course_id)
+    try:
+        pdf_path = await pdf_renderer.get(course.id, course.title, course.content, course.created_at)
+    except PdfUnavailable:
+        html = export.render_stored_course(course.title, course.content, course.created_at)
+        return Response(
+            html,
+            media_type="text/html",
+            headers={"Content-Disposition": export.attachment_header(f"{course.title}.html")}
+        )
     
     return FileResponse(
         pdf_path,
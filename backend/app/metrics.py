@@ -0,0 +1,349 @@
+"""Prometheus-style metrics: request latency per route and pipeline stages.
+
+Счётчики и гистограммы живут в памяти воркера. Каждый воркер раз в
+METRICS_FLUSH_SECONDS сбрасывает снимок в METRICS_DIR, а /metrics
+складывает снимки всех воркеров, так что при нескольких процессах
+цифры не зависят от того, какой воркер ответил на запрос.
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+# Снимки воркеров, которые давно не обновлялись, больше не учитываются
+METRICS_STALE_SECONDS = float(os.getenv("METRICS_STALE_SECONDS", "300"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Этапы генерации длятся от миллисекунд (промпт) до минут (модель)
+STAGE_BUCKETS = (0.001, 0.005, 0.025, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+TOKENS_PER_SECOND_BUCKETS = (1, 2.5, 5, 10, 20, 30, 50, 75, 100, 150, 250, 500)
+
+LabelValues = Tuple[str, ...]
+# Разделитель значений меток в ключах снимка
+_SEP = "\x1f"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(label, "")) for label in self.labels)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {_SEP.join(key): value for key, value in self._values.items()}
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [счётчики по корзинам..., +Inf, сумма]
+        self._values: Dict[LabelValues, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {_SEP.join(key): list(series) for key, series in self._values.items()}
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def render(self, snapshots: Iterable[dict], gauges: Iterable[Tuple[str, str, float]] = ()) -> str:
+        """Prometheus text format of the sum of ``snapshots`` plus point-in-time gauges."""
+        merged = _merge(snapshots)
+        lines: List[str] = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(merged.get(name, {}).items()):
+                label_values = key.split(_SEP) if metric.labels else []
+                labels = list(zip(metric.labels, label_values))
+                if isinstance(metric, Histogram):
+                    cumulative = 0.0
+                    for bound, count in zip(metric.buckets, value):
+                        cumulative += count
+                        lines.append(_sample(f"{name}_bucket", labels + [("le", _number(bound))], cumulative))
+                    cumulative += value[len(metric.buckets)]
+                    lines.append(_sample(f"{name}_bucket", labels + [("le", "+Inf")], cumulative))
+                    lines.append(_sample(f"{name}_sum", labels, value[-1]))
+                    lines.append(_sample(f"{name}_count", labels, cumulative))
+                else:
+                    lines.append(_sample(name, labels, value))
+        for name, help_text, value in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(_sample(name, [], value))
+        return "\n".join(lines) + "\n"
+
+
+def _merge(snapshots: Iterable[dict]) -> dict:
+    merged: Dict[str, dict] = {}
+    for snapshot in snapshots:
+        for name, series in snapshot.items():
+            target = merged.setdefault(name, {})
+            for key, value in series.items():
+                if isinstance(value, list):
+                    current = target.get(key)
+                    target[key] = value[:] if current is None else [a + b for a, b in zip(current, value)]
+                else:
+                    target[key] = target.get(key, 0.0) + value
+    return merged
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _sample(name: str, labels: List[Tuple[str, str]], value: float) -> str:
+    if labels:
+        rendered = ",".join(f'{key}="{_escape(val)}"' for key, val in labels)
+        return f"{name}{{{rendered}}} {_number(value)}"
+    return f"{name} {_number(value)}"
+
+
+registry = Registry()
+
+HTTP_REQUESTS = registry.counter(
+    "coursegen_http_requests_total", "HTTP requests by route and status", ("method", "route", "status")
+)
+HTTP_LATENCY = registry.histogram(
+    "coursegen_http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+)
+STAGE_SECONDS = registry.histogram(
+    "coursegen_stage_duration_seconds",
+    "Course pipeline stage durations (transcript, pdf_extract, dedup_signature, dedup_lookup, passage_select, prompt, llm_ttft, llm_total, db_write, db_read, export_render, pdf_render)",
+    ("stage",),
+    STAGE_BUCKETS,
+)
+LLM_REQUESTS = registry.counter(
+    "coursegen_llm_requests_total", "Model server requests by result", ("result",)
+)
+LLM_TOKENS = registry.counter(
+    "coursegen_llm_tokens_total", "Tokens reported by the model server", ("kind",)
+)
+LLM_TOKENS_PER_SECOND = registry.histogram(
+    "coursegen_llm_tokens_per_second",
+    "Completion tokens per second after the first token",
+    (),
+    TOKENS_PER_SECOND_BUCKETS,
+)
+LLM_PARSE = registry.counter(
+    "coursegen_llm_parse_total", "Course JSON parse outcome (ok, repaired, model_repaired, fallback)", ("outcome",)
+)
+LLM_ROUTE_REQUESTS = registry.counter(
+    "coursegen_llm_route_requests_total",
+    "Model requests by task and route (ok, error, fallback = answered as a fallback route, hedge = answered a hedged request)",
+    ("task", "route", "result"),
+)
+LLM_ROUTE_SECONDS = registry.histogram(
+    "coursegen_llm_route_duration_seconds",
+    "Successful model request duration by task and route",
+    ("task", "route"),
+    STAGE_BUCKETS,
+)
+LLM_RETRIES = registry.counter(
+    "coursegen_llm_retries_total", "Retries of transient model errors by task and route", ("task", "route")
+)
+LLM_HEDGES = registry.counter(
+    "coursegen_llm_hedges_total",
+    "Hedged model requests by outcome (won = the hedge answered first, lost = the primary did, failed)",
+    ("task", "outcome"),
+)
+GENERATIONS_CANCELLED = registry.counter(
+    "coursegen_generations_cancelled_total", "Generation jobs cancelled by reason (disconnect, client)", ("reason",)
+)
+COURSE_UPGRADES = registry.counter(
+    "coursegen_course_upgrades_total",
+    "Background upgrades of template courses (upgraded, retry, deferred, gave_up)",
+    ("result",),
+)
+DEDUP_LOOKUPS = registry.counter(
+    "coursegen_dedup_lookups_total", "Near-duplicate source lookups (hit, miss)", ("result",)
+)
+
+
+def stage_timer(stage: str):
+    """``with stage_timer("pdf_extract"): ...`` records the block duration."""
+    return STAGE_SECONDS.time(stage=stage)
+
+
+class SnapshotStore:
+    """Per-worker snapshot files so /metrics can sum all worker processes."""
+
+    def __init__(self, directory: str = METRICS_DIR, interval: float = METRICS_FLUSH_SECONDS):
+        self.directory = directory
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        # flush идёт в потоке пула и не прерывается отменой задачи: stop ждёт его под
+        # этой блокировкой, а флаг не даёт записать файл после удаления
+        self._lock = threading.Lock()
+        self._stopped = False
+
+    def _path(self) -> str:
+        return os.path.join(self.directory, f"worker_{os.getpid()}.json")
+
+    def flush(self):
+        with self._lock:
+            if self._stopped:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path()
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(registry.snapshot(), f)
+            os.replace(tmp_path, path)
+
+    def collect(self) -> List[dict]:
+        """This worker's live values plus fresh snapshots of the other workers."""
+        own_path = self._path()
+        snapshots = [registry.snapshot()]
+        now = time.time()
+        for path in glob.glob(os.path.join(self.directory, "worker_*.json")):
+            if path == own_path:
+                continue
+            try:
+                if now - os.path.getmtime(path) > METRICS_STALE_SECONDS:
+                    os.remove(path)
+                    continue
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return snapshots
+
+    async def start(self):
+        with self._lock:
+            self._stopped = False
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await asyncio.get_running_loop().run_in_executor(None, self._remove)
+
+    def _remove(self):
+        with self._lock:
+            self._stopped = True
+            try:
+                os.remove(self._path())
+            except OSError:
+                pass
+
+    async def _flush_forever(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.flush)
+            except OSError as e:
+                logger.warning("Не удалось сохранить метрики: %s", e)
+            await asyncio.sleep(self.interval)
+
+
+def _route_label(scope) -> str:
+    route = scope.get("route")
+    if route is not None and getattr(route, "path", None):
+        return route.path
+    if "app_root_path" in scope and scope.get("root_path"):
+        # Mount (например, /static)
+        return scope["root_path"]
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """Counts requests and measures latency until the last body chunk is sent."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            method = scope.get("method", "")
+            route = _route_label(scope)
+            HTTP_LATENCY.observe(time.perf_counter() - started, method=method, route=route)
+            HTTP_REQUESTS.inc(method=method, route=route, status=str(status[0]))
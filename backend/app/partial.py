@@ -0,0 +1,159 @@
+"""Regeneration of a single part of a stored course.
+
+Вместо повторной генерации всего курса (4000 токенов) модель получает
+компактный промпт — план курса, нужный кусок и выдержку из источника —
+и возвращает только один раздел, резюме или несколько вопросов. Ответ
+применяется к сохранённому JSON одним UPDATE через json_set, поэтому
+параллельные правки других частей курса не теряются.
+"""
+import json
+import os
+from typing import Callable, List, NamedTuple, Optional, Sequence, Tuple
+
+from .passages import select_passages
+from .revisions import section_texts, valid_quiz, valid_section
+
+# Сколько текста источника и текущего курса попадает в промпт
+PARTIAL_SOURCE_CHARS = int(os.getenv("PARTIAL_SOURCE_CHARS", "2500"))
+PARTIAL_CONTEXT_CHARS = int(os.getenv("PARTIAL_CONTEXT_CHARS", "2500"))
+PARTIAL_MAX_QUIZZES = int(os.getenv("PARTIAL_MAX_QUIZZES", "20"))
+
+# (JSON-путь, значение); значение уже сериализовано в JSON
+Patch = Tuple[str, str]
+
+
+class PartialError(ValueError):
+    """The requested part does not exist or the parameters are invalid."""
+
+
+class PartialTask(NamedTuple):
+    kind: str  # section, summary, quizzes
+    prompt: str
+    max_tokens: int
+    # Пути, которые должны существовать в момент записи
+    guards: List[str]
+    # Ответ модели -> патчи, None если ответ не подходит
+    patches: Callable[[dict], Optional[List[Patch]]]
+
+
+def _outline(content: dict) -> str:
+    titles = [section.get("title", "") for section in content.get("sections") or [] if isinstance(section, dict)]
+    return "\n".join(f"{number}. {title}" for number, title in enumerate(titles, 1))
+
+
+def _source_block(source: str) -> str:
+    if not source:
+        return "Источник не сохранён — опирайся на план и текст курса."
+    return f"ИСТОЧНИК:\n{source}"
+
+
+def section_task(content: dict, index: int, source: str) -> PartialTask:
+    sections = content.get("sections") or []
+    if not 0 <= index < len(sections) or not isinstance(sections[index], dict):
+        raise PartialError(f"Раздела {index} нет")
+    section = sections[index]
+    prompt = f"""
+ПЕРЕПИШИ ОДИН РАЗДЕЛ КУРСА «{content.get('title', '')}».
+План курса:
+{_outline(content)}
+
+Раздел {index + 1}: {section.get('title', '')}
+Текущий текст раздела (пользователь им недоволен, не повторяй его):
+{str(section.get('content', ''))[:1500]}
+
+{_source_block(source)}
+
+Требования: тот же предмет раздела, 10-15 информативных предложений на русском языке.
+Ответ только в JSON: {{"title": "Название раздела", "content": "Текст раздела"}}
+"""
+
+    def patches(result: dict):
+        if not valid_section(result):
+            return None
+        value = {"title": str(result["title"]), "content": str(result["content"])}
+        return [(f"$.sections[{index}]", json.dumps(value, ensure_ascii=False))]
+
+    return PartialTask("section", prompt, 900, [f"$.sections[{index}]"], patches)
+
+
+def summary_task(content: dict, source: str) -> PartialTask:
+    context = select_passages("\n".join(section_texts(content)), PARTIAL_CONTEXT_CHARS, query=content.get("title", ""))
+    prompt = f"""
+НАПИШИ НОВОЕ ИТОГОВОЕ РЕЗЮМЕ КУРСА «{content.get('title', '')}».
+План курса:
+{_outline(content)}
+
+Содержание разделов (сокращённо):
+{context}
+
+{_source_block(source)}
+
+Требования: 3-5 предложений, подытоживай идеи и выводы курса.
+Ответ только в JSON: {{"summary": "Текст резюме"}}
+"""
+
+    def patches(result: dict):
+        summary = result.get("summary")
+        if not isinstance(summary, str) or not summary.strip():
+            return None
+        return [("$.summary", json.dumps(summary, ensure_ascii=False))]
+
+    return PartialTask("summary", prompt, 400, [], patches)
+
+
+def quiz_task(content: dict, indices: Optional[Sequence[int]], count: Optional[int], source: str) -> PartialTask:
+    """Replace the quiz questions at ``indices``, or the whole set with ``count`` new ones."""
+    quizzes = content.get("quizzes") or []
+    if indices:
+        indices = sorted(set(indices))
+        if indices[0] < 0 or indices[-1] >= len(quizzes):
+            raise PartialError(f"В курсе {len(quizzes)} вопросов")
+        count = len(indices)
+    elif count is None:
+        count = len(quizzes) or 10
+    if not 1 <= count <= PARTIAL_MAX_QUIZZES:
+        raise PartialError(f"Можно перегенерировать от 1 до {PARTIAL_MAX_QUIZZES} вопросов")
+
+    keep = [quiz for number, quiz in enumerate(quizzes) if indices and number not in indices]
+    existing = "\n".join(f"- {quiz.get('question', '')}" for quiz in keep if isinstance(quiz, dict))
+    context = select_passages("\n".join(section_texts(content)), PARTIAL_CONTEXT_CHARS, query=content.get("title", ""))
+    prompt = f"""
+СОСТАВЬ {count} НОВЫХ ТЕСТОВЫХ ВОПРОСОВ К КУРСУ «{content.get('title', '')}».
+Содержание разделов (сокращённо):
+{context}
+
+{_source_block(source)}
+{f"Эти вопросы уже есть, не повторяй их:{chr(10)}{existing}" if existing else ""}
+
+Каждый вопрос: "question", 4 варианта в "options", "correct_answer" — индекс от 0 до 3.
+Ответ только в JSON: {{"quizzes": [{{"question": "...", "options": ["...", "...", "...", "..."], "correct_answer": 0}}]}}
+"""
+
+    def patches(result: dict):
+        fresh = [quiz for quiz in result.get("quizzes") or [] if valid_quiz(quiz)]
+        if len(fresh) < count:
+            return None
+        if not indices:
+            return [("$.quizzes", json.dumps(fresh[:count], ensure_ascii=False))]
+        return [
+            (f"$.quizzes[{index}]", json.dumps(quiz, ensure_ascii=False))
+            for index, quiz in zip(indices, fresh)
+        ]
+
+    guards = [f"$.quizzes[{index}]" for index in indices or []]
+    return PartialTask("quizzes", prompt, 100 + 150 * count, guards, patches)
+
+
+def patch_statement(course_id: int, user_id: int, patches: Sequence[Patch], guards: Sequence[str]):
+    """Single UPDATE that applies the patches to the JSON stored right now."""
+    assignments = ", ".join("?, json(?)" for _ in patches)
+    sql = f"UPDATE courses SET content = json_set(content, {assignments}) WHERE id = ? AND user_id = ? AND json_valid(content)"
+    params = [value for patch in patches for value in patch] + [course_id, user_id]
+    for path in guards:
+        sql += " AND json_type(content, ?) IS NOT NULL"
+        params.append(path)
+    return sql, params
+
+
+def source_excerpt(texts: Sequence[str], query: str = "") -> str:
+    return select_passages(" ".join(texts), PARTIAL_SOURCE_CHARS, query=query) if texts else ""
@@ -0,0 +1,162 @@
+"""Relevance-based passage selection for long sources.
+
+Вместо первых N символов транскрипта в промпт попадают самые
+информативные и непохожие друг на друга фрагменты всего документа:
+текст режется на фрагменты примерно по PASSAGE_CHARS символов, для них
+строится TF-IDF (термы хешируются в PASSAGE_HASH_DIMS измерений), а
+затем MMR жадно набирает фрагменты до бюджета символов. Выбранные
+фрагменты возвращаются в порядке документа. Без numpy остаётся прежнее
+поведение — обрезка по бюджету.
+"""
+import itertools
+import logging
+import os
+import re
+from typing import List
+
+from .metrics import stage_timer
+
+try:
+    import numpy as np
+except ImportError:  # numpy необязателен, тогда транскрипт просто обрезается
+    np = None
+
+logger = logging.getLogger(__name__)
+
+PASSAGE_CHARS = int(os.getenv("PASSAGE_CHARS", "500"))
+# Больше фрагментов не делаем: для очень длинных текстов фрагменты укрупняются
+PASSAGE_MAX_COUNT = int(os.getenv("PASSAGE_MAX_COUNT", "4000"))
+PASSAGE_HASH_DIMS = int(os.getenv("PASSAGE_HASH_DIMS", "1024"))
+# 1.0 — только релевантность, 0.0 — только непохожесть на уже выбранное
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# Вес заголовка видео относительно «центра» документа
+QUERY_WEIGHT = float(os.getenv("PASSAGE_QUERY_WEIGHT", "0.5"))
+
+SEPARATOR = "\n…\n"
+
+_SENTENCE_END_RE = re.compile(r"[.!?…]\s|\n\s*\n")
+# Слова от трёх букв: предлоги и союзы почти не несут смысла
+_TOKEN_RE = re.compile(r"\w{3,}")
+
+
+def split_passages(text: str, target_chars: int = PASSAGE_CHARS) -> List[str]:
+    """Split text into passages of about target_chars, ending on a sentence boundary when possible."""
+    passages = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = start + target_chars
+        if end >= length:
+            end = length
+        else:
+            # Ближайший конец предложения, но не дальше двух целевых длин;
+            # автоматические субтитры идут без знаков препинания — тогда по пробелу
+            match = _SENTENCE_END_RE.search(text, end, start + 2 * target_chars)
+            if match:
+                end = match.end()
+            else:
+                space = text.rfind(" ", start + target_chars // 2, end)
+                end = space + 1 if space != -1 else end
+        passage = text[start:end].strip()
+        if passage:
+            passages.append(passage)
+        start = end
+    return passages
+
+
+def _tfidf(passages: List[str], query: str):
+    """Row-normalised TF-IDF matrix (passages x hash dims) and the query vector."""
+    dims = PASSAGE_HASH_DIMS
+    vocab = {}
+    positions = itertools.count()
+    term_ids = []
+    lengths = []
+    for passage in passages:
+        # Номер терма — позиция первого появления: детерминирован, в отличие
+        # от hash(), поэтому выбор одинаков во всех воркерах
+        ids = list(map(vocab.setdefault, _TOKEN_RE.findall(passage.lower()), positions))
+        term_ids.extend(ids)
+        lengths.append(len(ids))
+    count = len(passages)
+    if not term_ids:
+        return None, None
+
+    rows = np.repeat(np.arange(count, dtype=np.int64), lengths)
+    cols = np.asarray(term_ids, dtype=np.int64) % dims
+    keys, counts = np.unique(rows * dims + cols, return_counts=True)
+    rows, cols = keys // dims, keys % dims
+    document_frequency = np.bincount(cols, minlength=dims)
+    idf = np.log((1 + count) / (1 + document_frequency)) + 1
+    matrix = np.zeros((count, dims), dtype=np.float32)
+    matrix[rows, cols] = (1 + np.log(counts)) * idf[cols]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.maximum(norms, 1e-12)
+
+    query_vector = np.zeros(dims, dtype=np.float32)
+    query_ids = [vocab[word] for word in _TOKEN_RE.findall(query.lower()) if word in vocab]
+    if query_ids:
+        np.add.at(query_vector, np.asarray(query_ids) % dims, 1.0)
+        query_vector *= idf
+        query_vector /= np.linalg.norm(query_vector)
+    return matrix, query_vector
+
+
+def similarity_matrix(left: List[str], right: List[str]):
+    """Cosine similarities (len(left) x len(right)) in one TF-IDF space; None without numpy."""
+    if np is None:
+        return None
+    matrix, _ = _tfidf(list(left) + list(right), "")
+    if matrix is None:
+        return np.zeros((len(left), len(right)), dtype=np.float32)
+    return matrix[:len(left)] @ matrix[len(left):].T
+
+
+def _mmr(matrix, relevance, lengths, budget: int) -> List[int]:
+    """Greedy maximal marginal relevance under a character budget."""
+    count = len(lengths)
+    available = np.ones(count, dtype=bool)
+    max_similarity = np.zeros(count, dtype=np.float32)
+    selected = []
+    used = 0
+    while True:
+        separator = len(SEPARATOR) if selected else 0
+        fits = available & (lengths + separator <= budget - used)
+        if not fits.any():
+            break
+        score = MMR_LAMBDA * relevance - (1 - MMR_LAMBDA) * max_similarity
+        score[~fits] = -np.inf
+        best = int(np.argmax(score))
+        selected.append(best)
+        used += int(lengths[best]) + separator
+        available[best] = False
+        np.maximum(max_similarity, matrix @ matrix[best], out=max_similarity)
+    return selected
+
+
+def select_passages(text: str, budget_chars: int, query: str = "") -> str:
+    """Fit text into budget_chars, keeping the most informative non-redundant passages."""
+    if len(text) <= budget_chars:
+        return text
+    if np is None:
+        return text[:budget_chars]
+
+    with stage_timer("passage_select"):
+        target = max(PASSAGE_CHARS, len(text) // PASSAGE_MAX_COUNT)
+        passages = split_passages(text, min(target, budget_chars))
+        matrix, query_vector = _tfidf(passages, query)
+        if matrix is None:
+            return text[:budget_chars]
+
+        centroid = matrix.mean(axis=0)
+        centroid /= max(float(np.linalg.norm(centroid)), 1e-12)
+        relevance = matrix @ (centroid + QUERY_WEIGHT * query_vector)
+        lengths = np.fromiter((len(p) for p in passages), dtype=np.int64, count=len(passages))
+        selected = _mmr(matrix, relevance, lengths, budget_chars)
+        if not selected:
+            return text[:budget_chars]
+
+    logger.debug(
+        "selected %d of %d passages", len(selected), len(passages),
+        extra={"source_chars": len(text), "budget_chars": budget_chars},
+    )
+    return SEPARATOR.join(passages[index] for index in sorted(selected))
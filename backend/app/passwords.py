@@ -0,0 +1,86 @@
+"""Password hashing off the event loop.
+
+bcrypt намеренно медленный, поэтому хеширование и проверка выполняются в
+отдельном пуле потоков ограниченного размера. Старые хеши SHA-256 с солью
+(из start.py и create_user.py) по-прежнему принимаются и прозрачно
+перехешируются при успешном входе.
+"""
+import asyncio
+import hashlib
+import hmac
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(
+    os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))
+)
+PASSWORD_SALT = os.getenv("PASSWORD_SALT", "coursegen-salt")
+
+_pwd_context = None
+_pwd_context_lock = threading.Lock()
+
+
+def get_pwd_context():
+    """bcrypt CryptContext, created (and passlib imported) on first use."""
+    global _pwd_context
+    with _pwd_context_lock:
+        if _pwd_context is None:
+            from passlib.context import CryptContext
+
+            # min_rounds = rounds: хеши с меньшей стоимостью считаются устаревшими
+            _pwd_context = CryptContext(
+                schemes=["bcrypt"],
+                deprecated="auto",
+                bcrypt__rounds=PASSWORD_HASH_ROUNDS,
+                bcrypt__min_rounds=PASSWORD_HASH_ROUNDS,
+            )
+        return _pwd_context
+
+_LEGACY_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+_executor = ThreadPoolExecutor(
+    max_workers=max(1, PASSWORD_HASH_WORKERS), thread_name_prefix="pwhash"
+)
+
+
+def legacy_hash(password: str, salt: str = PASSWORD_SALT) -> str:
+    """Single-round salted SHA-256 used before bcrypt"""
+    return hashlib.sha256((password + salt).encode()).hexdigest()
+
+
+def is_legacy_hash(stored_hash: str) -> bool:
+    return bool(stored_hash) and bool(_LEGACY_HASH_RE.match(stored_hash))
+
+
+def hash_password(password: str) -> str:
+    return get_pwd_context().hash(password)
+
+
+def verify_password(password: str, stored_hash: str) -> Tuple[bool, Optional[str]]:
+    """Check a password; returns (ok, new_hash) where new_hash is set when
+    the stored hash is legacy or weaker than the configured cost."""
+    if not stored_hash:
+        return False, None
+    if is_legacy_hash(stored_hash):
+        if hmac.compare_digest(legacy_hash(password), stored_hash):
+            return True, hash_password(password)
+        return False, None
+    try:
+        return get_pwd_context().verify_and_update(password, stored_hash)
+    except (ValueError, TypeError):
+        return False, None
+
+
+async def hash_password_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, hash_password, password)
+
+
+async def verify_password_async(
+    password: str, stored_hash: str
+) -> Tuple[bool, Optional[str]]:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, verify_password, password, stored_hash)
@@ -0,0 +1,202 @@
+"""Background PDF rendering with a bounded on-disk cache.
+
+PDF (wkhtmltopdf через pdfkit) рендерится в отдельных процессах сразу после
+сохранения курса. Готовые файлы лежат в courses/ под именем, включающим
+версию содержимого; при превышении лимита размера удаляются давно не
+скачивавшиеся файлы. Запрос на скачивание либо сразу отдаёт файл, либо
+дожидается уже идущего рендера.
+"""
+import asyncio
+import glob
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional
+
+from .export import content_version
+from .metrics import STAGE_SECONDS
+from .profiling import child_profile_id, run_profiled_child
+
+logger = logging.getLogger(__name__)
+
+PDF_CACHE_DIR = os.getenv("PDF_CACHE_DIR", "courses")
+PDF_CACHE_MAX_BYTES = int(float(os.getenv("PDF_CACHE_MAX_MB", "512")) * 1024 * 1024)
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", "2"))
+
+
+class PdfUnavailable(Exception):
+    """wkhtmltopdf is not installed, only the HTML export can be served."""
+
+
+def _render_to_file(title: str, raw_content: Any, created_at: Any, target_path: str) -> str:
+    # Выполняется в процессе-воркере
+    import pdfkit
+
+    from .export import render_stored_course
+
+    html = render_stored_course(title, raw_content, created_at)
+    tmp_path = f"{target_path}.{os.getpid()}.tmp"
+    try:
+        pdfkit.from_string(html, tmp_path, options={"encoding": "UTF-8", "quiet": ""})
+        os.replace(tmp_path, target_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return target_path
+
+
+class PdfRenderer:
+    def __init__(
+        self,
+        cache_dir: str = PDF_CACHE_DIR,
+        max_bytes: int = PDF_CACHE_MAX_BYTES,
+        workers: int = PDF_RENDER_WORKERS,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.workers = max(1, workers)
+        self.rendered = 0
+        self.failed = 0
+        self.evicted = 0
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._available: Optional[bool] = None
+
+    def available(self) -> bool:
+        if self._available is None:
+            self._available = shutil.which("wkhtmltopdf") is not None
+            if not self._available:
+                logger.warning("wkhtmltopdf не найден: вместо PDF будет отдаваться HTML")
+        return self._available
+
+    def path_for(self, course_id: int, title: str, raw_content: Any, created_at: Any) -> str:
+        version = content_version(course_id, title, raw_content, created_at)
+        return os.path.join(self.cache_dir, f"course_{course_id}_{version}.pdf")
+
+    def schedule(self, course_id: int, title: str, raw_content: Any, created_at: Any) -> asyncio.Future:
+        """Start rendering unless the file is cached or already being rendered."""
+        if not self.available():
+            raise PdfUnavailable()
+        path = self.path_for(course_id, title, raw_content, created_at)
+        future = self._in_flight.get(path)
+        if future is not None:
+            return future
+        loop = asyncio.get_running_loop()
+        if os.path.exists(path):
+            future = loop.create_future()
+            future.set_result(path)
+            return future
+        os.makedirs(self.cache_dir, exist_ok=True)
+        future = asyncio.ensure_future(
+            loop.run_in_executor(
+                self._get_pool(),
+                run_profiled_child,
+                child_profile_id(),
+                ".pdf_render",
+                _render_to_file,
+                title,
+                raw_content,
+                created_at,
+                path,
+            )
+        )
+        self._in_flight[path] = future
+        started = time.perf_counter()
+        future.add_done_callback(lambda done: self._on_rendered(course_id, path, done, started))
+        return future
+
+    async def get(self, course_id: int, title: str, raw_content: Any, created_at: Any) -> str:
+        """Path of the rendered PDF, waiting for an in-progress render if needed."""
+        for _ in range(2):
+            path = await asyncio.shield(self.schedule(course_id, title, raw_content, created_at))
+            try:
+                # mtime служит отметкой последнего использования для LRU
+                os.utime(path)
+                return path
+            except FileNotFoundError:
+                # Файл успели вытеснить между рендером и отдачей — рендерим снова
+                continue
+        raise FileNotFoundError(path)
+
+    def remove_course(self, course_id: int):
+        for path in glob.glob(os.path.join(self.cache_dir, f"course_{course_id}_*.pdf")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {
+            "available": bool(self._available),
+            "in_flight": len(self._in_flight),
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "evicted": self.evicted,
+            "cache_bytes": self._cache_size(),
+            "max_bytes": self.max_bytes,
+        }
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: в родителе уже работают потоки (писатель БД, пул хеширования)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def _on_rendered(self, course_id: int, path: str, future: asyncio.Future, started: float):
+        self._in_flight.pop(path, None)
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            self.failed += 1
+            logger.error("Ошибка рендера PDF %s: %s", path, future.exception(), extra={"course_id": course_id})
+            return
+        self.rendered += 1
+        # Включая ожидание свободного процесса в пуле
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage="pdf_render")
+        # Предыдущие версии этого курса больше не понадобятся
+        for stale_path in glob.glob(os.path.join(self.cache_dir, f"course_{course_id}_*.pdf")):
+            if stale_path != path and stale_path not in self._in_flight:
+                try:
+                    os.remove(stale_path)
+                except OSError:
+                    pass
+        self._evict()
+
+    def _cached_files(self):
+        files = []
+        for path in glob.glob(os.path.join(self.cache_dir, "course_*.pdf")):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        return files
+
+    def _cache_size(self) -> int:
+        return sum(size for _, size, _ in self._cached_files())
+
+    def _evict(self):
+        files = sorted(self._cached_files())
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            if path in self._in_flight:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+                self.evicted += 1
+            except OSError:
+                pass
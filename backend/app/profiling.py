@@ -0,0 +1,236 @@
+"""Opt-in sampling profiler for a single request.
+
+Администратор добавляет заголовок ``X-Profile: 1`` (или ``?profile=1``),
+и на время этого запроса — включая отдачу потокового тела — отдельный
+поток раз в PROFILE_INTERVAL_MS снимает стеки потока event loop и
+потоков, в которых выполняется работа этого запроса (генерация, разбор
+PDF, рендер экспорта). Рендер PDF в процессе-воркере профилируется там
+же и пишется рядом. Результат — collapsed stacks (flamegraph.pl,
+speedscope) и JSON-сводка в PROFILE_DIR; id возвращается в X-Profile-Id.
+Без флага стоимость — поиск заголовка и одно чтение contextvar.
+"""
+import asyncio
+import collections
+import contextvars
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+PROFILE_DIR = os.path.abspath(os.getenv("PROFILE_DIR", "profiles"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+# Дольше не семплируем: профиль зависшей генерации не должен расти бесконечно
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "600"))
+PROFILE_MAX_PROFILES = int(os.getenv("PROFILE_MAX_PROFILES", "50"))
+PROFILE_TOP = 25
+
+_MAX_DEPTH = 128
+
+_active: contextvars.ContextVar[Optional["SamplingProfiler"]] = contextvars.ContextVar(
+    "active_profile", default=None
+)
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(frame) -> bool:
+    # Event loop ждёт событий в selectors — это простой, а не работа
+    return frame.f_code.co_filename.endswith("selectors.py")
+
+
+class SamplingProfiler:
+    """Samples the stacks of registered threads from a background thread."""
+
+    def __init__(self, profile_id: str, interval: float = PROFILE_INTERVAL_MS / 1000,
+                 max_seconds: float = PROFILE_MAX_SECONDS):
+        self.id = profile_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks: Dict[str, int] = collections.Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self.started_at = 0.0
+        self.elapsed = 0.0
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def add_thread(self, ident: int, label: str):
+        with self._lock:
+            self._threads[ident] = label
+
+    def remove_thread(self, ident: int):
+        with self._lock:
+            self._threads.pop(ident, None)
+
+    def start(self):
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name=f"profiler-{self.id}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed = time.time() - self.started_at
+
+    def _run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads.items())
+            for ident, label in threads:
+                frame = frames.get(ident)
+                if frame is None:
+                    continue
+                if _is_idle(frame):
+                    self.idle_samples += 1
+                    continue
+                names = []
+                while frame is not None and len(names) < _MAX_DEPTH:
+                    names.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                names.append(label)
+                self.stacks[";".join(reversed(names))] += 1
+                self.samples += 1
+
+    def save(self, directory: str = PROFILE_DIR, suffix: str = "", meta: Optional[dict] = None):
+        """Write ``<id><suffix>.collapsed`` and ``<id><suffix>.json``."""
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"{self.id}{suffix}")
+        with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        own = collections.Counter()
+        for stack, count in self.stacks.items():
+            own[stack.rsplit(";", 1)[-1]] += count
+        summary = {
+            "id": self.id,
+            "part": suffix.lstrip(".") or "request",
+            "started_at": self.started_at,
+            "duration_seconds": round(self.elapsed, 3),
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "idle_samples": self.idle_samples,
+            "top_self": [
+                {"frame": frame, "samples": count, "share": round(count / self.samples, 3)}
+                for frame, count in own.most_common(PROFILE_TOP)
+            ] if self.samples else [],
+            **(meta or {}),
+        }
+        with open(f"{base}.json", "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        prune(directory)
+
+
+def prune(directory: str = PROFILE_DIR, keep: int = PROFILE_MAX_PROFILES):
+    """Keep files of the ``keep`` most recent profile ids."""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    newest: Dict[str, float] = {}
+    for name in names:
+        profile_id = name.split(".", 1)[0]
+        try:
+            mtime = os.path.getmtime(os.path.join(directory, name))
+        except OSError:
+            continue
+        newest[profile_id] = max(newest.get(profile_id, 0.0), mtime)
+    stale = set(sorted(newest, key=newest.get, reverse=True)[keep:])
+    for name in names:
+        if name.split(".", 1)[0] in stale:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def current() -> Optional[SamplingProfiler]:
+    return _active.get()
+
+
+def child_profile_id() -> Optional[str]:
+    """Profile id to pass to a worker process, if this request is profiled."""
+    profile = _active.get()
+    return profile.id if profile is not None else None
+
+
+def profiled_thread(func: Callable) -> Callable:
+    """Let the active request profile sample the thread running ``func``."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        profile = _active.get()
+        if profile is None:
+            return func(*args, **kwargs)
+        ident = threading.get_ident()
+        profile.add_thread(ident, f"thread:{func.__name__}")
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.remove_thread(ident)
+
+    return wrapper
+
+
+def run_profiled_child(profile_id: Optional[str], suffix: str, func: Callable, *args):
+    """Run ``func`` in a worker process, sampling it when ``profile_id`` is set."""
+    if profile_id is None:
+        return func(*args)
+    profile = SamplingProfiler(profile_id)
+    profile.add_thread(threading.get_ident(), f"process:{suffix.lstrip('.')}")
+    profile.start()
+    try:
+        return func(*args)
+    finally:
+        profile.stop()
+        profile.save(suffix=suffix, meta={"pid": os.getpid()})
+
+
+def _requested(scope) -> bool:
+    for name, value in scope.get("headers", ()):
+        if name == b"x-profile":
+            return value.lower() in (b"1", b"true", b"yes")
+    query = scope.get("query_string", b"")
+    return bool(query) and b"profile=1" in query.split(b"&")
+
+
+class ProfilingMiddleware:
+    """Profiles requests that ask for it when ``is_admin(scope)`` allows."""
+
+    def __init__(self, app, is_admin: Callable[[dict], bool]):
+        self.app = app
+        self.is_admin = is_admin
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _requested(scope) or not self.is_admin(scope):
+            await self.app(scope, receive, send)
+            return
+        profile = SamplingProfiler(uuid.uuid4().hex[:12])
+        profile.add_thread(threading.get_ident(), "event-loop")
+        token = _active.set(profile)
+        profile.start()
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile.id.encode("ascii"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _active.reset(token)
+            profile.stop()
+            meta = {"method": scope.get("method"), "path": scope.get("path"), "pid": os.getpid()}
+            await asyncio.get_running_loop().run_in_executor(None, lambda: profile.save(meta=meta))
@@ -0,0 +1,75 @@
+"""Field projection for API responses (``?fields=title,sections.title``).
+
+Путь — имена ключей через точку; списки проходятся поэлементно, так что
+``sections.title`` оставляет у каждого раздела только заголовок.
+"""
+import re
+from typing import Any, Dict, Iterable, Optional
+
+MAX_FIELDS = 32
+_SEGMENT_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]{0,63}$")
+
+# Дерево проекции: ключ -> поддерево; пустое поддерево означает «всё значение»
+FieldTree = Dict[str, "FieldTree"]
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+def parse_fields(
+    raw: Optional[str],
+    aliases: Optional[Dict[str, str]] = None,
+    known: Optional[Dict[str, Optional[Iterable[str]]]] = None,
+) -> Optional[FieldTree]:
+    """Parse a ``fields`` parameter; None means no projection.
+
+    ``aliases`` maps a first path segment to a prefix, e.g. sections -> content.sections.
+    ``known`` lists the allowed first segments (after aliases) and, where not None,
+    the allowed second segments under them; anything else is InvalidFields.
+    """
+    if raw is None or not raw.strip():
+        return None
+    paths = [path.strip() for path in raw.split(",") if path.strip()]
+    if len(paths) > MAX_FIELDS:
+        raise InvalidFields(f"Не больше {MAX_FIELDS} полей")
+    tree: FieldTree = {}
+    for path in paths:
+        segments = path.split(".")
+        if not all(_SEGMENT_RE.match(segment) for segment in segments):
+            raise InvalidFields(f"Некорректное поле: {path}")
+        if aliases and segments[0] in aliases:
+            segments = aliases[segments[0]].split(".") + segments[1:]
+        if known is not None:
+            # Опечатка в имени поля иначе выглядела бы как пустой ответ
+            if segments[0] not in known:
+                raise InvalidFields(f"Неизвестное поле: {path}")
+            children = known[segments[0]]
+            if children is not None and len(segments) > 1 and segments[1] not in children:
+                raise InvalidFields(f"Неизвестное поле: {path}")
+        _add_path(tree, segments)
+    return tree
+
+
+def _add_path(tree: FieldTree, segments: Iterable[str]):
+    node = tree
+    segments = list(segments)
+    for index, segment in enumerate(segments):
+        existing = node.get(segment)
+        if existing is not None and not existing:
+            # Значение уже запрошено целиком — уточнение ничего не меняет
+            return
+        if index == len(segments) - 1:
+            node[segment] = {}
+            return
+        node = node.setdefault(segment, {})
+
+
+def project(value: Any, tree: Optional[FieldTree]) -> Any:
+    if not tree:
+        return value
+    if isinstance(value, dict):
+        return {key: project(value[key], subtree) for key, subtree in tree.items() if key in value}
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    return value
@@ -0,0 +1,276 @@
+"""Source chunks of courses and incremental regeneration of revised sources.
+
+Источник режется на фрагменты по содержимому: граница ставится после
+пары слов, хеш которой делится на CHUNK_DIVISOR (не раньше
+CHUNK_MIN_CHARS), поэтому правка в одной главе меняет только соседние
+фрагменты, а не все последующие. Тексты фрагментов хранятся по хешу
+(source_chunks, общие для версий), курс ссылается на них по порядку
+(course_chunks) и помнит, к какому разделу отнесён каждый фрагмент.
+Для новой версии документа сравниваются хеши, и модель переписывает
+только разделы, чьи фрагменты изменились.
+"""
+import difflib
+import hashlib
+import os
+import sqlite3
+import zlib
+from contextlib import closing
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+from .passages import select_passages, similarity_matrix
+
+CHUNK_MIN_CHARS = int(os.getenv("CHUNK_MIN_CHARS", "800"))
+CHUNK_MAX_CHARS = int(os.getenv("CHUNK_MAX_CHARS", "4000"))
+# После минимального размера граница в среднем раз в CHUNK_DIVISOR слов
+CHUNK_DIVISOR = int(os.getenv("CHUNK_DIVISOR", "100"))
+# Ниже этого косинуса фрагмент относится к разделу по положению в тексте
+MIN_SIMILARITY = float(os.getenv("CHUNK_MIN_SIMILARITY", "0.1"))
+# Сколько текста источника на один переписываемый раздел попадает в промпт
+REVISION_SOURCE_CHARS = int(os.getenv("REVISION_SOURCE_CHARS", "2500"))
+
+# SQLite ограничивает число параметров одного запроса
+_ROWS_PER_INSERT = 200
+
+
+class Chunk(NamedTuple):
+    hash: str
+    text: str
+
+
+class RevisionPlan(NamedTuple):
+    sections: List[int]  # раздел для каждого фрагмента новой версии
+    changed: List[int]  # разделы, которые нужно переписать
+    reused: int
+    added: int
+    removed: int
+
+
+def _chunk(words: List[str]) -> Chunk:
+    text = " ".join(words)
+    # Регистр и пробелы не влияют на хеш: разные PDF-генераторы расставляют их по-разному
+    return Chunk(hashlib.blake2b(text.lower().encode("utf-8"), digest_size=10).hexdigest(), text)
+
+
+def split_chunks(text: str) -> List[Chunk]:
+    """Content-defined chunks: boundaries depend only on nearby words, so edits stay local."""
+    words = text.split()
+    chunks = []
+    start = 0
+    size = 0
+    previous = ""
+    for index, word in enumerate(words):
+        size += len(word) + 1
+        boundary = size >= CHUNK_MAX_CHARS or (
+            size >= CHUNK_MIN_CHARS
+            and zlib.crc32(f"{previous} {word}".lower().encode("utf-8")) % CHUNK_DIVISOR == 0
+        )
+        previous = word
+        if boundary:
+            chunks.append(_chunk(words[start:index + 1]))
+            start = index + 1
+            size = 0
+    if start < len(words):
+        chunks.append(_chunk(words[start:]))
+    return chunks
+
+
+def section_texts(content: dict) -> List[str]:
+    return [
+        f"{section.get('title', '')}\n{section.get('content', '')}"
+        for section in content.get("sections") or []
+        if isinstance(section, dict)
+    ]
+
+
+def _closest(texts: Sequence[str], targets: Sequence[str]) -> List[int]:
+    """Index of the most similar target for every text."""
+    if not targets:
+        return [-1] * len(texts)
+    # По порядку: разделы обычно идут вслед за текстом
+    by_position = [index * len(targets) // max(len(texts), 1) for index in range(len(texts))]
+    similarity = similarity_matrix(texts, targets)
+    if similarity is None:
+        return by_position
+    best = similarity.argmax(axis=1)
+    # Слабое сходство — это шум хеширования термов, а не общая тема
+    return [
+        int(best[index]) if similarity[index, best[index]] >= MIN_SIMILARITY else by_position[index]
+        for index in range(len(texts))
+    ]
+
+
+def assign_sections(chunks: Sequence[Chunk], content: dict) -> List[int]:
+    """Section of the course each source chunk most likely went into."""
+    return _closest([chunk.text for chunk in chunks], section_texts(content))
+
+
+def quiz_owners(content: dict) -> List[int]:
+    """Section each quiz question is about."""
+    quizzes = content.get("quizzes") or []
+    texts = [
+        " ".join([str(quiz.get("question", ""))] + [str(option) for option in quiz.get("options") or []])
+        if isinstance(quiz, dict) else ""
+        for quiz in quizzes
+    ]
+    return _closest(texts, section_texts(content))
+
+
+def plan_revision(old: Sequence[Tuple[str, int]], new: Sequence[Chunk]) -> RevisionPlan:
+    """Align the new version's chunks with the stored ones and find sections whose source changed.
+
+    ``old`` is (hash, section) of the stored version in document order.
+    """
+    old_hashes = [chunk_hash for chunk_hash, _ in old]
+    old_sections = [section for _, section in old]
+    sections: List[int] = []
+    changed = set()
+    reused = added = removed = 0
+    matcher = difflib.SequenceMatcher(None, old_hashes, [chunk.hash for chunk in new], autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == "equal":
+            sections.extend(old_sections[old_start:old_end])
+            reused += old_end - old_start
+            continue
+        replaced = old_sections[old_start:old_end]
+        changed.update(replaced)
+        removed += len(replaced)
+        count = new_end - new_start
+        added += count
+        if replaced:
+            # Заменённый кусок наследует разделы того, что было на его месте
+            owners = [replaced[index * len(replaced) // count] for index in range(count)]
+        else:
+            # Вставка — в раздел соседнего фрагмента
+            neighbour = sections[-1] if sections else (old_sections[old_start] if old_start < len(old) else 0)
+            owners = [neighbour] * count
+        sections.extend(owners)
+        changed.update(owners)
+    changed.discard(-1)
+    return RevisionPlan(sections, sorted(changed), reused, added, removed)
+
+
+def section_sources(chunks: Sequence[Chunk], sections: Sequence[int], content: dict) -> Dict[int, str]:
+    """Source excerpt for every section that has chunks, fitted into REVISION_SOURCE_CHARS."""
+    grouped: Dict[int, List[str]] = {}
+    for chunk, section in zip(chunks, sections):
+        grouped.setdefault(section, []).append(chunk.text)
+    titles = [section.get("title", "") for section in content.get("sections") or [] if isinstance(section, dict)]
+    return {
+        section: select_passages(
+            " ".join(texts), REVISION_SOURCE_CHARS, query=titles[section] if 0 <= section < len(titles) else ""
+        )
+        for section, texts in grouped.items()
+    }
+
+
+def revision_prompt(content: dict, changed: Sequence[int], sources: Dict[int, str], quiz_count: int) -> str:
+    sections = content.get("sections") or []
+    blocks = "\n\n".join(
+        f"РАЗДЕЛ {number}: {sections[index].get('title', '')}\nНОВЫЙ ИСТОЧНИК:\n{sources.get(index, '')}"
+        for number, index in enumerate(changed, 1)
+    )
+    return f"""
+ОБНОВИ РАЗДЕЛЫ КУРСА «{content.get('title', '')}» ПО ИЗМЕНЁННОЙ ВЕРСИИ ДОКУМЕНТА.
+Остальные разделы курса не меняются, их не выводи.
+
+{blocks}
+
+Требования:
+1. Верни ровно {len(changed)} разделов в том же порядке; в каждом content — 10-15 информативных предложений по новому источнику.
+2. Верни {quiz_count} вопросов по этим разделам: "question", 4 варианта в "options", "correct_answer" — индекс от 0 до 3.
+3. Ответ только в JSON, без пояснений:
+{{"sections": [{{"title": "...", "content": "..."}}], "quizzes": [{{"question": "...", "options": ["...", "...", "...", "..."], "correct_answer": 0}}]}}
+"""
+
+
+def valid_section(section) -> bool:
+    return isinstance(section, dict) and bool(section.get("title")) and bool(section.get("content"))
+
+
+def valid_quiz(quiz) -> bool:
+    return (
+        isinstance(quiz, dict)
+        and bool(quiz.get("question"))
+        and isinstance(quiz.get("options"), list)
+        and len(quiz["options"]) >= 2
+        and isinstance(quiz.get("correct_answer"), int)
+        and 0 <= quiz["correct_answer"] < len(quiz["options"])
+    )
+
+
+def merge_revision(
+    content: dict, changed: Sequence[int], result: dict, quiz_count: int
+) -> Tuple[dict, List[int]]:
+    """New course content with the rewritten sections and their quizzes; returns (content, rewritten)."""
+    rewritten_sections = [section for section in result.get("sections") or [] if valid_section(section)]
+    rewritten = list(changed[:len(rewritten_sections)])
+    merged = dict(content)
+    sections = list(content.get("sections") or [])
+    for index, section in zip(rewritten, rewritten_sections):
+        sections[index] = {"title": str(section["title"]), "content": str(section["content"])}
+    merged["sections"] = sections
+
+    fresh = [quiz for quiz in result.get("quizzes") or [] if valid_quiz(quiz)][:quiz_count]
+    if fresh and rewritten:
+        replaced = set(rewritten)
+        kept = [
+            quiz for quiz, owner in zip(content.get("quizzes") or [], quiz_owners(content))
+            if owner not in replaced
+        ]
+        merged["quizzes"] = kept + fresh
+    return merged, rewritten
+
+
+def chunk_statements(course_id: int, chunks: Sequence[Chunk], sections: Sequence[int]):
+    """(sql, params) pairs that link a stored course to its source chunks."""
+    statements = []
+    for start in range(0, len(chunks), _ROWS_PER_INSERT):
+        part = range(start, min(start + _ROWS_PER_INSERT, len(chunks)))
+        statements.append((
+            "INSERT OR IGNORE INTO source_chunks (hash, text) VALUES " + ",".join("(?, ?)" for _ in part),
+            [value for index in part for value in (chunks[index].hash, chunks[index].text)],
+        ))
+        statements.append((
+            "INSERT INTO course_chunks (course_id, position, hash, section) VALUES "
+            + ",".join("(?, ?, ?, ?)" for _ in part),
+            [value for index in part for value in (course_id, index, chunks[index].hash, sections[index])],
+        ))
+    return statements
+
+
+def load_course_chunks(db_path: str, course_id: int) -> List[Tuple[str, int]]:
+    """(hash, section) of a course's source chunks in document order."""
+    with closing(sqlite3.connect(db_path)) as conn:
+        return conn.execute(
+            "SELECT hash, section FROM course_chunks WHERE course_id = ? ORDER BY position", (course_id,)
+        ).fetchall()
+
+
+def load_course_source(db_path: str, course_id: int) -> Tuple[List[Chunk], List[int]]:
+    """Stored source chunks of a course with their sections."""
+    with closing(sqlite3.connect(db_path)) as conn:
+        rows = conn.execute(
+            """
+            SELECT cc.hash, sc.text, cc.section
+            FROM course_chunks cc JOIN source_chunks sc ON sc.hash = cc.hash
+            WHERE cc.course_id = ? ORDER BY cc.position
+            """,
+            (course_id,),
+        ).fetchall()
+    return [Chunk(chunk_hash, text) for chunk_hash, text, _ in rows], [section for _, _, section in rows]
+
+
+def remove_course_chunks(conn: sqlite3.Connection, course_id: int):
+    """Unlink a deleted course; chunk texts no other version uses are dropped too."""
+    conn.execute(
+        """
+        DELETE FROM source_chunks
+        WHERE hash IN (SELECT hash FROM course_chunks WHERE course_id = ?)
+          AND NOT EXISTS (
+              SELECT 1 FROM course_chunks other
+              WHERE other.hash = source_chunks.hash AND other.course_id != ?
+          )
+        """,
+        (course_id, course_id),
+    )
+    conn.execute("DELETE FROM course_chunks WHERE course_id = ?", (course_id,))
@@ -0,0 +1,366 @@
+"""Routing of model calls by task type.
+
+Разные задачи требуют разной модели: разделы курса пишет большая модель,
+а вопросы и резюме справится сделать маленькая и быстрая. Маршруты
+задаются JSON-ом в LLM_ROUTES (или файлом LLM_ROUTES_FILE):
+
+    {
+      "routes": {
+        "default": {"url": "http://127.0.0.1:1234/v1", "model": "qwen2.5-7b-instruct"},
+        "small": {"url": "http://127.0.0.1:1235/v1", "model": "qwen2.5-1.5b-instruct",
+                  "temperature": 0.5, "max_tokens": 1500, "timeout": 60}
+      },
+      "tasks": {"quizzes": "small", "summary": "small", "json_repair": "small"}
+    }
+
+Задача без маршрута идёт в default (QWEN_API_URL, "local-model") с
+параметрами вызывающего кода. Если маршрут не ответил, запрос повторяется
+на маршруте из его "fallback" (по умолчанию default). По каждой паре
+задача/маршрут считаются задержки и доля fallback — и в /metrics, и в
+/api/debug, чтобы подбирать схему маршрутизации.
+
+Временные сбои (обрыв соединения, 429/5xx, оборванный поток) повторяются
+на том же маршруте до LLM_RETRIES раз с экспоненциальной паузой и
+случайным разбросом (full jitter), чтобы воркеры не били в сервер
+одновременно. Для задач из LLM_HEDGE_TASKS медленный запрос страхуется:
+если ответа нет дольше p95 задержки маршрута, второй запрос уходит на
+запасной маршрут (или тот же, если запасного нет); берётся первый
+успешный ответ, второй запрос обрывается.
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from .cancellation import CancelToken, GenerationCancelled, current_token
+from .llm import LLM_API_URL, Completion, LLMError, stream_chat
+from .metrics import LLM_HEDGES, LLM_RETRIES, LLM_ROUTE_REQUESTS, LLM_ROUTE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+LLM_ROUTES = os.getenv("LLM_ROUTES", "")
+LLM_ROUTES_FILE = os.getenv("LLM_ROUTES_FILE", "")
+# Сколько последних задержек на маршрут хранить для квантилей
+ROUTE_LATENCY_WINDOW = int(os.getenv("LLM_ROUTE_LATENCY_WINDOW", "200"))
+# Повторы временных сбоев на одном маршруте; пауза — случайная в [0, base * 2**n], не больше max
+LLM_RETRIES_MAX = int(os.getenv("LLM_RETRIES", "2"))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "8"))
+# Задачи через запятую; по умолчанию страховочных запросов нет — они удваивают нагрузку на модель
+LLM_HEDGE_TASKS = {task.strip() for task in os.getenv("LLM_HEDGE_TASKS", "").split(",") if task.strip()}
+LLM_HEDGE_QUANTILE = float(os.getenv("LLM_HEDGE_QUANTILE", "0.95"))
+# Пока задержек мало, квантиль ненадёжен и страховки нет
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "1"))
+
+TASKS = ("course", "revision", "section", "summary", "quizzes", "json_repair")
+_ROUTE_PARAMS = ("temperature", "top_p", "max_tokens")
+# Перегрузка и сбои сервера; остальные ошибки HTTP (400, 404) повтор не исправит
+_RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class Route(NamedTuple):
+    name: str
+    url: str
+    model: str
+    params: Dict[str, Any]
+    timeout: Optional[float]
+    fallback: Optional[str]
+
+
+class RoutingConfigError(ValueError):
+    pass
+
+
+def retryable(error: Exception) -> bool:
+    """Whether a failed model request is worth repeating."""
+    import requests
+
+    if isinstance(error, LLMError):
+        # Без статуса — битый поток, обычно разовый сбой
+        return error.status is None or error.status in _RETRY_STATUSES
+    if isinstance(error, (requests.exceptions.ConnectTimeout, requests.exceptions.ChunkedEncodingError)):
+        return True
+    if isinstance(error, requests.exceptions.Timeout):
+        # Генерация не уложилась в timeout: повтор займёт столько же
+        return False
+    return isinstance(error, requests.exceptions.ConnectionError)
+
+
+def backoff_delay(attempt: int) -> float:
+    return random.uniform(0, min(LLM_RETRY_MAX_SECONDS, LLM_RETRY_BASE_SECONDS * 2 ** attempt))
+
+
+def _in_context(token: CancelToken, func, *args):
+    current_token.set(token)
+    return func(*args)
+
+
+def _load_config() -> dict:
+    if LLM_ROUTES_FILE:
+        with open(LLM_ROUTES_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    return json.loads(LLM_ROUTES) if LLM_ROUTES.strip() else {}
+
+
+def parse_config(config: dict) -> Tuple[Dict[str, Route], Dict[str, str]]:
+    """(routes by name, route name by task) with the built-in default route filled in."""
+    specs = dict(config.get("routes") or {})
+    default_spec = {"url": LLM_API_URL, "model": "local-model", **(specs.pop("default", None) or {})}
+    routes = {}
+    for name, spec in [("default", default_spec)] + list(specs.items()):
+        if not isinstance(spec, dict):
+            raise RoutingConfigError(f"route {name}: expected an object")
+        routes[name] = Route(
+            name=name,
+            url=str(spec.get("url") or default_spec["url"]).rstrip("/"),
+            model=str(spec.get("model") or default_spec["model"]),
+            params={key: spec[key] for key in _ROUTE_PARAMS if key in spec},
+            timeout=float(spec["timeout"]) if spec.get("timeout") else None,
+            fallback=spec.get("fallback", None if name == "default" else "default"),
+        )
+    for route in routes.values():
+        if route.fallback is not None and route.fallback not in routes:
+            raise RoutingConfigError(f"route {route.name}: unknown fallback {route.fallback}")
+    tasks = dict(config.get("tasks") or {})
+    for task, name in tasks.items():
+        if task not in TASKS:
+            raise RoutingConfigError(f"unknown task {task}, expected one of {', '.join(TASKS)}")
+        if name not in routes:
+            raise RoutingConfigError(f"task {task}: unknown route {name}")
+    return routes, tasks
+
+
+class ModelRouter:
+    """Sends each chat request to the route configured for its task, with fallback."""
+
+    def __init__(self, config: Optional[dict] = None):
+        self.routes, self.tasks = parse_config(_load_config() if config is None else config)
+        self._lock = threading.Lock()
+        self._stats: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    def route(self, task: str) -> Route:
+        return self.routes[self.tasks.get(task, "default")]
+
+    def configured(self, task: str) -> bool:
+        """Whether the task has its own route (optional tasks run only then)."""
+        return task in self.tasks
+
+    def chain(self, task: str) -> List[Route]:
+        route = self.route(task)
+        chain = [route]
+        while route.fallback and all(route.fallback != seen.name for seen in chain):
+            route = self.routes[route.fallback]
+            chain.append(route)
+        return chain
+
+    def chat(self, task: str, messages: List[dict], max_tokens: int, timeout: float, **params) -> Completion:
+        """Run the request on the task's route; on failure move along the fallback chain."""
+        import requests
+
+        chain = self.chain(task)
+        request = (messages, max_tokens, timeout, params)
+        error: Optional[Exception] = None
+        start = 0
+        delay = self.hedge_delay(task)
+        if delay is not None:
+            completion, error, start = self._hedged(task, chain, delay, request)
+            if completion is not None:
+                return completion
+        for attempt in range(start, len(chain)):
+            route = chain[attempt]
+            try:
+                return self._call_route(task, route, request, "ok" if attempt == 0 else "fallback")
+            except (LLMError, requests.exceptions.RequestException) as e:
+                error = e
+                if attempt + 1 < len(chain):
+                    logger.warning(
+                        "Маршрут %s не ответил (%s), пробуем %s", route.name, e, chain[attempt + 1].name,
+                        extra={"task": task},
+                    )
+        # Страхованные запросы могли закончиться без ошибки модели (например, отменой) —
+        # тогда error пуст, а raise None дал бы TypeError
+        raise error or LLMError(f"no route answered task {task}")
+
+    def _call_route(self, task: str, route: Route, request, result: str) -> Completion:
+        """One route with bounded, jittered retries of transient failures."""
+        import requests
+
+        messages, max_tokens, timeout, params = request
+        payload = {"model": route.model, "messages": messages, "max_tokens": max_tokens, **params, **route.params}
+        for attempt in range(LLM_RETRIES_MAX + 1):
+            started = time.perf_counter()
+            try:
+                completion = stream_chat(route.url, payload, timeout=route.timeout or timeout)
+            except (LLMError, requests.exceptions.RequestException) as e:
+                self._record(task, route.name, "error", time.perf_counter() - started)
+                if attempt == LLM_RETRIES_MAX or not retryable(e):
+                    raise
+                pause = backoff_delay(attempt)
+                LLM_RETRIES.inc(task=task, route=route.name)
+                self._count(task, route.name, "retries")
+                logger.warning(
+                    "Сбой маршрута %s (%s), повтор через %.2f с", route.name, e, pause,
+                    extra={"task": task, "attempt": attempt + 1},
+                )
+                token = current_token.get()
+                if token is not None:
+                    if token.wait(pause):
+                        token.check()
+                else:
+                    time.sleep(pause)
+                continue
+            self._record(task, route.name, result, completion.total)
+            return completion
+
+    def hedge_delay(self, task: str) -> Optional[float]:
+        """How long to wait for the primary route before a hedged request, None if hedging is off."""
+        if task not in LLM_HEDGE_TASKS:
+            return None
+        with self._lock:
+            stats = self._stats.get((task, self.route(task).name))
+            if not stats or len(stats["latencies"]) < LLM_HEDGE_MIN_SAMPLES:
+                return None
+        return max(LLM_HEDGE_MIN_DELAY, self.latency_quantile(task, LLM_HEDGE_QUANTILE))
+
+    def _hedged(self, task: str, chain: List[Route], delay: float, request):
+        """Primary request plus a hedged one after ``delay``; (completion, last error, routes used)."""
+        import requests
+
+        primary = chain[0]
+        backup = chain[1] if len(chain) > 1 else primary
+        parent = current_token.get()
+        tokens = [CancelToken(), CancelToken()]
+        unlink = parent.on_cancel(lambda: [token.cancel(parent.reason) for token in tokens]) if parent else None
+        error: Optional[Exception] = None
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=2, thread_name_prefix="llm-hedge") as pool:
+                futures = {
+                    pool.submit(
+                        contextvars.copy_context().run, _in_context, tokens[0], self._call_route, task, primary, request, "ok"
+                    ): "primary"
+                }
+                done, _ = wait(futures, timeout=delay)
+                if not done:
+                    futures[pool.submit(
+                        contextvars.copy_context().run, _in_context, tokens[1], self._call_route, task, backup, request, "hedge"
+                    )] = "hedge"
+                    logger.info(
+                        "Нет ответа %s за %.1f с, страхующий запрос на %s", primary.name, delay, backup.name,
+                        extra={"task": task},
+                    )
+                pending = set(futures)
+                while pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        try:
+                            completion = future.result()
+                        except GenerationCancelled:
+                            if parent is not None and parent.cancelled:
+                                raise GenerationCancelled(parent.reason)
+                            continue
+                        except (LLMError, requests.exceptions.RequestException) as e:
+                            error = e
+                            continue
+                        # Проигравший запрос обрывается, чтобы не занимать сервер модели
+                        for token in tokens:
+                            token.cancel("hedge")
+                        if len(futures) > 1:
+                            winner = futures[future]
+                            LLM_HEDGES.inc(task=task, outcome="won" if winner == "hedge" else "lost")
+                            self._count(task, primary.name, "hedges")
+                            if winner == "hedge":
+                                # Задержка основного маршрута не меньше прошедшего времени: без этой
+                                # оценки p95 смещался бы вниз и страховка срабатывала всё чаще
+                                self._sample(task, primary.name, time.perf_counter() - started)
+                        return completion, None, 0
+            if len(futures) > 1:
+                LLM_HEDGES.inc(task=task, outcome="failed")
+                self._count(task, primary.name, "hedges")
+            return None, error, 2 if len(futures) > 1 and backup is not primary else 1
+        finally:
+            if unlink is not None:
+                unlink()
+
+    def latency_quantile(self, task: str, quantile: float) -> Optional[float]:
+        """Recent successful latency quantile of the task's primary route, None without data."""
+        with self._lock:
+            stats = self._stats.get((task, self.route(task).name))
+            samples = sorted(stats["latencies"]) if stats else []
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(quantile * len(samples)))]
+
+    def stats(self) -> dict:
+        with self._lock:
+            items = [(key, dict(value), sorted(value["latencies"])) for key, value in self._stats.items()]
+        report = {
+            "routes": {name: {"url": route.url, "model": route.model, "fallback": route.fallback}
+                       for name, route in self.routes.items()},
+            "tasks": {task: self.tasks.get(task, "default") for task in TASKS},
+            "usage": [],
+            "fallback_rate": {},
+        }
+        answers: Dict[str, List[int]] = {}
+        for (task, route), stats, latencies in items:
+            requests_total = stats["ok"] + stats["fallback"] + stats["hedge"] + stats["error"]
+            report["usage"].append({
+                "task": task,
+                "route": route,
+                "requests": requests_total,
+                "errors": stats["error"],
+                # Ответы, полученные этим маршрутом как запасным
+                "fallbacks": stats["fallback"],
+                # Ответы страхующих запросов этим маршрутом
+                "hedge_wins": stats["hedge"],
+                "retries": stats["retries"],
+                "hedged_requests": stats["hedges"],
+                "p50_seconds": round(latencies[len(latencies) // 2], 3) if latencies else None,
+                "p95_seconds": round(latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))], 3)
+                if latencies else None,
+            })
+            total = answers.setdefault(task, [0, 0])
+            total[0] += stats["fallback"]
+            total[1] += stats["ok"] + stats["fallback"] + stats["hedge"]
+        report["fallback_rate"] = {
+            task: round(fallbacks / answered, 3) if answered else None
+            for task, (fallbacks, answered) in answers.items()
+        }
+        return report
+
+    def _record(self, task: str, route: str, result: str, seconds: float):
+        LLM_ROUTE_REQUESTS.inc(task=task, route=route, result=result)
+        if result != "error":
+            LLM_ROUTE_SECONDS.observe(seconds, task=task, route=route)
+        with self._lock:
+            stats = self._route_stats(task, route)
+            stats[result] += 1
+            if result != "error":
+                stats["latencies"].append(seconds)
+
+    def _count(self, task: str, route: str, key: str):
+        with self._lock:
+            self._route_stats(task, route)[key] += 1
+
+    def _sample(self, task: str, route: str, seconds: float):
+        with self._lock:
+            self._route_stats(task, route)["latencies"].append(seconds)
+
+    def _route_stats(self, task: str, route: str) -> Dict[str, Any]:
+        stats = self._stats.get((task, route))
+        if stats is None:
+            stats = self._stats[(task, route)] = {
+                "ok": 0, "fallback": 0, "hedge": 0, "error": 0, "retries": 0, "hedges": 0,
+                "latencies": deque(maxlen=ROUTE_LATENCY_WINDOW),
+            }
+        return stats
+
+
+model_router = ModelRouter()
@@ -0,0 +1,175 @@
+"""Versioned SQLite schema.
+
+Версия схемы хранится в PRAGMA user_version. При старте каждого воркера
+проверяется только она (одно чтение заголовка); миграции применяются под
+BEGIN IMMEDIATE, поэтому одновременно стартующие воркеры не мешают друг
+другу. Первая миграция использует IF NOT EXISTS и подхватывает базы,
+созданные до появления версий.
+"""
+import logging
+import sqlite3
+from contextlib import closing
+from typing import List, Tuple
+
+from .write_batcher import open_connection
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS: List[Tuple[str, List[str]]] = [
+    (
+        "users and courses",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                email TEXT UNIQUE NOT NULL,
+                hashed_password TEXT NOT NULL,
+                first_name TEXT,
+                last_name TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS courses (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title TEXT NOT NULL,
+                description TEXT,
+                video_url TEXT,
+                video_title TEXT,
+                content TEXT,
+                user_id INTEGER NOT NULL,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (user_id) REFERENCES users (id)
+            )
+            """,
+        ],
+    ),
+    (
+        "state shared between workers",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS generation_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                worker TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                heartbeat_at REAL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_generation_jobs_status ON generation_jobs (status, user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_generation_jobs_user ON generation_jobs (user_id, started_at)",
+            """
+            CREATE TABLE IF NOT EXISTS rate_limits (
+                user_id INTEGER PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS cache_invalidations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                cache TEXT NOT NULL,
+                key TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """,
+        ],
+    ),
+    (
+        "near-duplicate source index",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS source_signatures (
+                course_id INTEGER PRIMARY KEY,
+                signature BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS source_lsh (
+                key INTEGER NOT NULL,
+                course_id INTEGER NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_source_lsh_key ON source_lsh (key)",
+            "CREATE INDEX IF NOT EXISTS idx_source_lsh_course ON source_lsh (course_id)",
+        ],
+    ),
+    (
+        "course versions and source chunks",
+        [
+            "ALTER TABLE courses ADD COLUMN parent_id INTEGER",
+            "ALTER TABLE courses ADD COLUMN version INTEGER NOT NULL DEFAULT 1",
+            """
+            CREATE TABLE IF NOT EXISTS source_chunks (
+                hash TEXT PRIMARY KEY,
+                text TEXT NOT NULL
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS course_chunks (
+                course_id INTEGER NOT NULL,
+                position INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                section INTEGER NOT NULL,
+                PRIMARY KEY (course_id, position)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_course_chunks_hash ON course_chunks (hash)",
+        ],
+    ),
+    (
+        "course status and pending upgrades",
+        [
+            "ALTER TABLE courses ADD COLUMN status TEXT NOT NULL DEFAULT 'ready'",
+            """
+            CREATE TABLE IF NOT EXISTS pending_upgrades (
+                course_id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                video_title TEXT,
+                description TEXT,
+                transcript TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                claimed_by TEXT,
+                claimed_until REAL,
+                created_at REAL NOT NULL
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_pending_upgrades_next ON pending_upgrades (next_attempt_at)",
+        ],
+    ),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_path: str) -> Tuple[int, int]:
+    """Bring the database up to SCHEMA_VERSION; returns (old, new) versions."""
+    with closing(open_connection(db_path)) as conn:
+        current = schema_version(conn)
+        if current >= SCHEMA_VERSION:
+            return current, current
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Пока ждали блокировку, другой воркер мог уже всё применить
+            current = schema_version(conn)
+            for version in range(current + 1, SCHEMA_VERSION + 1):
+                description, statements = MIGRATIONS[version - 1]
+                for statement in statements:
+                    conn.execute(statement)
+                logger.info("Миграция схемы v%s: %s", version, description)
+            if current < SCHEMA_VERSION:
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.execute("COMMIT")
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+        return current, max(current, SCHEMA_VERSION)
@@ -0,0 +1,191 @@
+"""Static assets with content-hashed URLs and frontend HTML pages.
+
+Ссылки вида /static/generate.js в HTML-страницах переписываются в
+/static/generate.js?v=<хеш содержимого>. Такой URL меняется вместе с
+файлом, поэтому его можно кешировать в браузере «навсегда», а сами
+страницы отдаются с ETag и проверяются при каждом заходе.
+"""
+import gzip
+import hashlib
+import os
+import re
+import threading
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from .compression import COMPRESS_MIN_SIZE, brotli, choose_encoding
+from .http_cache import etag_matches
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+_STATIC_REF_RE = re.compile(r'(?P<attr>src|href)="/static/(?P<path>[^"?#]+)"')
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.blake2b(digest_size=8)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class HashedStaticFiles(StaticFiles):
+    """StaticFiles with strong content ETags and immutable versioned URLs."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._hashes: Dict[str, Tuple[float, int, str]] = {}
+        self._lock = threading.Lock()
+
+    def content_hash(self, full_path: str, stat_result: Optional[os.stat_result] = None) -> str:
+        stat_result = stat_result or os.stat(full_path)
+        key = (stat_result.st_mtime, stat_result.st_size)
+        with self._lock:
+            cached = self._hashes.get(full_path)
+        if cached is not None and cached[:2] == key:
+            return cached[2]
+        value = _file_hash(full_path)
+        with self._lock:
+            self._hashes[full_path] = (*key, value)
+        return value
+
+    def asset_url(self, relative_path: str) -> str:
+        """Versioned URL of a file under the static directory."""
+        full_path = os.path.join(self.directory, relative_path)
+        try:
+            return f"/static/{relative_path}?v={self.content_hash(full_path)}"
+        except OSError:
+            return f"/static/{relative_path}"
+
+    def rewrite_asset_urls(self, html: str) -> str:
+        return _STATIC_REF_RE.sub(
+            lambda m: f'{m.group("attr")}="{self.asset_url(m.group("path"))}"', html
+        )
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        version = self.content_hash(str(full_path), stat_result)
+        requested_version = QueryParams(scope.get("query_string", b"")).get("v")
+        headers = {
+            "ETag": f'"{version}"',
+            "Cache-Control": (
+                IMMUTABLE_CACHE_CONTROL
+                if requested_version == version
+                else REVALIDATE_CACHE_CONTROL
+            ),
+        }
+        response = FileResponse(
+            full_path,
+            status_code=status_code,
+            stat_result=stat_result,
+            method=scope["method"],
+            headers=headers,
+        )
+        if etag_matches(Headers(scope=scope).get("if-none-match"), headers["ETag"]):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+class PageVariant(NamedTuple):
+    body: bytes
+    headers: Dict[str, str]
+
+
+class Page(NamedTuple):
+    variants: Dict[Optional[str], PageVariant]
+    etag: str
+    mtime: float
+
+
+class PageStore:
+    """Frontend HTML pages held in memory with precompressed variants.
+
+    Страницы читаются один раз при старте; заголовки (ETag, длина,
+    кодировка) считаются заранее. В режиме разработки (``reload=True``)
+    файл перечитывается, если изменился на диске.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        static_files: HashedStaticFiles,
+        names: Iterable[str] = (),
+        reload: bool = False,
+    ):
+        self.directory = directory
+        self.static_files = static_files
+        self.names = list(names)
+        self.reload = reload
+        self._pages: Dict[str, Page] = {}
+        self._lock = threading.Lock()
+
+    def load_all(self):
+        for name in self.names:
+            self._load(name)
+
+    def get(self, name: str) -> Page:
+        page = self._pages.get(name)
+        if page is None:
+            return self._load(name)
+        if self.reload:
+            try:
+                if os.stat(self._path(name)).st_mtime != page.mtime:
+                    return self._load(name)
+            except OSError:
+                pass
+        return page
+
+    def response(self, name: str, request_headers: Headers) -> Response:
+        page = self.get(name)
+        if etag_matches(request_headers.get("if-none-match"), page.etag):
+            return Response(
+                status_code=304,
+                headers={"ETag": page.etag, "Cache-Control": REVALIDATE_CACHE_CONTROL},
+            )
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""))
+        variant = page.variants.get(encoding) or page.variants[None]
+        return Response(variant.body, headers=variant.headers)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.html")
+
+    def _load(self, name: str) -> Page:
+        path = self._path(name)
+        mtime = os.stat(path).st_mtime
+        with open(path, encoding="utf-8") as f:
+            html = self.static_files.rewrite_asset_urls(f.read())
+        body = html.encode("utf-8")
+        digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+        etag = f'"{digest}"'
+        variants = {None: PageVariant(body, self._headers(body, etag, None))}
+        if len(body) >= COMPRESS_MIN_SIZE:
+            for encoding, compressed in _precompress(body):
+                variants[encoding] = PageVariant(
+                    compressed, self._headers(compressed, f"W/{etag}", encoding)
+                )
+        page = Page(variants, etag, mtime)
+        with self._lock:
+            self._pages[name] = page
+        return page
+
+    @staticmethod
+    def _headers(body: bytes, etag: str, encoding: Optional[str]) -> Dict[str, str]:
+        headers = {
+            "content-type": "text/html; charset=utf-8",
+            "content-length": str(len(body)),
+            "etag": etag,
+            "cache-control": REVALIDATE_CACHE_CONTROL,
+            "vary": "Accept-Encoding",
+        }
+        if encoding:
+            headers["content-encoding"] = encoding
+        return headers
+
+
+def _precompress(body: bytes):
+    yield "gzip", gzip.compress(body, compresslevel=9, mtime=0)
+    if brotli is not None:
+        yield "br", brotli.compress(body, quality=11)
@@ -0,0 +1,243 @@
+"""Background upgrade of template courses created while the model was down.
+
+Если модель недоступна, пользователь сразу получает шаблонный курс со
+статусом pending_upgrade, а входные данные генерации остаются в
+pending_upgrades. Фоновая задача каждого воркера раз в
+UPGRADE_POLL_SECONDS проверяет, что есть курсы на очереди, очередь
+генераций пуста и модель отвечает, и тогда перегенерирует один курс.
+Генерации пользователей важнее: апгрейд идёт через ту же очередь
+admission от системного пользователя и стартует, только когда никто не
+ждёт. Записи берутся в аренду (claimed_until), поэтому два воркера не
+генерируют один курс; аренда упавшего воркера истекает сама.
+
+Клиент узнаёт о замене по полю status курса (и смене ETag) при опросе
+/api/courses/<id>. Курс, так и не получивший содержимое за
+UPGRADE_MAX_ATTEMPTS попыток, остаётся шаблоном со статусом fallback.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from contextlib import closing
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from .admission import AdmissionRejected
+from .metrics import COURSE_UPGRADES
+from .write_batcher import open_connection
+
+logger = logging.getLogger(__name__)
+
+UPGRADE_POLL_SECONDS = float(os.getenv("UPGRADE_POLL_SECONDS", "30"))
+UPGRADE_MAX_ATTEMPTS = int(os.getenv("UPGRADE_MAX_ATTEMPTS", "8"))
+# Пауза после неудачной попытки удваивается: 1, 2, 4 ... минут, но не больше часа
+UPGRADE_RETRY_BASE_SECONDS = float(os.getenv("UPGRADE_RETRY_BASE_SECONDS", "60"))
+UPGRADE_RETRY_MAX_SECONDS = float(os.getenv("UPGRADE_RETRY_MAX_SECONDS", "3600"))
+UPGRADE_LEASE_SECONDS = float(os.getenv("UPGRADE_LEASE_SECONDS", "900"))
+# Id пользователя в generation_jobs и rate_limits для фоновых генераций (настоящие id начинаются с 1)
+UPGRADE_USER_ID = 0
+
+# Статусы курса
+READY = "ready"
+PENDING_UPGRADE = "pending_upgrade"
+FALLBACK = "fallback"
+
+
+class PendingUpgrade(NamedTuple):
+    course_id: int
+    user_id: int
+    video_title: str
+    description: str
+    # None — источник хранится фрагментами (PDF-курс)
+    transcript: Optional[str]
+    attempts: int
+
+
+class UpgradeQueue:
+    """Template courses waiting for real content, and the loop that upgrades them."""
+
+    def __init__(
+        self,
+        db_path: str,
+        upgrade: Callable[[PendingUpgrade], Awaitable[bool]],
+        ready: Callable[[], bool],
+        interval: float = UPGRADE_POLL_SECONDS,
+    ):
+        """``upgrade`` regenerates one course (True if real content was stored);
+        ``ready`` tells whether the model is up and no user waits in the queue."""
+        self.db_path = db_path
+        self.interval = interval
+        self._upgrade = upgrade
+        self._ready = ready
+        self.upgraded = 0
+        self.failed = 0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def worker_id(self) -> str:
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def add_statement(self, course_id: int, user_id: int, video_title: str, description: str, transcript: Optional[str]):
+        """(sql, params) that queues a stored template course; run it through the shared writer."""
+        now = time.time()
+        return (
+            """
+            INSERT OR REPLACE INTO pending_upgrades
+                (course_id, user_id, video_title, description, transcript, attempts, next_attempt_at, created_at)
+            VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+            """,
+            (course_id, user_id, video_title, description, transcript, now, now),
+        )
+
+    def remove(self, conn, course_id: int):
+        """Forget a deleted course inside the caller's transaction."""
+        conn.execute("DELETE FROM pending_upgrades WHERE course_id = ?", (course_id,))
+
+    async def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> int:
+        """Upgrade due courses one by one while the model stays free; returns how many were tried."""
+        loop = asyncio.get_running_loop()
+        tried = 0
+        while await loop.run_in_executor(None, self._has_due):
+            if not await loop.run_in_executor(None, self._ready):
+                break
+            pending = await loop.run_in_executor(None, self._claim_sync)
+            if pending is None:
+                break
+            tried += 1
+            await self._attempt(pending)
+        return tried
+
+    def stats(self) -> dict:
+        with closing(open_connection(self.db_path)) as conn:
+            pending, next_at = conn.execute(
+                "SELECT COUNT(*), MIN(next_attempt_at) FROM pending_upgrades"
+            ).fetchone()
+        return {
+            "pending": pending,
+            "next_attempt_at": next_at,
+            "worker_upgraded": self.upgraded,
+            "worker_failed": self.failed,
+            "interval": self.interval,
+        }
+
+    async def _attempt(self, pending: PendingUpgrade):
+        loop = asyncio.get_running_loop()
+        try:
+            upgraded = await self._upgrade(pending)
+        except AdmissionRejected as e:
+            # Очередь заняли пользователи — это не неудачная попытка
+            COURSE_UPGRADES.inc(result="deferred")
+            await loop.run_in_executor(None, self._release_sync, pending.course_id, e.retry_after)
+            return
+        except Exception as e:
+            logger.exception("Ошибка апгрейда курса: %s", e, extra={"course_id": pending.course_id})
+            upgraded = False
+        if upgraded:
+            self.upgraded += 1
+            COURSE_UPGRADES.inc(result="upgraded")
+            logger.info("Шаблонный курс заменён", extra={"course_id": pending.course_id})
+            await loop.run_in_executor(None, self._done_sync, pending.course_id)
+            return
+        self.failed += 1
+        gave_up = await loop.run_in_executor(None, self._retry_sync, pending)
+        COURSE_UPGRADES.inc(result="gave_up" if gave_up else "retry")
+        if gave_up:
+            logger.warning("Курс так и остался шаблоном", extra={"course_id": pending.course_id})
+
+    async def _run_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.warning("Ошибка фонового апгрейда курсов: %s", e)
+
+    # --- Работа с базой, выполняется в потоках ---
+
+    def _has_due(self) -> bool:
+        now = time.time()
+        with closing(open_connection(self.db_path)) as conn:
+            return conn.execute(
+                """
+                SELECT 1 FROM pending_upgrades
+                WHERE next_attempt_at <= ? AND (claimed_until IS NULL OR claimed_until < ?)
+                LIMIT 1
+                """,
+                (now, now),
+            ).fetchone() is not None
+
+    def _claim_sync(self) -> Optional[PendingUpgrade]:
+        now = time.time()
+        with closing(open_connection(self.db_path)) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute(
+                    """
+                    SELECT course_id, user_id, video_title, description, transcript, attempts
+                    FROM pending_upgrades
+                    WHERE next_attempt_at <= ? AND (claimed_until IS NULL OR claimed_until < ?)
+                    ORDER BY next_attempt_at, course_id
+                    LIMIT 1
+                    """,
+                    (now, now),
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute(
+                    "UPDATE pending_upgrades SET claimed_by = ?, claimed_until = ? WHERE course_id = ?",
+                    (self.worker_id, now + UPGRADE_LEASE_SECONDS, row[0]),
+                )
+                conn.execute("COMMIT")
+                return PendingUpgrade(*row)
+            finally:
+                if conn.in_transaction:
+                    conn.execute("ROLLBACK")
+
+    def _release_sync(self, course_id: int, delay: float):
+        with closing(open_connection(self.db_path)) as conn:
+            conn.execute(
+                """
+                UPDATE pending_upgrades SET claimed_by = NULL, claimed_until = NULL, next_attempt_at = ?
+                WHERE course_id = ?
+                """,
+                (time.time() + delay, course_id),
+            )
+
+    def _done_sync(self, course_id: int):
+        with closing(open_connection(self.db_path)) as conn:
+            conn.execute("DELETE FROM pending_upgrades WHERE course_id = ?", (course_id,))
+
+    def _retry_sync(self, pending: PendingUpgrade) -> bool:
+        """Schedule the next attempt with exponential backoff; True if the course is given up."""
+        attempts = pending.attempts + 1
+        with closing(open_connection(self.db_path)) as conn:
+            if attempts >= UPGRADE_MAX_ATTEMPTS:
+                conn.execute("DELETE FROM pending_upgrades WHERE course_id = ?", (pending.course_id,))
+                conn.execute(
+                    "UPDATE courses SET status = ? WHERE id = ? AND status = ?",
+                    (FALLBACK, pending.course_id, PENDING_UPGRADE),
+                )
+                return True
+            delay = min(UPGRADE_RETRY_MAX_SECONDS, UPGRADE_RETRY_BASE_SECONDS * 2 ** pending.attempts)
+            conn.execute(
+                """
+                UPDATE pending_upgrades
+                SET attempts = ?, next_attempt_at = ?, claimed_by = NULL, claimed_until = NULL
+                WHERE course_id = ?
+                """,
+                (attempts, time.time() + delay, pending.course_id),
+            )
+            return False
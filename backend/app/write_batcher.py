@@ -0,0 +1,167 @@
+"""Group-commit writer for SQLite.
+
+Коррутины ставят INSERT/UPDATE в общую очередь, а один фоновый писатель
+собирает их в короткие транзакции: одна фиксация (и один fsync) на пачку
+вместо одной на каждую запись. Каждый вызывающий получает свой rowid.
+"""
+import asyncio
+import os
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Optional, Sequence
+
+from .metrics import stage_timer
+
+BATCH_MAX_SIZE = int(os.getenv("DB_BATCH_MAX_SIZE", "64"))
+BATCH_MAX_DELAY = float(os.getenv("DB_BATCH_MAX_DELAY_MS", "5")) / 1000.0
+
+WriteResult = namedtuple("WriteResult", ["lastrowid", "rowcount"])
+
+_STOP = object()
+
+
+def open_connection(db_path: str) -> sqlite3.Connection:
+    """Autocommit connection in WAL mode that waits for locks instead of failing"""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA busy_timeout=30000")
+    return conn
+
+
+class WriteBatcher:
+    """Collects writes from many coroutines and commits them in groups.
+
+    A batch is flushed as soon as it holds ``max_batch`` statements or
+    ``max_delay`` seconds have passed since its first statement arrived.
+    Every statement runs inside its own savepoint, so one failing write
+    only fails its own caller and never the rest of the batch.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_batch: int = BATCH_MAX_SIZE,
+        max_delay: float = BATCH_MAX_DELAY,
+    ):
+        self.db_path = db_path
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max(0.0, max_delay)
+        self.batches = 0
+        self.statements = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        # Один поток: соединение SQLite живёт и используется только в нём
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+
+    async def execute(self, sql: str, params: Sequence[Any] = ()) -> WriteResult:
+        """Queue a write and wait until the batch containing it is committed."""
+        self._ensure_started()
+        future = self._loop.create_future()
+        await self._queue.put((sql, tuple(params), future))
+        return await future
+
+    async def insert(self, sql: str, params: Sequence[Any] = ()) -> int:
+        """Queue an INSERT and return the id of the new row."""
+        result = await self.execute(sql, params)
+        return result.lastrowid
+
+    async def close(self):
+        """Flush everything still queued and stop the writer."""
+        if self._task is not None and not self._task.done():
+            await self._queue.put(_STOP)
+            await self._task
+        self._task = None
+        if self._conn is not None:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, self._conn.close
+            )
+            self._conn = None
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "statements": self.statements,
+            "avg_batch_size": round(self.statements / self.batches, 2) if self.batches else 0.0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            batch = [first]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                # Сначала забираем всё, что уже накопилось, пока шёл прошлый коммит
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                results = await loop.run_in_executor(self._executor, self._commit, batch)
+            except Exception as e:
+                results = [e] * len(batch)
+            for (_, _, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = open_connection(self.db_path)
+        return self._conn
+
+    def _commit(self, batch: List[tuple]) -> List[Any]:
+        with stage_timer("db_write"):
+            return self._commit_batch(batch)
+
+    def _commit_batch(self, batch: List[tuple]) -> List[Any]:
+        conn = self._connect()
+        results: List[Any] = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params, _ in batch:
+                conn.execute("SAVEPOINT write_item")
+                try:
+                    cursor = conn.execute(sql, params)
+                    results.append(WriteResult(cursor.lastrowid, cursor.rowcount))
+                    conn.execute("RELEASE write_item")
+                except sqlite3.Error as e:
+                    conn.execute("ROLLBACK TO write_item")
+                    conn.execute("RELEASE write_item")
+                    results.append(e)
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        self.batches += 1
+        self.statements += len(batch)
+        return results
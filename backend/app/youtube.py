@@ -1,7 +1,13 @@
-from youtube_transcript_api import YouTubeTranscriptApi
-from pytube import YouTube
+import logging
 import re
 
+from .metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# pytube и youtube_transcript_api импортируются при первом вызове,
+# чтобы не замедлять старт сервера
+
 def extract_video_id(url: str) -> str:
     """Extract YouTube video ID from URL"""
     patterns = [
@@ -24,6 +30,8 @@ def extract_video_id(url: str) -> str:
 def get_video_info(url: str) -> dict:
     """Get YouTube video information"""
     try:
+        from pytube import YouTube
+
         yt = YouTube(url)
         return {
             "title": yt.title,
@@ -38,8 +46,11 @@ def get_video_info(url: str) -> dict:
 def get_video_transcript(url: str) -> str:
     """Get YouTube video transcript"""
     try:
+        from youtube_transcript_api import YouTubeTranscriptApi
+
         video_id = extract_video_id(url)
-        transcript_list = YouTubeTranscriptApi.get_transcript(video_id, languages=['ru', 'en'])
+        with stage_timer("transcript"):
+            transcript_list = YouTubeTranscriptApi.get_transcript(video_id, languages=['ru', 'en'])
         
         # Combine all transcript parts
         full_transcript = " ".join([item['text'] for item in transcript_list])
@@ -47,5 +58,5 @@ def get_video_transcript(url: str) -> str:
     
     except Exception as e:
         # If no transcript available, return empty string
-        print(f"Transcript not available: {str(e)}")
+        logger.info("Transcript not available: %s", e)
         return ""
\ No newline at end of file
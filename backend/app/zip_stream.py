@@ -0,0 +1,83 @@
+"""ZIP archive written incrementally to a stream.
+
+zipfile умеет писать в поток без seek (с дескрипторами данных), поэтому
+архив отдаётся клиенту по мере добавления файлов: в памяти держится
+только текущая запись, а не весь архив.
+"""
+import io
+import re
+import zipfile
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, unseekable sink that collects bytes until drained."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        chunk = bytes(data)
+        self._chunks.append(chunk)
+        self._position += len(chunk)
+        return len(chunk)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _date_time(value: Any) -> Tuple[int, int, int, int, int, int]:
+    if isinstance(value, datetime):
+        moment = value
+    else:
+        try:
+            moment = datetime.fromisoformat(str(value)[:19])
+        except (TypeError, ValueError):
+            moment = datetime.now()
+    if moment.year < 1980:
+        moment = datetime(1980, 1, 1)
+    return moment.timetuple()[:6]
+
+
+def safe_name(value: str, max_length: int = 60) -> str:
+    """File-system friendly version of a course title"""
+    name = re.sub(r"[\\/:*?\"<>|\x00-\x1f]+", "_", value or "").strip(" ._")
+    return name[:max_length] or "course"
+
+
+class ZipStream:
+    def __init__(self):
+        self._sink = _ChunkSink()
+        self._zip = zipfile.ZipFile(
+            self._sink, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True
+        )
+
+    def add_bytes(self, name: str, data: bytes, modified: Optional[Any] = None) -> bytes:
+        """Add an entry and return the archive bytes produced so far."""
+        info = zipfile.ZipInfo(name, date_time=_date_time(modified))
+        info.compress_type = zipfile.ZIP_DEFLATED
+        self._zip.writestr(info, data)
+        return self._sink.drain()
+
+    def add_file(self, name: str, path: str) -> bytes:
+        # PDF уже сжат, повторное сжатие только тратит CPU
+        self._zip.write(path, arcname=name, compress_type=zipfile.ZIP_STORED)
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        """Write the central directory and return the final bytes."""
+        self._zip.close()
+        return self._sink.drain()
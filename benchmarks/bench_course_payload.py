@@ -0,0 +1,121 @@
+"""Benchmark: course detail payload size and serialization time.
+
+Сравнивает старый ответ (content строкой JSON внутри JSON, стандартный
+кодировщик) с разобранным содержимым, orjson и проекциями ``fields=``,
+которые использует course-detail.html. Время — медиана на один ответ,
+включая разбор сохранённого JSON.
+
+    python benchmarks/bench_course_payload.py --sections 60 --section-chars 4000 --quizzes 40
+"""
+import argparse
+import gzip
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from starlette.responses import JSONResponse as StdJSONResponse  # noqa: E402
+
+from backend.app import fast_json  # noqa: E402
+from backend.app.export import parse_course_content  # noqa: E402
+from backend.app.projection import parse_fields, project  # noqa: E402
+
+ALIASES = {"sections": "content.sections", "quizzes": "content.quizzes", "summary": "content.summary"}
+OUTLINE_FIELDS = "id,title,description,video_url,created_at,sections.title,summary"
+BODY_FIELDS = "sections.content,quizzes"
+
+
+def make_course(sections: int, section_chars: int, quizzes: int) -> str:
+    paragraph = "Содержание раздела с \"кавычками\", переносами\nи разметкой <b>курса</b>. "
+    content = {
+        "title": "Большой курс",
+        "description": "Курс для замера размера ответа",
+        "sections": [
+            {
+                "title": f"Раздел {i + 1}",
+                "content": (paragraph * (section_chars // len(paragraph) + 1))[:section_chars],
+                "key_points": [f"Пункт {j}" for j in range(5)],
+            }
+            for i in range(sections)
+        ],
+        "quizzes": [
+            {"question": f"Вопрос {i}?", "options": ["Вариант А", "Вариант Б", "Вариант В", "Вариант Г"], "correct_answer": i % 4}
+            for i in range(quizzes)
+        ],
+        "summary": "Итоговое резюме курса. " * 20,
+    }
+    return json.dumps(content, ensure_ascii=False)
+
+
+def row() -> dict:
+    return {
+        "id": 1,
+        "title": "Большой курс",
+        "description": "Курс для замера размера ответа",
+        "video_url": "https://youtu.be/x",
+        "video_title": "Видео",
+        "created_at": "2024-01-01 10:00:00",
+    }
+
+
+def variants(raw: str):
+    def legacy():
+        return StdJSONResponse({**row(), "content": raw}).body
+
+    def parsed_stdlib():
+        return StdJSONResponse({**row(), "content": parse_course_content(raw, "")}).body
+
+    def parsed_orjson():
+        return fast_json.JSONResponse({**row(), "content": parse_course_content(raw, "")}).body
+
+    def projected(fields):
+        tree = parse_fields(fields, ALIASES)
+
+        def render():
+            data = row()
+            if "content" in tree:
+                data["content"] = parse_course_content(raw, "")
+            return fast_json.JSONResponse(project(data, tree)).body
+
+        return render
+
+    return [
+        ("legacy: content as string, json", legacy),
+        ("parsed content, json", parsed_stdlib),
+        ("parsed content, orjson", parsed_orjson),
+        ("fields=outline, orjson", projected(OUTLINE_FIELDS)),
+        ("fields=body, orjson", projected(BODY_FIELDS)),
+    ]
+
+
+def measure(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sections", type=int, default=60)
+    parser.add_argument("--section-chars", type=int, default=4000)
+    parser.add_argument("--quizzes", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    raw = make_course(args.sections, args.section_chars, args.quizzes)
+    print(f"stored content: {len(raw.encode('utf-8')) / 1024:.1f} KiB, orjson: {fast_json.orjson is not None}")
+    print(f"{'variant':36} {'bytes':>10} {'gzip':>9} {'us/resp':>10}")
+    for name, func in variants(raw):
+        body = func()
+        micros = measure(func, args.repeat)
+        print(f"{name:36} {len(body):>10} {len(gzip.compress(body)):>9} {micros:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark: login throughput and event-loop latency with password hashing.
+
+Сравнивает проверку пароля прямо в event loop (как было раньше) и в
+выделенном пуле потоков. Параллельно крутится "лёгкий запрос", который
+каждую миллисекунду просыпается и замеряет задержку цикла событий.
+
+    python benchmarks/bench_password_hashing.py --logins 64 --concurrency 16 --rounds 10
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def probe_latency(stop: asyncio.Event, lags: list, interval: float = 0.001):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lags.append((loop.time() - started - interval) * 1000)
+
+
+async def run(mode: str, logins: int, concurrency: int, stored_hash: str, password: str):
+    from backend.app import passwords
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def login():
+        async with semaphore:
+            if mode == "inline":
+                ok, _ = passwords.verify_password(password, stored_hash)
+            else:
+                ok, _ = await passwords.verify_password_async(password, stored_hash)
+            assert ok
+
+    stop = asyncio.Event()
+    lags: list = []
+    probe = asyncio.create_task(probe_latency(stop, lags))
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+    return {
+        "mode": mode,
+        "logins_per_sec": round(logins / elapsed, 1),
+        "elapsed_s": round(elapsed, 3),
+        "loop_lag_p50_ms": round(percentile(lags, 50), 2),
+        "loop_lag_p99_ms": round(percentile(lags, 99), 2),
+        "loop_lag_max_ms": round(max(lags) if lags else 0.0, 2),
+        "loop_lag_mean_ms": round(statistics.mean(lags) if lags else 0.0, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--logins", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--rounds", type=int, default=None, help="bcrypt cost (PASSWORD_HASH_ROUNDS)")
+    parser.add_argument("--workers", type=int, default=None, help="PASSWORD_HASH_WORKERS")
+    args = parser.parse_args()
+
+    if args.rounds is not None:
+        os.environ["PASSWORD_HASH_ROUNDS"] = str(args.rounds)
+    if args.workers is not None:
+        os.environ["PASSWORD_HASH_WORKERS"] = str(args.workers)
+
+    from backend.app import passwords
+
+    password = "correct horse battery staple"
+    stored_hash = passwords.hash_password(password)
+    print(
+        f"bcrypt rounds={passwords.PASSWORD_HASH_ROUNDS} "
+        f"workers={passwords.PASSWORD_HASH_WORKERS} logins={args.logins} "
+        f"concurrency={args.concurrency}"
+    )
+    for mode in ("inline", "offloaded"):
+        result = asyncio.run(run(mode, args.logins, args.concurrency, stored_hash, password))
+        print(
+            f"{result['mode']:>10}: {result['logins_per_sec']:>8} logins/s  "
+            f"loop lag p50={result['loop_lag_p50_ms']}ms "
+            f"p99={result['loop_lag_p99_ms']}ms max={result['loop_lag_max_ms']}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""Startup budget check: import time of start.py and lifespan startup.
+
+Каждый воркер (и каждый перезапуск под gunicorn) платит за импорт
+приложения, поэтому время импорта держим в бюджете, а тяжёлые
+необязательные зависимости не должны загружаться при старте. Скрипт
+запускает `python -X importtime -c "import start"` в чистом процессе
+несколько раз, берёт медиану, проверяет, что ленивые модули не
+импортированы, и замеряет время lifespan-инициализации. Код возврата 1,
+если бюджет превышен, — так проверку можно поставить в CI.
+
+    python benchmarks/check_import_time.py --runs 5 --budget-ms 1000 --startup-budget-ms 300
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Импортируются только при первом использовании
+LAZY_MODULES = [
+    "uvicorn",
+    "requests",
+    "jinja2",
+    "passlib",
+    "PyPDF2",
+    "pdfkit",
+    "whisper",
+    "pytube",
+    "youtube_transcript_api",
+]
+
+_PROBE = """
+import asyncio, json, sys, time
+import start
+lazy = sorted(m for m in {lazy!r} if m in sys.modules)
+
+async def startup():
+    started = time.perf_counter()
+    async with start.lifespan(start.app):
+        elapsed = time.perf_counter() - started
+    return elapsed
+
+print(json.dumps({{"loaded_lazy": lazy, "startup_ms": asyncio.run(startup()) * 1000}}))
+"""
+
+
+def parse_importtime(stderr: str):
+    """Yield (module, self_us, cumulative_us) from -X importtime output."""
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue  # строка-заголовок
+        yield parts[2].strip(), self_us, cumulative_us
+
+
+def run_python(args, env):
+    return subprocess.run(
+        [sys.executable, *args], cwd=ROOT_DIR, env=env, capture_output=True, text=True, check=True
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "1000"))
+    )
+    parser.add_argument(
+        "--startup-budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", "300"))
+    )
+    parser.add_argument("--top", type=int, default=10, help="show the slowest imports")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        env = dict(
+            os.environ,
+            COURSEGEN_DB=os.path.join(work_dir, "startup.db"),
+            PDF_CACHE_DIR=os.path.join(work_dir, "courses"),
+            # lifespan пишет снимки метрик; без этого файл остался бы в дереве (и в образе)
+            METRICS_DIR=os.path.join(work_dir, "metrics"),
+            PROFILE_DIR=os.path.join(work_dir, "profiles"),
+            PYTHONDONTWRITEBYTECODE="1",
+        )
+        # Прогрев: байткод и файловый кеш, чтобы замерять именно импорт
+        run_python(["-c", "import start"], env)
+
+        totals = []
+        slowest = {}
+        for _ in range(args.runs):
+            result = run_python(["-X", "importtime", "-c", "import start"], env)
+            for module, _, cumulative_us in parse_importtime(result.stderr):
+                if module == "start":
+                    totals.append(cumulative_us / 1000)
+                else:
+                    slowest[module] = max(slowest.get(module, 0), cumulative_us / 1000)
+
+        probe = json.loads(
+            run_python(["-c", _PROBE.format(lazy=LAZY_MODULES)], env).stdout.strip().splitlines()[-1]
+        )
+
+    import_ms = statistics.median(totals)
+    report = {
+        "import_ms_median": round(import_ms, 1),
+        "import_ms_runs": [round(value, 1) for value in totals],
+        "import_budget_ms": args.budget_ms,
+        "startup_ms": round(probe["startup_ms"], 1),
+        "startup_budget_ms": args.startup_budget_ms,
+        "loaded_lazy_modules": probe["loaded_lazy"],
+        "slowest_imports_ms": dict(
+            sorted(
+                (
+                    (module, round(ms, 1))
+                    for module, ms in slowest.items()
+                    if "." not in module or module.startswith("backend.")
+                ),
+                key=lambda item: -item[1],
+            )[: args.top]
+        ),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    failures = []
+    if import_ms > args.budget_ms:
+        failures.append(f"import start: {import_ms:.0f} ms > {args.budget_ms:.0f} ms")
+    if probe["startup_ms"] > args.startup_budget_ms:
+        failures.append(f"lifespan startup: {probe['startup_ms']:.0f} ms > {args.startup_budget_ms:.0f} ms")
+    if probe["loaded_lazy"]:
+        failures.append(f"heavy modules imported at startup: {', '.join(probe['loaded_lazy'])}")
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""End-to-end load test against start:app with a stub model server.
+
+Поднимает stub_llm_server.py (OpenAI-совместимый, без реальной модели)
+и сервер через gunicorn на временной базе, регистрирует пользователей,
+добавляет им курсы и гоняет смесь реальных сценариев: регистрация, вход,
+список, карточка курса, генерация по видео, генерация из PDF, выгрузка
+ZIP. Последовательность операций детерминирована (--seed), а с
+--requests-per-client объём работы фиксирован, так что результаты разных
+коммитов сравнимы. Печатает JSON: пропускную способность и p50/p95/p99
+по каждому сценарию; --out сохраняет его в файл.
+
+    python benchmarks/load_test_e2e.py --duration 30 --clients 16
+    python benchmarks/load_test_e2e.py --requests-per-client 50 --out e2e.json --tokens-per-sec 0
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import requests
+
+from load_test_workers import ROOT_DIR, free_port, percentile, start_server, stop_server
+
+DEFAULT_MIX = "login=10,list=30,detail=30,generate=5,pdf=3,export=2,register=2"
+PASSWORD = "load-test-password"
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in OPERATIONS:
+            raise SystemExit(f"unknown operation in --mix: {name}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def make_pdf(lines, pages: int = 1) -> bytes:
+    """Minimal PDF with ASCII text on every page that PyPDF2 can extract."""
+    text = "BT /F1 12 Tf 50 780 Td 14 TL " + " ".join(
+        "(%s) '" % line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines
+    ) + " ET"
+    # 1 — каталог, 2 — дерево страниц, 3 — шрифт, затем пары (страница, поток)
+    kids = " ".join(f"{4 + 2 * page} 0 R" for page in range(pages))
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids.encode(), pages),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for page in range(pages):
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents %d 0 R"
+            b" /Resources << /Font << /F1 3 0 R >> >> >>" % (5 + 2 * page)
+        )
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(text), text.encode("latin-1")))
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+PDF_FIXTURE = make_pdf(
+    [f"Lecture notes, paragraph {i}: gradient descent, loss functions and evaluation." for i in range(40)]
+)
+
+
+def start_stub(args, port: int) -> subprocess.Popen:
+    command = [
+        sys.executable,
+        os.path.join(ROOT_DIR, "benchmarks", "stub_llm_server.py"),
+        "--port", str(port),
+        "--ttft-ms", str(args.ttft_ms),
+        "--tokens-per-sec", str(args.tokens_per_sec),
+        "--error-rate", str(args.error_rate),
+        "--truncate-rate", str(args.truncate_rate),
+        "--seed", str(args.seed),
+    ]
+    if args.replay:
+        command += ["--replay", args.replay]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/v1/models", timeout=1).ok:
+                return process
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("stub model server did not start")
+
+
+def seed_users(base_url: str, db_path: str, users: int, courses: int):
+    content = json.dumps(
+        {
+            "title": "Нагрузочный курс",
+            "description": "Курс для нагрузочного теста",
+            "sections": [
+                {"title": f"Раздел {i}", "content": "Текст раздела. " * 40, "key_points": ["a", "b", "c"]}
+                for i in range(5)
+            ],
+            "quizzes": [{"question": "Вопрос?", "options": ["1", "2", "3", "4"], "correct_answer": 0}] * 10,
+            "summary": "Итог",
+        },
+        ensure_ascii=False,
+    )
+    accounts = []
+    conn = sqlite3.connect(db_path)
+    for n in range(users):
+        email = f"load{n}@test.local"
+        response = requests.post(
+            f"{base_url}/api/register",
+            data={"email": email, "password": PASSWORD, "first_name": "Load", "last_name": str(n)},
+        )
+        response.raise_for_status()
+        user_id = response.json()["user_id"]
+        conn.executemany(
+            "INSERT INTO courses (title, description, video_url, video_title, content, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+            [(f"Курс {i}", "Описание", "https://youtu.be/x", "Видео", content, user_id) for i in range(courses)],
+        )
+        conn.commit()
+        ids = [row[0] for row in conn.execute("SELECT id FROM courses WHERE user_id = ?", (user_id,))]
+        accounts.append({"email": email, "token": response.json()["access_token"], "course_ids": ids})
+    conn.close()
+    return accounts
+
+
+# Каждая операция возвращает HTTP-статус последнего запроса сценария
+def op_register(session, base_url, account, rng, tag):
+    return session.post(
+        f"{base_url}/api/register",
+        data={"email": f"new-{tag}@test.local", "password": PASSWORD, "first_name": "New", "last_name": "User"},
+    ).status_code
+
+
+def op_login(session, base_url, account, rng, tag):
+    return session.post(
+        f"{base_url}/api/login", data={"email": account["email"], "password": PASSWORD}
+    ).status_code
+
+
+def op_list(session, base_url, account, rng, tag):
+    return session.get(f"{base_url}/api/courses").status_code
+
+
+def op_detail(session, base_url, account, rng, tag):
+    course_id = rng.choice(account["course_ids"])
+    return session.get(f"{base_url}/api/courses/{course_id}").status_code
+
+
+def op_generate(session, base_url, account, rng, tag):
+    return session.post(
+        f"{base_url}/api/generate-course", data={"video_url": f"https://youtu.be/load{rng.randint(1, 10**6)}"}
+    ).status_code
+
+
+def op_pdf(session, base_url, account, rng, tag):
+    return session.post(
+        f"{base_url}/api/generate-course-from-pdf",
+        files={"pdf": ("lecture.pdf", PDF_FIXTURE, "application/pdf")},
+        # Фикстура всегда одна и та же: без dedup=off все загрузки после первой давали бы 409
+        data={"dedup": "off"},
+    ).status_code
+
+
+def op_export(session, base_url, account, rng, tag):
+    response = session.post(f"{base_url}/api/export/ticket")
+    if response.status_code != 200:
+        return response.status_code
+    with session.get(base_url + response.json()["url"], stream=True) as archive:
+        for _ in archive.iter_content(64 * 1024):
+            pass
+        return archive.status_code
+
+
+OPERATIONS = {
+    "register": op_register,
+    "login": op_login,
+    "list": op_list,
+    "detail": op_detail,
+    "generate": op_generate,
+    "pdf": op_pdf,
+    "export": op_export,
+}
+
+
+def client_process(base_url, accounts, mix, threads, duration, requests_per_client, seed, proc):
+    """Runs in a separate process so the client side does not cap throughput."""
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    results = {name: {"latencies": [], "errors": 0, "throttled": 0} for name in names}
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker(thread: int):
+        rng = random.Random(seed * 10_000 + proc * 100 + thread)
+        account = accounts[(proc * threads + thread) % len(accounts)]
+        session = requests.Session()
+        session.headers["Authorization"] = f"Bearer {account['token']}"
+        local = {name: {"latencies": [], "errors": 0, "throttled": 0} for name in names}
+        done = 0
+        while (done < requests_per_client) if requests_per_client else (time.perf_counter() < stop_at):
+            name = rng.choices(names, weights)[0]
+            done += 1
+            started = time.perf_counter()
+            try:
+                status = OPERATIONS[name](session, base_url, account, rng, f"{seed}-{proc}-{thread}-{done}")
+            except requests.RequestException:
+                status = 0
+            if status == 200:
+                local[name]["latencies"].append((time.perf_counter() - started) * 1000)
+            elif status == 429:
+                local[name]["throttled"] += 1
+            else:
+                local[name]["errors"] += 1
+        with lock:
+            for name, values in local.items():
+                results[name]["latencies"].extend(values["latencies"])
+                results[name]["errors"] += values["errors"]
+                results[name]["throttled"] += values["throttled"]
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return results
+
+
+def summarize(name: str, latencies, errors: int, throttled: int, elapsed: float) -> dict:
+    return {
+        "endpoint": name,
+        "ok": len(latencies),
+        "errors": errors,
+        "throttled": throttled,
+        "rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args) -> dict:
+    mix = parse_mix(args.mix)
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_path = os.path.join(work_dir, "e2e.db")
+        stub_port, app_port = free_port(), free_port()
+        stub = start_stub(args, stub_port)
+        limits = {} if args.keep_limits else {
+            # Иначе почти все генерации упрутся в персональные лимиты
+            "GEN_USER_MAX_CONCURRENT": "1000",
+            "GEN_USER_BURST": "1000000",
+            "GEN_USER_RATE_PER_MIN": "1000000",
+            "GEN_MAX_QUEUED": "1000",
+        }
+        server = start_server(
+            args.workers,
+            app_port,
+            db_path,
+            work_dir,
+            extra_env={
+                "QWEN_API_URL": f"http://127.0.0.1:{stub_port}/v1",
+                "GEN_MAX_IN_FLIGHT": str(args.gen_max_in_flight),
+                "METRICS_DIR": os.path.join(work_dir, "metrics"),
+                "LOG_LEVEL": "WARNING",
+                **limits,
+            },
+        )
+        base_url = f"http://127.0.0.1:{app_port}"
+        try:
+            accounts = seed_users(base_url, db_path, args.users, args.courses)
+            per_process = max(1, args.clients // args.client_procs)
+            started = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=args.client_procs) as pool:
+                futures = [
+                    pool.submit(
+                        client_process, base_url, accounts, mix, per_process,
+                        args.duration, args.requests_per_client, args.seed, proc,
+                    )
+                    for proc in range(args.client_procs)
+                ]
+                results = [future.result() for future in futures]
+            elapsed = time.perf_counter() - started
+            stub_stats = requests.get(f"http://127.0.0.1:{stub_port}/stats", timeout=5).json()
+        finally:
+            stop_server(server)
+            stub.terminate()
+            stub.wait(timeout=10)
+
+    endpoints = []
+    all_latencies = []
+    total_errors = total_throttled = 0
+    for name in mix:
+        latencies = [value for result in results for value in result[name]["latencies"]]
+        errors = sum(result[name]["errors"] for result in results)
+        throttled = sum(result[name]["throttled"] for result in results)
+        all_latencies.extend(latencies)
+        total_errors += errors
+        total_throttled += throttled
+        endpoints.append(summarize(name, latencies, errors, throttled, elapsed))
+    return {
+        "commit": git_commit(),
+        "config": {
+            key: getattr(args, key)
+            for key in ("workers", "clients", "client_procs", "duration", "requests_per_client", "mix",
+                        "seed", "ttft_ms", "tokens_per_sec", "error_rate", "truncate_rate", "replay",
+                        "gen_max_in_flight", "keep_limits")
+        },
+        "elapsed_seconds": round(elapsed, 2),
+        "total": summarize("total", all_latencies, total_errors, total_throttled, elapsed),
+        "endpoints": endpoints,
+        "stub": stub_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--clients", type=int, default=16, help="concurrent connections in total")
+    parser.add_argument("--client-procs", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--requests-per-client", type=int, default=0, help="fixed work instead of --duration")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="operation=weight,...")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--courses", type=int, default=20, help="seeded courses per user")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--gen-max-in-flight", type=int, default=1)
+    parser.add_argument("--keep-limits", action="store_true", help="keep per-user generation limits")
+    parser.add_argument("--ttft-ms", type=float, default=200.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=400.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument("--replay", help="JSONL with recorded model responses")
+    parser.add_argument("--out", help="write the JSON report to this file")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
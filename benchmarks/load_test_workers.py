@@ -0,0 +1,211 @@
+"""Load test: production server throughput with a growing number of workers.
+
+Для каждого значения --workers поднимает gunicorn (gunicorn.conf.py) на
+временной базе, регистрирует пользователя, добавляет ему курсы и гоняет
+смесь запросов (список курсов, карточка курса, HTML-страница) из
+нескольких клиентских процессов. Печатает запросы/с и перцентили
+задержки; на машине с несколькими ядрами пропускная способность должна
+расти почти линейно до числа ядер.
+
+    python benchmarks/load_test_workers.py --workers 1 2 4 --duration 10 --clients 32
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import requests
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(
+    workers: int, port: int, db_path: str, work_dir: str, extra_env: Optional[dict] = None
+) -> subprocess.Popen:
+    env = dict(
+        os.environ,
+        WEB_CONCURRENCY=str(workers),
+        BIND=f"127.0.0.1:{port}",
+        COURSEGEN_DB=db_path,
+        PDF_CACHE_DIR=os.path.join(work_dir, "courses"),
+        PASSWORD_HASH_ROUNDS="4",
+        **(extra_env or {}),
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "start:app"],
+        cwd=ROOT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/login", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("server did not start in time")
+
+
+def stop_server(process: subprocess.Popen):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def seed(base_url: str, db_path: str, courses: int) -> str:
+    response = requests.post(
+        f"{base_url}/api/register",
+        data={"email": "load@test.local", "password": "load", "first_name": "Load", "last_name": "Test"},
+    )
+    response.raise_for_status()
+    token = response.json()["access_token"]
+    user_id = response.json()["user_id"]
+    content = {
+        "title": "Нагрузочный курс",
+        "description": "Курс для нагрузочного теста",
+        "sections": [
+            {"title": f"Раздел {i}", "content": "Текст раздела. " * 40, "key_points": ["a", "b", "c"]}
+            for i in range(5)
+        ],
+        "quizzes": [{"question": "Вопрос?", "options": ["1", "2", "3"], "correct_answer": 0}],
+        "summary": "Итог",
+    }
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO courses (title, description, video_url, video_title, content, user_id) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (f"Курс {i}", "Описание", "https://youtu.be/x", "Видео", json.dumps(content, ensure_ascii=False), user_id)
+            for i in range(courses)
+        ],
+    )
+    conn.commit()
+    conn.close()
+    return token
+
+
+def client_process(base_url: str, token: str, threads: int, duration: float):
+    """Runs in a separate process so the client side does not cap throughput."""
+    headers = {"Authorization": f"Bearer {token}", "Accept-Encoding": "gzip"}
+    paths = ["/api/courses", "/api/courses/1", "/my-courses"]
+    latencies = {path: [] for path in paths}
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker(offset: int):
+        session = requests.Session()
+        local = {path: [] for path in paths}
+        local_errors = 0
+        i = offset
+        while time.perf_counter() < stop_at:
+            path = paths[i % len(paths)]
+            i += 1
+            started = time.perf_counter()
+            try:
+                ok = session.get(base_url + path, headers=headers, timeout=30).status_code == 200
+            except requests.RequestException:
+                ok = False
+            if ok:
+                local[path].append((time.perf_counter() - started) * 1000)
+            else:
+                local_errors += 1
+        with lock:
+            for path, values in local.items():
+                latencies[path].extend(values)
+            errors[0] += local_errors
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return latencies, errors[0]
+
+
+def run(workers: int, args) -> dict:
+    with tempfile.TemporaryDirectory() as work_dir:
+        db_path = os.path.join(work_dir, "load.db")
+        port = free_port()
+        server = start_server(workers, port, db_path, work_dir)
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            token = seed(base_url, db_path, args.courses)
+            per_process = max(1, args.clients // args.client_procs)
+            with ProcessPoolExecutor(max_workers=args.client_procs) as pool:
+                futures = [
+                    pool.submit(client_process, base_url, token, per_process, args.duration)
+                    for _ in range(args.client_procs)
+                ]
+                results = [future.result() for future in futures]
+        finally:
+            stop_server(server)
+    merged = {}
+    errors = 0
+    for latencies, failed in results:
+        errors += failed
+        for path, values in latencies.items():
+            merged.setdefault(path, []).extend(values)
+    everything = [value for values in merged.values() for value in values]
+    return {
+        "workers": workers,
+        "requests": len(everything),
+        "rps": round(len(everything) / args.duration, 1),
+        "p50_ms": round(percentile(everything, 50), 2),
+        "p95_ms": round(percentile(everything, 95), 2),
+        "p99_ms": round(percentile(everything, 99), 2),
+        "errors": errors,
+        "per_path_p95_ms": {path: round(percentile(values, 95), 2) for path, values in merged.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--clients", type=int, default=32, help="concurrent connections in total")
+    parser.add_argument("--client-procs", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    parser.add_argument("--courses", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"CPU cores: {os.cpu_count()}, clients: {args.clients} in {args.client_procs} processes")
+    baseline = None
+    for workers in args.workers:
+        result = run(workers, args)
+        baseline = baseline or result["rps"]
+        result["speedup"] = round(result["rps"] / baseline, 2) if baseline else 0.0
+        print(json.dumps(result, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""Microbenchmarks of the CPU-bound hot functions, with a regression check.
+
+Каждый бенчмарк калибруется так, чтобы один замер длился не меньше
+--min-time, повторяется --repeat раз; в отчёт идёт медиана времени на
+вызов. Результаты сохраняются в JSON (--out), а режим --compare
+сравнивает два файла и возвращает код 1, если медиана выросла больше
+чем на --threshold процентов.
+
+    python benchmarks/microbench.py --out base.json
+    python benchmarks/microbench.py --out new.json --filter parse
+    python benchmarks/microbench.py --compare base.json new.json --threshold 10
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT_DIR)
+# Предупреждения о fallback-ответах не должны попадать в замеры и вывод
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+from load_test_e2e import make_pdf  # noqa: E402
+
+
+def course_json(sections: int = 6, quizzes: int = 10) -> str:
+    return json.dumps(
+        {
+            "title": "Машинное обучение",
+            "description": "Введение в тему. " * 8,
+            "sections": [
+                {"title": f"Раздел {i}", "content": "Подробный текст раздела с примерами. " * 15}
+                for i in range(sections)
+            ],
+            "quizzes": [
+                {"question": f"Вопрос {i}?", "options": ["А", "Б", "В", "Г"], "correct_answer": i % 4}
+                for i in range(quizzes)
+            ],
+            "summary": "Итоговое резюме курса. " * 5,
+        },
+        ensure_ascii=False,
+    )
+
+
+def build_benchmarks():
+    """name -> zero-argument callable."""
+    import start
+    from backend.app.export import render_stored_course
+    from backend.app.passages import select_passages
+    from backend.app.passwords import hash_password
+    from backend.app.youtube import extract_video_id
+
+    client = start.QwenAIClient()
+    transcript = ("Сегодня разбираем градиентный спуск и функции потерь. " * 200)[:4000]
+    good = course_json()
+
+    def response(content):
+        return {"choices": [{"message": {"content": content}}], "usage": {"completion_tokens": 900}}
+
+    responses = {
+        "good": response(good),
+        "fenced": response(f"Вот курс:\n```json\n{good}\n```"),
+        "truncated": response(good[: int(len(good) * 0.8)]),
+        "bad": response("Извините, я не могу создать курс по этому видео."),
+    }
+    urls = [
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=42s",
+        "https://youtu.be/dQw4w9WgXcQ?si=abc",
+        "https://www.youtube.com/embed/dQw4w9WgXcQ",
+        "not a url at all",
+    ]
+
+    def video_ids():
+        for url in urls:
+            try:
+                extract_video_id(url)
+            except ValueError:
+                pass
+
+    lines = [f"Lecture notes, paragraph {i}: gradient descent, loss functions and evaluation." for i in range(40)]
+    token = start.create_access_token("bench@test.local")
+
+    benchmarks = {
+        "prompt_build": lambda: client._create_course_prompt("Видео о машинном обучении", transcript, "Описание"),
+        "export_html": lambda: render_stored_course("Машинное обучение", good, "2024-01-01 10:00:00"),
+        "extract_video_id": video_ids,
+        "jwt_encode": lambda: start.create_access_token("bench@test.local"),
+        "jwt_decode": lambda: start.decode_token(token),
+        "hash_password": lambda: hash_password("correct horse battery staple"),
+    }
+    for kind, payload in responses.items():
+        benchmarks[f"parse_response_{kind}"] = (lambda payload=payload: client._parse_ai_response(payload, "Видео"))
+    topics = ["градиентный спуск", "функции потерь", "переобучение", "метрики качества", "нейронные сети"]
+    for size in (50_000, 1_000_000):
+        source = " ".join(
+            f"В этой части лекции обсуждаем {topics[i * 5 // 400]}, пример номер {i}." for i in range(400)
+        )
+        source = (source * (size // len(source) + 1))[:size]
+        benchmarks[f"passage_select_{size // 1000}k"] = (
+            lambda source=source: select_passages(source, 4000, query="Машинное обучение")
+        )
+    for pages in (1, 10, 50):
+        document = make_pdf(lines, pages)
+        benchmarks[f"pdf_extract_{pages}p"] = lambda document=document: start.extract_pdf_text(document)
+    return benchmarks
+
+
+def measure(func, repeat: int, min_time: float) -> dict:
+    func()  # прогрев: ленивые импорты, кеши
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    timings = [elapsed / loops]
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - started) / loops)
+    median = statistics.median(timings)
+    return {
+        "median_us": round(median * 1e6, 3),
+        "min_us": round(min(timings) * 1e6, 3),
+        "stdev_pct": round(statistics.pstdev(timings) / median * 100, 2) if median else 0.0,
+        "loops": loops,
+        "repeat": repeat,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(args) -> dict:
+    pattern = re.compile(args.filter) if args.filter else None
+    results = {}
+    for name, func in build_benchmarks().items():
+        if pattern and not pattern.search(name):
+            continue
+        results[name] = measure(func, args.repeat, args.min_time)
+        print(f"{name:28} {results[name]['median_us']:>14.1f} us  ±{results[name]['stdev_pct']:.1f}%", file=sys.stderr)
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        # Стоимость bcrypt задаётся окружением и сильно влияет на hash_password
+        "password_hash_rounds": os.getenv("PASSWORD_HASH_ROUNDS", "default"),
+        "results": results,
+    }
+
+
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"base {base.get('commit')} -> new {new.get('commit')}, threshold {threshold:.1f}%")
+    print(f"{'benchmark':28} {'base us':>12} {'new us':>12} {'change':>9}")
+    regressions = []
+    for name in sorted(set(base["results"]) | set(new["results"])):
+        old_result, new_result = base["results"].get(name), new["results"].get(name)
+        if old_result is None or new_result is None:
+            print(f"{name:28} {'only in ' + ('new' if old_result is None else 'base'):>35}")
+            continue
+        change = (new_result["median_us"] / old_result["median_us"] - 1) * 100 if old_result["median_us"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif change < -threshold:
+            flag = "  faster"
+        print(f"{name:28} {old_result['median_us']:>12.1f} {new_result['median_us']:>12.1f} {change:>+8.1f}%{flag}")
+    if base.get("password_hash_rounds") != new.get("password_hash_rounds"):
+        print("note: PASSWORD_HASH_ROUNDS differs between runs, hash_password is not comparable")
+    if regressions:
+        print(f"FAIL {len(regressions)} regression(s): {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--out", help="write results to this JSON file")
+    parser.add_argument("--filter", help="regex of benchmark names to run")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per measurement")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two result files")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold, percent")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+"""Stub OpenAI-compatible model server for offline load tests.
+
+Отвечает на /v1/models и /v1/chat/completions так же, как LM Studio:
+с потоком (SSE, include_usage) и без. Ответ — валидный JSON курса,
+который собирается детерминированно из --seed и номера запроса, поэтому
+прогоны на разных коммитах сравнимы. Задержка до первого токена,
+скорость генерации, доля ошибок и оборванных ответов (finish_reason
+"length") настраиваются; --replay отдаёт по кругу записанные ответы
+(JSONL: {"content": "..."} или полный ответ chat/completions).
+
+    python benchmarks/stub_llm_server.py --port 1234 --ttft-ms 300 --tokens-per-sec 60
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Примерно столько символов русского текста приходится на токен
+CHARS_PER_TOKEN = 4
+
+
+def make_course(rng: random.Random, sections: int, quizzes: int) -> str:
+    words = ["модель", "данные", "обучение", "пример", "метод", "задача", "результат", "анализ"]
+
+    def sentence(n=12):
+        return " ".join(rng.choice(words) for _ in range(n)).capitalize() + "."
+
+    course = {
+        "title": f"Курс {rng.randint(1, 10**6)}",
+        "description": " ".join(sentence() for _ in range(6)),
+        "sections": [
+            {"title": f"Раздел {i + 1}", "content": " ".join(sentence() for _ in range(10))}
+            for i in range(sections)
+        ],
+        "quizzes": [
+            {
+                "question": sentence(6)[:-1] + "?",
+                "options": [sentence(3) for _ in range(4)],
+                "correct_answer": rng.randint(0, 3),
+            }
+            for _ in range(quizzes)
+        ],
+        "summary": " ".join(sentence() for _ in range(4)),
+    }
+    return json.dumps(course, ensure_ascii=False)
+
+
+def load_replay(path: str):
+    contents = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if "choices" in record:
+                record = {"content": record["choices"][0]["message"]["content"]}
+            contents.append(record["content"])
+    if not contents:
+        raise SystemExit(f"{path}: no recorded responses")
+    return contents
+
+
+class StubState:
+    def __init__(self, args):
+        self.args = args
+        self.counter = itertools.count()
+        self.replay = load_replay(args.replay) if args.replay else None
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "truncated": 0, "streamed": 0}
+
+    def next_response(self):
+        """(content, error, truncated) for the next request, deterministic by request number."""
+        number = next(self.counter)
+        rng = random.Random(self.args.seed * 1_000_003 + number)
+        if rng.random() < self.args.error_rate:
+            return None, True, False
+        if self.replay is not None:
+            content = self.replay[number % len(self.replay)]
+        else:
+            content = make_course(rng, self.args.sections, self.args.quizzes)
+        truncated = rng.random() < self.args.truncate_rate
+        if truncated:
+            content = content[: int(len(content) * rng.uniform(0.5, 0.95))]
+        return content, False, truncated
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: StubState = None
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status: int, payload: dict):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self._json(200, {"object": "list", "data": [{"id": "stub-model", "object": "model"}]})
+        elif self.path == "/stats":
+            self._json(200, self.state.stats)
+        else:
+            self._json(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._json(404, {"error": "not found"})
+            return
+        state = self.state
+        args = state.args
+        content, error, truncated = state.next_response()
+        with state.lock:
+            state.stats["requests"] += 1
+            state.stats["errors"] += error
+            state.stats["truncated"] += truncated
+            state.stats["streamed"] += bool(request.get("stream"))
+        time.sleep(args.ttft_ms / 1000)
+        if error:
+            self._json(500, {"error": {"message": "stub failure"}})
+            return
+        prompt_chars = sum(len(m.get("content", "")) for m in request.get("messages", []))
+        tokens = [content[i:i + CHARS_PER_TOKEN] for i in range(0, len(content), CHARS_PER_TOKEN)]
+        usage = {
+            "prompt_tokens": prompt_chars // CHARS_PER_TOKEN,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_chars // CHARS_PER_TOKEN + len(tokens),
+        }
+        finish_reason = "length" if truncated else "stop"
+        delay = 1.0 / args.tokens_per_sec if args.tokens_per_sec > 0 else 0.0
+        if not request.get("stream"):
+            time.sleep(delay * len(tokens))
+            self._json(200, {
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": finish_reason}],
+                "usage": usage,
+            })
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(payload):
+            data = b"data: " + (payload if isinstance(payload, bytes) else json.dumps(payload, ensure_ascii=False).encode("utf-8")) + b"\n\n"
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+        # Пачками, чтобы не упираться в системные вызовы на каждый токен
+        batch = max(1, args.tokens_per_flush)
+        started = time.perf_counter()
+        for index in range(0, len(tokens), batch):
+            for token in tokens[index:index + batch]:
+                event({"object": "chat.completion.chunk",
+                       "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}]})
+            self.wfile.flush()
+            wait = started + delay * (index + batch) - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        event({"object": "chat.completion.chunk",
+               "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+        if (request.get("stream_options") or {}).get("include_usage"):
+            event({"object": "chat.completion.chunk", "choices": [], "usage": usage})
+        event(b"[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--ttft-ms", type=float, default=200.0, help="delay before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0, help="0 = no generation delay")
+    parser.add_argument("--tokens-per-flush", type=int, default=8)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of HTTP 500 answers")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="share of answers cut at max_tokens")
+    parser.add_argument("--sections", type=int, default=4)
+    parser.add_argument("--quizzes", type=int, default=10)
+    parser.add_argument("--replay", help="JSONL file with recorded responses")
+    parser.add_argument("--seed", type=int, default=1)
+    return parser
+
+
+def serve(args) -> ThreadingHTTPServer:
+    """Start the stub in a background thread (used by the load test)."""
+    handler = type("StubHandler", (Handler,), {"state": StubState(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    args = build_parser().parse_args()
+    server = serve(args)
+    print(f"stub model server on http://{args.host}:{server.server_port}/v1")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
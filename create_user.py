@@ -1,11 +1,8 @@
 import os
 import sqlite3
-import hashlib
 import getpass
 
-
-def hash_password(password: str, salt: str) -> str:
-    return hashlib.sha256((password + salt).encode()).hexdigest()
+from backend.app.passwords import hash_password
 
 
 def init_database():
@@ -41,13 +38,13 @@ def init_database():
     conn.close()
 
 
-def create_or_update_user(email: str, password: str, first_name: str = None, last_name: str = None, salt: str = "coursegen-salt"):
+def create_or_update_user(email: str, password: str, first_name: str = None, last_name: str = None):
     """Create user or update password if user exists."""
     init_database()
     conn = sqlite3.connect('coursegen.db')
     cursor = conn.cursor()
 
-    hashed = hash_password(password, salt)
+    hashed = hash_password(password)
 
     try:
         cursor.execute('''
@@ -70,7 +67,6 @@ def main():
     # Prefer environment variables for automation
     admin_email = os.getenv("ADMIN_EMAIL")
     admin_password = os.getenv("ADMIN_PASSWORD")
-    password_salt = os.getenv("PASSWORD_SALT", "coursegen-salt")
 
     if not admin_email or not admin_password:
         print("Нет переменных окружения ADMIN_EMAIL/ADMIN_PASSWORD.")
@@ -86,7 +82,7 @@ def main():
         print("Email и пароль обязательны. Прерывание.")
         return
 
-    create_or_update_user(admin_email, admin_password, first_name=None, last_name=None, salt=password_salt)
+    create_or_update_user(admin_email, admin_password, first_name=None, last_name=None)
 
 
 if __name__ == "__main__":
@@ -241,11 +241,11 @@ window.handleCourseCreation = async function () {
 
             if (response.ok) {
                 if (data.success) {
-                    showResult(`✅ Курс "${data.title}" успешно создан! Перенаправление...`, 'success');
+                    showResult(courseCreatedMessage(data), data.status === 'pending_upgrade' ? 'info' : 'success');
 
                     setTimeout(() => {
                         window.location.href = '/my-courses';
-                    }, 2000);
+                    }, data.status === 'pending_upgrade' ? 4000 : 2000);
                 } else {
                     showResult('❌ Ошибка при создании курса: ' + (data.detail || 'Неизвестная ошибка'), 'error');
                 }
@@ -265,6 +265,17 @@ window.handleCourseCreation = async function () {
     }
 };
 
+// Черновой курс (модель недоступна) уже сохранён, но его содержимое заменится позже
+function courseCreatedMessage(data) {
+    if (data.ai_used === 'duplicate') {
+        return `✅ ${data.message}. Перенаправление...`;
+    }
+    if (data.status === 'pending_upgrade') {
+        return `⏳ ${data.message || 'Сохранён черновой курс, он обновится автоматически'}. Перенаправление...`;
+    }
+    return `✅ Курс "${data.title}" успешно создан! Перенаправление...`;
+}
+
 // Функция для кнопки на главной странице
 window.handleMainPageCourseCreation = async function () {
     console.log('handleMainPageCourseCreation called');
@@ -533,10 +544,67 @@ function displayCourses(courses) {
     } else if (layoutContainer) {
         layoutContainer.appendChild(coursesGrid);
     }
+    window.watchCourseList(courses);
 
     showResult(`✅ Загружено ${courses.length} курсов`, 'success');
 }
 
+// Статусы курса: pending_upgrade — черновой шаблон, сервер заменит его, когда модель
+// освободится; fallback — замена так и не удалась
+const COURSE_STATUS_POLL_MS = 15000;
+
+window.courseStatusBadge = function (status) {
+    if (status === 'pending_upgrade') {
+        return `<span class="inline-flex items-center gap-1 rounded-full bg-amber-100 px-2 py-0.5 text-xs font-bold text-amber-800" title="Курс обновится автоматически">
+            <span class="material-symbols-outlined text-sm animate-spin">progress_activity</span>Черновик, обновляется</span>`;
+    }
+    if (status === 'fallback') {
+        return `<span class="inline-flex items-center gap-1 rounded-full bg-gray-100 px-2 py-0.5 text-xs font-bold text-graphite-gray" title="Модель не смогла обновить курс">
+            <span class="material-symbols-outlined text-sm">draft</span>Черновик</span>`;
+    }
+    return '';
+};
+
+// Опрашивает статус курса, пока он pending_upgrade; onChange получает новый статус
+window.watchCourseStatus = function (courseId, onChange) {
+    const poll = async function () {
+        const token = localStorage.getItem('access_token');
+        if (!token) return;
+        try {
+            const response = await fetch(`/api/courses/${courseId}?fields=status`, {
+                headers: { 'Authorization': `Bearer ${token}` }
+            });
+            if (response.ok) {
+                const data = await response.json();
+                if (data.status !== 'pending_upgrade') {
+                    onChange(data.status);
+                    return;
+                }
+            } else if (response.status === 404) {
+                return;
+            }
+        } catch (error) {
+            console.error('Course status check failed:', error);
+        }
+        setTimeout(poll, COURSE_STATUS_POLL_MS);
+    };
+    setTimeout(poll, COURSE_STATUS_POLL_MS);
+};
+
+// Перезагружает список курсов, когда черновые курсы в нём обновились
+let courseListWatched = false;
+window.watchCourseList = function (courses) {
+    if (courseListWatched) return;
+    (courses || []).filter(course => course.status === 'pending_upgrade').forEach(course => {
+        courseListWatched = true;
+        window.watchCourseStatus(course.id, function () {
+            if (!courseListWatched) return;
+            courseListWatched = false;
+            loadUserCourses();
+        });
+    });
+};
+
 function createCourseCard(course) {
     const card = document.createElement('div');
     card.className = 'bg-white rounded-xl border border-graphite-gray/20 p-6 hover:shadow-lg transition-shadow';
@@ -558,6 +626,7 @@ function createCourseCard(course) {
             <h3 class="text-lg font-bold text-cobblestone-blue">${course.title || 'Без названия'}</h3>
             <span class="material-symbols-outlined text-primary">school</span>
         </div>
+        ${course.status && course.status !== 'ready' ? `<div class="mb-3">${window.courseStatusBadge(course.status)}</div>` : ''}
         <p class="text-graphite-gray text-sm mb-4">${course.description || 'Автоматически сгенерированный курс'}</p>
         <div class="text-xs text-graphite-gray mb-4">
             <div class="flex items-center gap-1 mb-1">
@@ -789,7 +858,8 @@ window.downloadCoursePdf = async function (courseId) {
         showResult('❌ Ошибка сети при загрузке PDF', 'error');
     }
 };
-window.handleCourseCreationFromPDF = function (file) {
+// dedup: clone — скопировать найденный похожий курс, off — создать новый без поиска
+window.handleCourseCreationFromPDF = function (file, dedup) {
     const token = localStorage.getItem('access_token');
     if (!token) {
         showResult('Пожалуйста, войдите в систему для создания курсов', 'error');
@@ -798,17 +868,20 @@ window.handleCourseCreationFromPDF = function (file) {
     }
     const formData = new FormData();
     formData.append('pdf', file);
+    if (dedup) formData.append('dedup', dedup);
 
     fetch('/api/generate-course-from-pdf', {
         method: 'POST',
         headers: { 'Authorization': `Bearer ${token}` },
         body: formData
     })
-        .then(response => response.json().then(data => ({ ok: response.ok, data })))
-        .then(({ ok, data }) => {
-            if (ok && data.success) {
-                showResult(`✅ Курс "${data.title}" успешно создан! Перенаправление...`, 'success');
-                setTimeout(() => { window.location.href = '/my-courses'; }, 2000);
+        .then(response => response.json().then(data => ({ ok: response.ok, status: response.status, data })))
+        .then(({ ok, status, data }) => {
+            if (status === 409 && data.duplicate) {
+                handleDuplicatePdf(file, data.duplicate);
+            } else if (ok && data.success) {
+                showResult(courseCreatedMessage(data), data.status === 'pending_upgrade' ? 'info' : 'success');
+                setTimeout(() => { window.location.href = '/my-courses'; }, data.status === 'pending_upgrade' ? 4000 : 2000);
             } else {
                 showResult('❌ Ошибка при создании курса из PDF: ' + (data.detail || 'Неизвестная ошибка'), 'error');
             }
@@ -817,6 +890,31 @@ window.handleCourseCreationFromPDF = function (file) {
             showResult('❌ Ошибка сети при создании курса', 'error');
         });
 };
+// Похожий PDF уже обрабатывался: спрашиваем, скопировать свой курс или создать новый
+function handleDuplicatePdf(file, duplicate) {
+    const similarity = Math.round((duplicate.similarity || 0) * 100);
+    if (duplicate.course_id) {
+        const copy = confirm(
+            `Этот документ на ${similarity}% совпадает с вашим курсом "${duplicate.title || 'Без названия'}".\n\n` +
+            'OK — скопировать готовый курс, Отмена — выбрать другое действие.'
+        );
+        if (copy) {
+            showResult('📋 Копируем существующий курс...', 'info');
+            window.handleCourseCreationFromPDF(file, 'clone');
+            return;
+        }
+    }
+    const message = duplicate.course_id
+        ? 'Создать новый курс по этому документу всё равно?'
+        : `Похожий документ (совпадение ${similarity}%) уже обрабатывался. Создать курс всё равно?`;
+    if (confirm(message)) {
+        showResult('⏳ Создаём новый курс...', 'info');
+        window.handleCourseCreationFromPDF(file, 'off');
+    } else {
+        showResult('Создание курса отменено', 'info');
+    }
+}
+
 window.deleteCourse = function (courseId) {
     const token = localStorage.getItem('access_token');
     if (!token) {
@@ -0,0 +1,30 @@
+"""Gunicorn settings for production: gunicorn -c gunicorn.conf.py start:app
+
+Несколько воркеров uvicorn по числу доступных ядер, приложение загружается
+один раз в мастере (preload), перезагрузчика нет. При остановке воркер
+перестаёт принимать соединения и дожидается идущих генераций.
+"""
+import os
+
+
+def _available_cpus() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(_available_cpus())))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+# Генерация курса может идти несколько минут (таймаут запроса к модели 360 с)
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "420"))
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+keepalive = 5
+accesslog = os.getenv("ACCESS_LOG") or None
+raw_env = ["COURSEGEN_ENV=production"]
+
+
+def when_ready(server):
+    print(f"🚀 CourseGen: {workers} воркеров на {bind}")
@@ -1,125 +1,252 @@
-import uvicorn
 from fastapi import FastAPI, Request, Form, HTTPException
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import UploadFile, File
+from starlette.concurrency import run_in_threadpool
+import asyncio
 import os
 import sys
 import json
+import logging
 import sqlite3
+from contextlib import asynccontextmanager
 from jose import jwt
 import datetime
-import hashlib
-import requests
 from typing import Optional
 
-app = FastAPI(title="CourseGen")
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+from backend.app.admission import AdmissionController, AdmissionRejected
+from backend.app.cache_sync import InvalidationLog
+from backend.app.cancellation import GenerationCancelled
+from backend.app.compression import CompressionMiddleware
+from backend.app.dedup import DEDUP_MODE, DEDUP_MODES, DEDUP_SCOPE, SourceIndex
+from backend.app.export import ExportCache, attachment_header, parse_course_content
+from backend.app.fast_json import JSONResponse
+from backend.app.http_cache import json_response_with_etag, not_modified
+from backend.app.llm import LLMError, extract_json_object
+from backend.app.logs import (
+    RequestIdMiddleware,
+    configure_logging,
+    log_payload,
+    shutdown_logging,
+    stats as logging_stats,
+)
+from backend.app.metrics import (
+    LLM_PARSE,
+    LLM_REQUESTS,
+    MetricsMiddleware,
+    SnapshotStore,
+    registry,
+    stage_timer,
+)
+from backend.app.partial import (
+    PartialError,
+    patch_statement,
+    quiz_task,
+    section_task,
+    source_excerpt,
+    summary_task,
 )
+from backend.app.passages import select_passages
+from backend.app.pdf_renderer import PdfRenderer
+from backend.app.profiling import PROFILE_DIR, ProfilingMiddleware, profiled_thread
+from backend.app.projection import InvalidFields, parse_fields, project
+from backend.app.routing import ModelRouter, model_router
+from backend.app.revisions import (
+    assign_sections,
+    chunk_statements,
+    load_course_chunks,
+    load_course_source,
+    merge_revision,
+    plan_revision,
+    quiz_owners,
+    remove_course_chunks,
+    revision_prompt,
+    section_sources,
+    split_chunks,
+)
+from backend.app.passwords import hash_password_async, verify_password_async
+from backend.app.schema import migrate
+from backend.app.static_assets import HashedStaticFiles, PageStore
+from backend.app.token_cache import TokenCache
+from backend.app.upgrades import PENDING_UPGRADE, READY, UPGRADE_USER_ID, PendingUpgrade, UpgradeQueue
+from backend.app.zip_stream import ZipStream, safe_name
+from backend.app.write_batcher import WriteBatcher
+
+DB_PATH = os.getenv("COURSEGEN_DB", "coursegen.db")
+
+configure_logging()
+logger = logging.getLogger("coursegen")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Выполняется в каждом воркере, а не при импорте модуля
+    old_version, new_version = await run_in_threadpool(migrate, DB_PATH)
+    if old_version != new_version:
+        logger.info("База данных готова (схема v%s)", new_version)
+    pages.load_all()
+    await cache_sync.start()
+    await metrics_snapshots.start()
+    await upgrade_queue.start()
+    yield
+    await upgrade_queue.stop()
+    left = await generation_admission.drain(GEN_DRAIN_SECONDS)
+    if left:
+        logger.warning("Остановка: не дождались %s генераций", left)
+    await cache_sync.stop()
+    await metrics_snapshots.stop()
+    await db_writer.close()
+    pdf_renderer.shutdown()
+    shutdown_logging()
+
+
+app = FastAPI(title="CourseGen", lifespan=lifespan, default_response_class=JSONResponse)
+
+metrics_snapshots = SnapshotStore()
 
 # Mount static files
 static_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "frontend/static"))
-app.mount("/static", StaticFiles(directory=static_dir), name="static")
+static_files = HashedStaticFiles(directory=static_dir)
+app.mount("/static", static_files, name="static")
 
+# HTML-страницы держим в памяти; в режиме разработки перечитываем при изменении
+DEV_MODE = os.getenv("COURSEGEN_ENV", "production") == "development"
+FRONTEND_PAGES = [
+    "index",
+    "login",
+    "register",
+    "generator",
+    "my-courses",
+    "support",
+    "course-detail",
+]
+frontend_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "frontend"))
+pages = PageStore(frontend_dir, static_files, names=FRONTEND_PAGES, reload=DEV_MODE)
 
-def init_database():
-    print("🔧 Инициализация базы данных...")
-    conn = sqlite3.connect("coursegen.db")
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            email TEXT UNIQUE NOT NULL,
-            hashed_password TEXT NOT NULL,
-            first_name TEXT,
-            last_name TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    """
-    )
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS courses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT NOT NULL,
-            description TEXT,
-            video_url TEXT,
-            video_title TEXT,
-            content TEXT,
-            user_id INTEGER NOT NULL,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    """
-    )
-    conn.commit()
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-    tables = cursor.fetchall()
-    print("📊 Таблицы в базе данных:", [table[0] for table in tables])
-    conn.close()
-    print("✅ База данных готова!")
+
+# Все вставки курсов идут через общий писатель с групповым коммитом
+db_writer = WriteBatcher(DB_PATH)
+
+
+# PDF рендерится в фоновых процессах сразу после сохранения курса
+pdf_renderer = PdfRenderer()
+
+
+# MinHash-подписи источников: почти одинаковые документы не генерируются заново
+source_index = SourceIndex(DB_PATH)
 
 
-init_database()
+# Сколько ждать незавершённые генерации при остановке воркера
+GEN_DRAIN_SECONDS = float(os.getenv("GEN_DRAIN_SECONDS", "60"))
+
 
 SECRET_KEY = os.getenv("SECRET_KEY", "coursegen-secret-key")
-PASSWORD_SALT = os.getenv("PASSWORD_SALT", "coursegen-salt")
+
+# Пользователи, которым разрешено профилирование запросов
+ADMIN_EMAILS = {
+    email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()
+}
+
+
+SYSTEM_PROMPT = "Ты — эксперт по составлению образовательных курсов на русском языке. Возвращай только JSON-ответ."
 
 
 class QwenAIClient:
-    def __init__(self, base_url: str = "http://127.0.0.1:1234/v1"):
-        self.base_url = base_url
+    def __init__(self, router: Optional[ModelRouter] = None):
+        self.router = router or model_router
 
     def generate_course_content(
         self, video_title: str, transcript: str, video_description: str = ""
     ) -> dict:
-        truncated_transcript = (
-            transcript[:4000] if len(transcript) > 4000 else transcript
-        )
-        prompt = self._create_course_prompt(
-            video_title, truncated_transcript, video_description
-        )
+        # Не первые 4000 символов, а самые содержательные фрагменты всего текста
+        truncated_transcript = select_passages(transcript, 4000, query=video_title)
+        with stage_timer("prompt"):
+            prompt = self._create_course_prompt(
+                video_title, truncated_transcript, video_description
+            )
+        import requests
+
         try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                json={
-                    "model": "local-model",
-                    "messages": [
-                        {
-                            "role": "system",
-                            "content": """Ты — эксперт по составлению образовательных курсов. Создавай подробные, структурированные учебные материалы на русском языке. Возвращай только JSON-ответ.""",
-                        },
-                        {"role": "user", "content": prompt},
-                    ],
-                    "max_tokens": 4000,
-                    "temperature": 0.7,
-                    "stream": False,
-                },
+            completion = self.router.chat(
+                "course",
+                [
+                    {
+                        "role": "system",
+                        "content": """Ты — эксперт по составлению образовательных курсов. Создавай подробные, структурированные учебные материалы на русском языке. Возвращай только JSON-ответ.""",
+                    },
+                    {"role": "user", "content": prompt},
+                ],
+                max_tokens=4000,
                 timeout=360,
+                temperature=0.7,
             )
-            if response.status_code == 200:
-                return self._parse_ai_response(response.json(), video_title)
-            else:
-                print(f"❌ Ошибка API: {response.status_code}")
-                return self._get_fallback_content(video_title)
+            return self._parse_ai_response(completion.as_response(), video_title)
+        except LLMError as e:
+            logger.error("Ошибка API модели: %s", e)
+            return self._get_fallback_content(video_title)
         except requests.exceptions.Timeout:
-            print("❌ Таймаут запроса к LM Studio")
+            logger.error("Таймаут запроса к LM Studio")
             return self._get_fallback_content(video_title)
         except requests.exceptions.ConnectionError:
-            print("❌ Не могу подключиться к LM Studio")
+            logger.error("Не могу подключиться к LM Studio")
             return self._get_fallback_content(video_title)
+        except GenerationCancelled:
+            raise
         except Exception as e:
-            print(f"❌ Неожиданная ошибка: {e}")
+            LLM_REQUESTS.inc(result="error")
+            logger.exception("Неожиданная ошибка генерации: %s", e)
             return self._get_fallback_content(video_title)
 
+    def complete_json(self, task: str, prompt: str, max_tokens: int, timeout: float = 180) -> Optional[dict]:
+        """One compact model call that must answer with a JSON object; None on any failure."""
+        import requests
+
+        try:
+            completion = self.router.chat(
+                task,
+                [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+                max_tokens=max_tokens,
+                timeout=timeout,
+                temperature=0.7,
+            )
+        except (LLMError, requests.exceptions.RequestException) as e:
+            logger.error("Ошибка запроса к модели: %s", e, extra={"task": task})
+            return None
+        log_payload(logger, "Ответ модели", completion.text, usage=completion.usage, task=task)
+        data, outcome = extract_json_object(completion.text)
+        if data is None:
+            data = self._repair_json(completion.text)
+            outcome = "model_repaired"
+        LLM_PARSE.inc(outcome=outcome if data is not None else "fallback")
+        return data
+
+    def _repair_json(self, text: str) -> Optional[dict]:
+        """Ask the json_repair route to fix an answer that could not be parsed locally.
+
+        Runs only when the task has its own route, so by default there is no extra model call.
+        """
+        import requests
+
+        if not text.strip() or not self.router.configured("json_repair"):
+            return None
+        prompt = (
+            "Исправь текст ниже так, чтобы он стал одним валидным JSON-объектом. "
+            "Не меняй содержание и не добавляй пояснений.\n\n" + text[:12000]
+        )
+        try:
+            completion = self.router.chat(
+                "json_repair",
+                [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}],
+                max_tokens=4000,
+                timeout=120,
+                temperature=0.0,
+            )
+        except (LLMError, requests.exceptions.RequestException) as e:
+            logger.error("Не удалось починить JSON моделью: %s", e)
+            return None
+        data, _ = extract_json_object(completion.text)
+        return data
+
     def _create_course_prompt(
         self, video_title: str, transcript: str, description: str
     ) -> str:
@@ -169,27 +296,30 @@ JSON пример:
     def _parse_ai_response(self, response_data: dict, video_title: str) -> dict:
         try:
             content = response_data["choices"][0]["message"]["content"]
-            content = content.strip()
-            start_idx = content.find("{")
-            end_idx = content.rfind("}") + 1
-            if start_idx != -1 and end_idx != 0:
-                json_str = content[start_idx:end_idx]
-                course_data = json.loads(json_str)
-                if "title" in course_data and "sections" in course_data:
-                    print("✅ Курс успешно создан с помощью Qwen2.5-4B!")
-                    return course_data
-            print("⚠️  ИИ вернул некорректный формат, используем fallback")
-            return self._get_fallback_content(video_title)
-        except json.JSONDecodeError as e:
-            print(f"❌ Ошибка парсинга JSON: {e}")
+            log_payload(logger, "Ответ модели", content, usage=response_data.get("usage"))
+            course_data, outcome = extract_json_object(content)
+            if course_data is None:
+                course_data = self._repair_json(content)
+                outcome = "model_repaired"
+            if course_data and "title" in course_data and "sections" in course_data:
+                LLM_PARSE.inc(outcome=outcome)
+                if outcome == "repaired":
+                    logger.info("Ответ модели починен при разборе JSON")
+                logger.info("Курс успешно создан с помощью Qwen2.5-4B", extra={"parse": outcome})
+                return course_data
+            LLM_PARSE.inc(outcome="fallback")
+            logger.warning("ИИ вернул некорректный формат, используем fallback")
             return self._get_fallback_content(video_title)
         except Exception as e:
-            print(f"❌ Ошибка обработки ответа: {e}")
+            LLM_PARSE.inc(outcome="fallback")
+            logger.exception("Ошибка обработки ответа модели: %s", e)
             return self._get_fallback_content(video_title)
 
     def _get_fallback_content(self, video_title: str) -> dict:
         return {
             "title": f"Курс: {video_title}",
+            # Шаблон, а не ответ модели: такой курс не годится как образец для копий
+            "is_fallback": True,
             "description": f"Автоматически сгенерированный курс, подробное введение в тему.",
             "sections": [
                 {
@@ -218,30 +348,79 @@ JSON пример:
 
 
 def is_lm_studio_available():
+    import requests
+
     try:
-        response = requests.get("http://127.0.0.1:1234/v1/models", timeout=5)
+        response = requests.get(f"{model_router.route('course').url}/models", timeout=5)
         return response.status_code == 200
     except:
         return False
 
 
+@profiled_thread
 def generate_course_content(
     video_title: str, transcript: str, video_description: str = ""
 ) -> dict:
     if is_lm_studio_available():
-        print("🎯 Используем Qwen2.5-4B для создания курса...")
+        logger.info("Используем Qwen2.5-4B для создания курса")
         ai_client = QwenAIClient()
         return ai_client.generate_course_content(
             video_title, transcript, video_description
         )
     else:
-        print("⚠️  LM Studio недоступен, используем базовый шаблон")
+        LLM_REQUESTS.inc(result="unavailable")
+        logger.warning("LM Studio недоступен, используем базовый шаблон")
         ai_client = QwenAIClient()
         return ai_client._get_fallback_content(video_title)
 
 
-def hash_password(password):
-    return hashlib.sha256((password + PASSWORD_SALT).encode()).hexdigest()
+@profiled_thread
+def revise_course_content(content: dict, plan, chunks) -> Optional[tuple]:
+    """Rewrite only the sections whose source chunks changed; (content, rewritten) or None."""
+    changed = [index for index in plan.changed if index < len(content.get("sections") or [])]
+    if not changed:
+        return content, []
+    if not is_lm_studio_available():
+        LLM_REQUESTS.inc(result="unavailable")
+        return None
+    with stage_timer("prompt"):
+        owners = quiz_owners(content)
+        quiz_count = max(sum(owner in changed for owner in owners), len(changed))
+        sources = section_sources(chunks, plan.sections, content)
+        prompt = revision_prompt(content, changed, sources, quiz_count)
+    # Ответ — только изменённые разделы, поэтому и max_tokens пропорционален правке
+    result = QwenAIClient().complete_json("revision", prompt, max_tokens=min(4000, 700 * len(changed) + 120 * quiz_count))
+    if result is None:
+        return None
+    return merge_revision(content, changed, result, quiz_count)
+
+
+async def store_course_chunks(course_id: int, chunks, sections):
+    await asyncio.gather(
+        *(db_writer.execute(sql, params) for sql, params in chunk_statements(course_id, chunks, sections))
+    )
+
+
+export_cache = ExportCache()
+
+# Очередь к серверу модели: лимиты на пользователя и общий лимит задач
+generation_admission = AdmissionController(DB_PATH)
+
+
+def too_many_requests(error: AdmissionRejected):
+    return JSONResponse(
+        {"detail": error.detail, "retry_after": error.retry_after},
+        status_code=429,
+        headers={"Retry-After": str(error.retry_after)},
+    )
+
+
+UPGRADE_MESSAGE = "Модель сейчас недоступна: сохранён черновой курс, он обновится автоматически"
+
+
+def generation_cancelled(error: GenerationCancelled):
+    # 499 — клиент закрыл запрос (обозначение nginx); ответ нужен только при отмене через DELETE /api/jobs
+    return JSONResponse({"detail": "Генерация отменена", "reason": error.reason}, status_code=499)
 
 
 def create_access_token(email: str):
@@ -253,23 +432,77 @@ def create_access_token(email: str):
     return token
 
 
-def verify_token(token: str):
+def decode_token(token: str):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
-        return payload.get("sub")
+        return jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
     except jwt.JWTError:
         return None
 
 
+def verify_token(token: str):
+    payload = decode_token(token)
+    return payload.get("sub") if payload else None
+
+
+def is_admin_email(email: Optional[str]) -> bool:
+    return bool(email) and email.lower() in ADMIN_EMAILS
+
+
+def is_admin_request(scope) -> bool:
+    if not ADMIN_EMAILS:
+        return False
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            auth = value.decode("latin-1")
+            if auth.startswith("Bearer "):
+                payload = decode_token(auth[7:])
+                if payload and not payload.get("scope"):
+                    return is_admin_email(payload.get("sub"))
+            return False
+    return False
+
+
+# Middleware: каждый add_middleware оборачивает добавленные раньше, поэтому снаружи
+# внутрь порядок обратный: Profiling -> RequestId -> Metrics -> Compression -> CORS -> приложение.
+# Профиль покрывает весь запрос, включая потоковое тело; request_id назначается до
+# метрик и логов; задержка в метриках учитывает сжатие и CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
+app.add_middleware(ProfilingMiddleware, is_admin=is_admin_request)
+
+
+token_cache = TokenCache()
+
+# Кеши живут в памяти каждого воркера; изменения рассылаются через базу
+cache_sync = InvalidationLog(DB_PATH)
+cache_sync.subscribe("auth", token_cache.invalidate_user)
+cache_sync.subscribe("export", lambda key: export_cache.invalidate(int(key)))
+
+
 async def get_current_user(request: Request):
     auth_header = request.headers.get("Authorization")
     if not auth_header or not auth_header.startswith("Bearer "):
         return None
     token = auth_header.split(" ")[1]
-    user_email = verify_token(token)
+    cached_user = token_cache.get(token)
+    if cached_user is not None:
+        return dict(cached_user)
+    payload = decode_token(token)
+    # Билеты на выгрузку не годятся как обычный токен доступа
+    if not payload or payload.get("scope"):
+        return None
+    user_email = payload.get("sub")
     if not user_email:
         return None
-    conn = sqlite3.connect("coursegen.db")
+    conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     cursor.execute(
         "SELECT id, email, first_name, last_name FROM users WHERE email = ?",
@@ -278,64 +511,57 @@ async def get_current_user(request: Request):
     user = cursor.fetchone()
     conn.close()
     if user:
-        return {
+        user_data = {
             "id": user[0],
             "email": user[1],
             "first_name": user[2],
             "last_name": user[3],
         }
+        token_cache.put(token, user_email, user_data, payload.get("exp"))
+        return dict(user_data)
     return None
 
 
 @app.get("/")
-async def serve_index():
-    return FileResponse("frontend/index.html")
+async def serve_index(request: Request):
+    return pages.response("index", request.headers)
 
 
 @app.get("/login")
-async def serve_login():
-    return FileResponse("frontend/login.html")
+async def serve_login(request: Request):
+    return pages.response("login", request.headers)
 
 
 @app.get("/register")
-async def serve_register():
-    return FileResponse("frontend/register.html")
+async def serve_register(request: Request):
+    return pages.response("register", request.headers)
 
 
 @app.get("/generator")
-async def serve_generator():
-    return FileResponse("frontend/generator.html")
+async def serve_generator(request: Request):
+    return pages.response("generator", request.headers)
 
 
 @app.get("/my-courses")
-async def serve_my_courses():
-    return FileResponse("frontend/my-courses.html")
+async def serve_my_courses(request: Request):
+    return pages.response("my-courses", request.headers)
 
 
 @app.get("/support")
-async def serve_support():
-    return FileResponse("frontend/support.html")
+async def serve_support(request: Request):
+    return pages.response("support", request.headers)
 
 
 @app.get("/course-detail")
-async def serve_course_detail():
-    return FileResponse("frontend/course-detail.html")
+async def serve_course_detail(request: Request):
+    return pages.response("course-detail", request.headers)
 
 
 @app.get("/{page_name}.html")
-async def serve_html_pages(page_name: str):
-    pages = [
-        "index",
-        "login",
-        "register",
-        "generator",
-        "my-courses",
-        "support",
-        "course-detail",
-    ]
-    if page_name in pages:
-        return FileResponse(f"frontend/{page_name}.html")
-    return FileResponse("frontend/index.html")
+async def serve_html_pages(page_name: str, request: Request):
+    if page_name in FRONTEND_PAGES:
+        return pages.response(page_name, request.headers)
+    return pages.response("index", request.headers)
 
 
 @app.post("/api/register")
@@ -346,19 +572,19 @@ async def register_user(request: Request):
         password = form_data.get("password")
         first_name = form_data.get("first_name")
         last_name = form_data.get("last_name")
-        print(f"📝 Регистрация: {email}")
+        logger.info("Регистрация", extra={"email": email})
         if not email or not password or not first_name or not last_name:
             return JSONResponse(
                 {"detail": "Все поля обязательны для заполнения"}, status_code=400
             )
-        conn = sqlite3.connect("coursegen.db")
+        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
         existing_user = cursor.fetchone()
         if existing_user:
             conn.close()
             return JSONResponse({"detail": "Email already registered"}, status_code=400)
-        hashed_password = hash_password(password)
+        hashed_password = await hash_password_async(password)
         cursor.execute(
             """
             INSERT INTO users (email, hashed_password, first_name, last_name)
@@ -369,8 +595,9 @@ async def register_user(request: Request):
         conn.commit()
         user_id = cursor.lastrowid
         conn.close()
+        await cache_sync.publish("auth", email)
         token = create_access_token(email)
-        print(f"✅ Пользователь зарегистрирован: {email}")
+        logger.info("Пользователь зарегистрирован", extra={"email": email, "user_id": user_id})
         return JSONResponse(
             {
                 "access_token": token,
@@ -382,7 +609,7 @@ async def register_user(request: Request):
             }
         )
     except Exception as e:
-        print(f"❌ Ошибка регистрации: {e}")
+        logger.exception("Ошибка регистрации: %s", e)
         return JSONResponse({"detail": str(e)}, status_code=500)
 
 
@@ -392,29 +619,34 @@ async def login_user(request: Request):
         form_data = await request.form()
         email = form_data.get("email")
         password = form_data.get("password")
-        print(f"🔐 Вход: {email}")
+        logger.debug("Вход", extra={"email": email})
         if not email or not password:
             return JSONResponse(
                 {"detail": "Email и пароль обязательны"}, status_code=400
             )
-        conn = sqlite3.connect("coursegen.db")
+        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
         user = cursor.fetchone()
+        conn.close()
         if not user:
-            conn.close()
             return JSONResponse(
                 {"detail": "Incorrect email or password"}, status_code=401
             )
-        hashed_input = hash_password(password)
-        stored_hash = user[2]
-        if hashed_input != stored_hash:
-            conn.close()
+        password_ok, upgraded_hash = await verify_password_async(password, user[2])
+        if not password_ok:
             return JSONResponse(
                 {"detail": "Incorrect email or password"}, status_code=401
             )
+        if upgraded_hash:
+            # Старый SHA-256 или заниженная стоимость — перехешируем прозрачно
+            await db_writer.execute(
+                "UPDATE users SET hashed_password = ? WHERE id = ?",
+                (upgraded_hash, user[0]),
+            )
+            logger.info("Хеш пароля обновлён", extra={"email": email})
         token = create_access_token(email)
-        print(f"✅ Успешный вход: {email}")
+        logger.info("Успешный вход", extra={"email": email})
         return JSONResponse(
             {
                 "access_token": token,
@@ -426,7 +658,7 @@ async def login_user(request: Request):
             }
         )
     except Exception as e:
-        print(f"❌ Ошибка входа: {e}")
+        logger.exception("Ошибка входа: %s", e)
         return JSONResponse({"detail": str(e)}, status_code=500)
 
 
@@ -437,18 +669,18 @@ async def get_user_courses(request: Request):
         if not current_user:
             return JSONResponse({"detail": "Authentication required"}, status_code=401)
         user_id = current_user["id"]
-        print(f"📚 Loading courses for user: {current_user['email']}")
-        conn = sqlite3.connect("coursegen.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT id, title, description, video_url, video_title, created_at 
-            FROM courses WHERE user_id = ? ORDER BY created_at DESC
-        """,
-            (user_id,),
-        )
-        courses_data = cursor.fetchall()
-        conn.close()
+        with stage_timer("db_read"):
+            conn = sqlite3.connect(DB_PATH)
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT id, title, description, video_url, video_title, created_at, status
+                FROM courses WHERE user_id = ? ORDER BY created_at DESC
+            """,
+                (user_id,),
+            )
+            courses_data = cursor.fetchall()
+            conn.close()
         courses = []
         for course in courses_data:
             courses.append(
@@ -459,15 +691,99 @@ async def get_user_courses(request: Request):
                     "video_url": course[3],
                     "video_title": course[4],
                     "created_at": course[5],
+                    "status": course[6],
                 }
             )
-        print(f"✅ Loaded {len(courses)} courses for user: {current_user['email']}")
-        return JSONResponse({"courses": courses})
+        logger.debug("Loaded courses", extra={"user_id": user_id, "count": len(courses)})
+        return json_response_with_etag(request, {"courses": courses})
     except Exception as e:
-        print(f"❌ Error loading courses: {e}")
+        logger.exception("Error loading courses: %s", e)
         return JSONResponse({"courses": []})
 
 
+async def prerender_course_pdf(course_id: int):
+    if not pdf_renderer.available():
+        return
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT title, content, created_at FROM courses WHERE id = ?", (course_id,)
+        )
+        course = cursor.fetchone()
+        conn.close()
+        if course:
+            pdf_renderer.schedule(course_id, *course)
+    except Exception as e:
+        logger.error("Не удалось запустить рендер PDF: %s", e, extra={"course_id": course_id})
+
+
+async def upgrade_course(pending: PendingUpgrade) -> bool:
+    """Regenerate a template course in the background; True if real content replaced it."""
+    chunks = None
+    transcript = pending.transcript
+    if transcript is None:
+        chunks, _ = await run_in_threadpool(load_course_source, DB_PATH, pending.course_id)
+        transcript = " ".join(chunk.text for chunk in chunks)
+    if not transcript.strip():
+        # Без источника модель выдумала бы курс по одному названию; попробуем позже
+        logger.warning("Нет источника для апгрейда курса", extra={"course_id": pending.course_id})
+        return False
+    async with generation_admission.admit(UPGRADE_USER_ID) as ticket:
+        async with ticket.model_slot():
+            course_content = await run_in_threadpool(
+                generate_course_content,
+                video_title=pending.video_title,
+                transcript=transcript,
+                video_description=pending.description,
+            )
+    if course_content.get("is_fallback") or not course_content.get("sections"):
+        return False
+    if chunks is not None:
+        course_content["is_pdf"] = True
+        course_content["video_url"] = ""
+    written = await db_writer.execute(
+        "UPDATE courses SET title = ?, description = ?, content = ?, status = ? WHERE id = ? AND status = ?",
+        (
+            course_content.get("title", pending.video_title),
+            course_content.get("description", "Автоматически сгенерированный курс"),
+            json.dumps(course_content, ensure_ascii=False),
+            READY,
+            pending.course_id,
+            PENDING_UPGRADE,
+        ),
+    )
+    if not written.rowcount:  # курс удалили, пока шла генерация
+        return True
+    if chunks is not None:
+        # Разделы шаблона были пустыми: фрагменты источника относим к настоящим
+        sections = await run_in_threadpool(assign_sections, chunks, course_content)
+        await db_writer.execute("DELETE FROM course_chunks WHERE course_id = ?", (pending.course_id,))
+        await store_course_chunks(pending.course_id, chunks, sections)
+        signature = await run_in_threadpool(source_index.signature, transcript)
+        if signature is not None:
+            await asyncio.gather(
+                *(db_writer.execute(sql, params) for sql, params in source_index.add_statements(pending.course_id, signature))
+            )
+    await cache_sync.publish("export", pending.course_id)
+    pdf_renderer.remove_course(pending.course_id)
+    await prerender_course_pdf(pending.course_id)
+    return True
+
+
+def model_ready() -> bool:
+    # Сначала дешёвая проверка очереди, потом запрос к серверу модели
+    return generation_admission.idle() and is_lm_studio_available()
+
+
+# Шаблонные курсы, созданные без модели, перегенерируются в фоне
+upgrade_queue = UpgradeQueue(DB_PATH, upgrade_course, model_ready)
+
+
+async def queue_upgrade(course_id: int, user_id: int, video_title: str, description: str, transcript: Optional[str]):
+    await db_writer.execute(*upgrade_queue.add_statement(course_id, user_id, video_title, description, transcript))
+
+
 @app.post("/api/generate-course")
 async def generate_course(request: Request):
     try:
@@ -478,7 +794,7 @@ async def generate_course(request: Request):
         video_url = form_data.get("video_url")
         if not video_url:
             return JSONResponse({"detail": "Video URL is required"}, status_code=400)
-        print(f"🎬 Generating course for: {video_url} by user: {current_user['email']}")
+        logger.info("Generating course", extra={"video_url": video_url, "user_id": current_user["id"]})
         user_id = current_user["id"]
         video_id = "unknown"
         video_title_from_url = "YouTube Video"
@@ -488,25 +804,28 @@ async def generate_course(request: Request):
         elif "youtu.be/" in video_url:
             video_id = video_url.split("youtu.be/")[1].split("?")[0]
             video_title_from_url = f"YouTube Video {video_id}"
-        ai_status = "Qwen2.5-4B" if is_lm_studio_available() else "basic template"
-        print(f"🤖 AI Status: {ai_status}")
+        lm_available = await run_in_threadpool(is_lm_studio_available)
+        ai_status = "Qwen2.5-4B" if lm_available else "basic template"
+        logger.debug("AI status: %s", ai_status)
         demo_transcript = f"""
         Это автоматически сгенерированный транскрипт видео '{video_title_from_url}'.
         В реальной системе здесь будет извлеченный текст из YouTube видео с помощью YouTube Transcript API.
         Текущий видео материал посвящен образовательной тематике и содержит ценную информацию для обучения.
         Основные темы включают в себя анализ контента, выделение ключевых идей и структурирование учебного материала.
         """
-        course_content = generate_course_content(
-            video_title=video_title_from_url,
-            transcript=demo_transcript,
-            video_description=f"Видео с YouTube: {video_url}",
-        )
-        conn = sqlite3.connect("coursegen.db")
-        cursor = conn.cursor()
-        cursor.execute(
+        async with generation_admission.admit(user_id, request.receive) as ticket:
+            async with ticket.model_slot():
+                course_content = await run_in_threadpool(
+                    generate_course_content,
+                    video_title=video_title_from_url,
+                    transcript=demo_transcript,
+                    video_description=f"Видео с YouTube: {video_url}",
+                )
+        status = PENDING_UPGRADE if course_content.get("is_fallback") else READY
+        course_id = await db_writer.insert(
             """
-            INSERT INTO courses (title, description, video_url, video_title, content, user_id)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO courses (title, description, video_url, video_title, content, user_id, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         """,
             (
                 course_content.get("title", f"Курс: {video_title_from_url}"),
@@ -515,71 +834,138 @@ async def generate_course(request: Request):
                 video_title_from_url,
                 json.dumps(course_content, ensure_ascii=False),
                 user_id,
+                status,
             ),
         )
-        course_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
-        print(f"✅ Course created with {ai_status}! ID: {course_id}")
+        if status == PENDING_UPGRADE:
+            await queue_upgrade(
+                course_id, user_id, video_title_from_url, f"Видео с YouTube: {video_url}", demo_transcript
+            )
+        await prerender_course_pdf(course_id)
+        logger.info("Course created with %s", ai_status, extra={"course_id": course_id, "status": status})
         return JSONResponse(
             {
                 "success": True,
                 "course_id": course_id,
                 "title": course_content.get("title", f"Курс: {video_title_from_url}"),
-                "message": f"Курс успешно создан с помощью {ai_status}!",
-                "ai_used": ai_status,
+                "message": UPGRADE_MESSAGE if status == PENDING_UPGRADE else f"Курс успешно создан с помощью {ai_status}!",
+                "ai_used": "basic template" if status == PENDING_UPGRADE else ai_status,
+                "status": status,
                 "pdf_url": f"/api/courses/{course_id}/pdf",
             }
         )
+    except AdmissionRejected as e:
+        logger.warning("Generation rejected: %s", e.detail, extra={"user_id": current_user["id"]})
+        return too_many_requests(e)
+    except GenerationCancelled as e:
+        return generation_cancelled(e)
     except Exception as e:
-        print(f"❌ Course generation error: {e}")
+        logger.exception("Course generation error: %s", e)
         return JSONResponse({"detail": str(e)}, status_code=500)
 
 
-@app.post("/api/generate-course-from-pdf")
-async def generate_course_from_pdf(request: Request, pdf: UploadFile = File(...)):
-    try:
-        current_user = await get_current_user(request)
-        if not current_user:
-            return JSONResponse({"detail": "Authentication required"}, status_code=401)
-        contents = await pdf.read()
-        import io
-        from PyPDF2 import PdfReader
+@profiled_thread
+def extract_pdf_text(contents: bytes) -> str:
+    import io
+    from PyPDF2 import PdfReader
 
+    with stage_timer("pdf_extract"):
         pdf_reader = PdfReader(io.BytesIO(contents))
         full_text = ""
         for page in pdf_reader.pages:
             page_txt = page.extract_text()
             if page_txt:
                 full_text += page_txt + "\n"
+    return full_text
+
+
+def load_course_json(course_id: int) -> dict:
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        row = conn.execute("SELECT title, content FROM courses WHERE id = ?", (course_id,)).fetchone()
+    finally:
+        conn.close()
+    return parse_course_content(row[1], row[0]) if row else {}
+
+
+@app.post("/api/generate-course-from-pdf")
+async def generate_course_from_pdf(
+    request: Request, pdf: UploadFile = File(...), dedup: Optional[str] = Form(None)
+):
+    try:
+        current_user = await get_current_user(request)
+        if not current_user:
+            return JSONResponse({"detail": "Authentication required"}, status_code=401)
+        dedup_mode = dedup if dedup in DEDUP_MODES else DEDUP_MODE
+        duplicate = None
+        # Поиск дубликата — до admit: ответ 409 не должен тратить токен лимита генераций
+        contents = await pdf.read()
+        full_text = await run_in_threadpool(extract_pdf_text, contents)
+        # Подпись нужна и при dedup=off: новый курс всё равно попадает в индекс
+        signature = await run_in_threadpool(source_index.signature, full_text)
+        if signature is not None and dedup_mode != "off":
+            # Копировать можно только свой курс: чужой контент в другой аккаунт не попадает
+            own_only = DEDUP_SCOPE == "user" or dedup_mode == "clone"
+            scope_user = current_user["id"] if own_only else None
+            duplicate = await run_in_threadpool(source_index.find, signature, scope_user)
 
         video_title = pdf.filename
-        course_content = generate_course_content(
-            video_title=video_title,
-            transcript=full_text,
-            video_description=f"Документ: {pdf.filename}",
-        )
+        if duplicate is not None and dedup_mode == "suggest":
+            # О чужом курсе сообщается только сам факт совпадения
+            own = duplicate.user_id == current_user["id"]
+            return JSONResponse(
+                {
+                    "detail": (
+                        "Похожий курс уже есть: отправьте dedup=clone, чтобы скопировать его, или dedup=off"
+                        if own
+                        else "Похожий документ уже обрабатывался: отправьте dedup=off, чтобы создать курс"
+                    ),
+                    "duplicate": {
+                        "course_id": duplicate.course_id if own else None,
+                        "title": duplicate.title if own else None,
+                        "similarity": duplicate.similarity,
+                    },
+                },
+                status_code=409,
+            )
+        async with generation_admission.admit(current_user["id"], request.receive) as ticket:
+            if duplicate is not None:
+                logger.info(
+                    "Near-duplicate source, cloning course",
+                    extra={"cloned_from": duplicate.course_id, "similarity": duplicate.similarity},
+                )
+                course_content = await run_in_threadpool(load_course_json, duplicate.course_id)
+                if not course_content:  # исходный курс успели удалить
+                    duplicate = None
+            if duplicate is None:
+                async with ticket.model_slot():
+                    course_content = await run_in_threadpool(
+                        generate_course_content,
+                        video_title=video_title,
+                        transcript=full_text,
+                        video_description=f"Документ: {pdf.filename}",
+                    )
 
         # === Логика проверки, что результат AI валидный (title и sections есть, не None, не {}) ===
         if "title" not in course_content or not course_content.get("sections"):
-            print("❗ Используем fallback, AI не дал валидный JSON!")
+            logger.warning("Используем fallback, AI не дал валидный JSON")
             course_content = {
                 "title": f"Курс: {video_title}",
                 "description": f"Автоматически сгенерированный курс из PDF",
                 "sections": [],
                 "quizzes": [],
                 "summary": "Нет резюме",
+                "is_fallback": True,
             }
 
         course_content["is_pdf"] = True
         course_content["video_url"] = ""  # убираем ссылку для pdf
+        status = PENDING_UPGRADE if course_content.get("is_fallback") else READY
 
-        conn = sqlite3.connect("coursegen.db")
-        cursor = conn.cursor()
-        cursor.execute(
+        course_id = await db_writer.insert(
             """
-            INSERT INTO courses (title, description, video_url, video_title, content, user_id)
-            VALUES (?, ?, ?, ?, ?, ?)
+            INSERT INTO courses (title, description, video_url, video_title, content, user_id, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
         """,
             (
                 course_content.get("title", f"Курс: {video_title}"),
@@ -590,45 +976,311 @@ async def generate_course_from_pdf(request: Request, pdf: UploadFile = File(...)
                 video_title,
                 json.dumps(course_content, ensure_ascii=False),
                 current_user["id"],
+                status,
             ),
         )
-        course_id = cursor.lastrowid
-        conn.commit()
+        if signature is not None and not course_content.get("is_fallback"):
+            await asyncio.gather(
+                *(db_writer.execute(sql, params) for sql, params in source_index.add_statements(course_id, signature))
+            )
+        # Фрагменты источника нужны, чтобы потом перегенерировать только изменённое
+        chunks = await run_in_threadpool(split_chunks, full_text)
+        sections = await run_in_threadpool(assign_sections, chunks, course_content)
+        await store_course_chunks(course_id, chunks, sections)
+        if status == PENDING_UPGRADE:
+            # Источник возьмётся из сохранённых фрагментов, поэтому в очередь — только после них
+            await queue_upgrade(course_id, current_user["id"], video_title, f"Документ: {pdf.filename}", None)
+
+        await prerender_course_pdf(course_id)
+
+        response = {
+            "success": True,
+            "course_id": course_id,
+            "title": course_content.get("title", f"Курс: {video_title}"),
+            "message": "Курс успешно создан из PDF!",
+            "ai_used": "Qwen2.5-4B",
+            "status": status,
+            "pdf_url": f"/api/courses/{course_id}/pdf",
+        }
+        if status == PENDING_UPGRADE:
+            response["message"] = UPGRADE_MESSAGE
+            response["ai_used"] = "basic template"
+        if duplicate is not None:
+            response["message"] = "Курс скопирован из уже созданного по почти такому же документу"
+            response["ai_used"] = "duplicate"
+            if duplicate.user_id == current_user["id"]:
+                response["cloned_from"] = duplicate.course_id
+            response["similarity"] = duplicate.similarity
+        return JSONResponse(response)
+    except AdmissionRejected as e:
+        logger.warning("PDF generation rejected: %s", e.detail, extra={"user_id": current_user["id"]})
+        return too_many_requests(e)
+    except GenerationCancelled as e:
+        return generation_cancelled(e)
+    except Exception as e:
+        logger.exception("Course from PDF error: %s", e)
+        return JSONResponse({"detail": str(e)}, status_code=500)
+
+
+def load_owned_course(course_id: int, user_id: int):
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        return conn.execute(
+            "SELECT title, content, video_title, version FROM courses WHERE id = ? AND user_id = ?",
+            (course_id, user_id),
+        ).fetchone()
+    finally:
         conn.close()
 
+
+@app.post("/api/courses/{course_id}/revisions")
+async def revise_course_from_pdf(course_id: int, request: Request, pdf: UploadFile = File(...)):
+    """New version of a PDF course: only sections whose source chunks changed are regenerated."""
+    try:
+        current_user = await get_current_user(request)
+        if not current_user:
+            return JSONResponse({"detail": "Authentication required"}, status_code=401)
+        base = await run_in_threadpool(load_owned_course, course_id, current_user["id"])
+        if not base:
+            return JSONResponse({"detail": "Course not found"}, status_code=404)
+        old_chunks = await run_in_threadpool(load_course_chunks, DB_PATH, course_id)
+        if not old_chunks:
+            return JSONResponse(
+                {"detail": "У курса нет сохранённых фрагментов источника, создайте его заново из PDF"},
+                status_code=409,
+            )
+        title, raw_content, _, version = base
+        content = parse_course_content(raw_content, title)
+        async with generation_admission.admit(current_user["id"], request.receive) as ticket:
+            contents = await pdf.read()
+            full_text = await run_in_threadpool(extract_pdf_text, contents)
+            chunks = await run_in_threadpool(split_chunks, full_text)
+            plan = plan_revision(old_chunks, chunks)
+            rewritten = []
+            if plan.changed:
+                async with ticket.model_slot():
+                    revised = await run_in_threadpool(revise_course_content, content, plan, chunks)
+                if revised is None:
+                    return JSONResponse({"detail": "Модель недоступна, попробуйте позже"}, status_code=503)
+                content, rewritten = revised
+            signature = await run_in_threadpool(source_index.signature, full_text)
+
+        new_id = await db_writer.insert(
+            """
+            INSERT INTO courses (title, description, video_url, video_title, content, user_id, parent_id, version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+            (
+                content.get("title", title),
+                content.get("description", "Автоматически сгенерированный курс из PDF"),
+                "",
+                pdf.filename,
+                json.dumps(content, ensure_ascii=False),
+                current_user["id"],
+                course_id,
+                (version or 1) + 1,
+            ),
+        )
+        await store_course_chunks(new_id, chunks, plan.sections)
+        if signature is not None and not content.get("is_fallback"):
+            await asyncio.gather(
+                *(db_writer.execute(sql, params) for sql, params in source_index.add_statements(new_id, signature))
+            )
+        await prerender_course_pdf(new_id)
+        logger.info(
+            "Course revised",
+            extra={
+                "course_id": new_id,
+                "parent_id": course_id,
+                "rewritten_sections": rewritten,
+                "chunks_reused": plan.reused,
+                "chunks_added": plan.added,
+                "chunks_removed": plan.removed,
+            },
+        )
+        return JSONResponse(
+            {
+                "success": True,
+                "course_id": new_id,
+                "parent_id": course_id,
+                "version": (version or 1) + 1,
+                "rewritten_sections": rewritten,
+                "chunks": {"reused": plan.reused, "added": plan.added, "removed": plan.removed},
+                "pdf_url": f"/api/courses/{new_id}/pdf",
+            }
+        )
+    except AdmissionRejected as e:
+        logger.warning("Revision rejected: %s", e.detail, extra={"user_id": current_user["id"]})
+        return too_many_requests(e)
+    except GenerationCancelled as e:
+        return generation_cancelled(e)
+    except Exception as e:
+        logger.exception("Course revision error: %s", e)
+        return JSONResponse({"detail": str(e)}, status_code=500)
+
+
+@profiled_thread
+def run_partial_task(task) -> Optional[dict]:
+    if not is_lm_studio_available():
+        LLM_REQUESTS.inc(result="unavailable")
+        return None
+    return QwenAIClient().complete_json(task.kind, task.prompt, max_tokens=task.max_tokens)
+
+
+async def regenerate_course_part(request: Request, course_id: int, build_task):
+    """Shared flow of the partial regeneration endpoints.
+
+    ``build_task(content, chunks, sections)`` returns a PartialTask for the stored course.
+    """
+    try:
+        current_user = await get_current_user(request)
+        if not current_user:
+            return JSONResponse({"detail": "Authentication required"}, status_code=401)
+        base = await run_in_threadpool(load_owned_course, course_id, current_user["id"])
+        if not base:
+            return JSONResponse({"detail": "Course not found"}, status_code=404)
+        content = parse_course_content(base[1], base[0])
+        chunks, sections = await run_in_threadpool(load_course_source, DB_PATH, course_id)
+        try:
+            task = await run_in_threadpool(build_task, content, chunks, sections)
+        except PartialError as e:
+            return JSONResponse({"detail": str(e)}, status_code=400)
+        async with generation_admission.admit(current_user["id"], request.receive) as ticket:
+            async with ticket.model_slot():
+                result = await run_in_threadpool(run_partial_task, task)
+        if result is None:
+            return JSONResponse({"detail": "Модель недоступна, попробуйте позже"}, status_code=503)
+        patches = task.patches(result)
+        if not patches:
+            return JSONResponse({"detail": "Модель вернула некорректный ответ, попробуйте ещё раз"}, status_code=502)
+        written = await db_writer.execute(*patch_statement(course_id, current_user["id"], patches, task.guards))
+        if not written.rowcount:
+            return JSONResponse({"detail": "Курс изменился или удалён, обновите страницу"}, status_code=409)
+        await cache_sync.publish("export", course_id)
+        pdf_renderer.remove_course(course_id)
+        await prerender_course_pdf(course_id)
+        logger.info("Course part regenerated", extra={"course_id": course_id, "part": task.kind})
         return JSONResponse(
             {
                 "success": True,
                 "course_id": course_id,
-                "title": course_content.get("title", f"Курс: {video_title}"),
-                "message": "Курс успешно создан из PDF!",
-                "ai_used": "Qwen2.5-4B",
-                "pdf_url": f"/api/courses/{course_id}/pdf",
+                "part": task.kind,
+                "updated": {path: json.loads(value) for path, value in patches},
             }
         )
+    except AdmissionRejected as e:
+        logger.warning("Partial regeneration rejected: %s", e.detail, extra={"user_id": current_user["id"]})
+        return too_many_requests(e)
+    except GenerationCancelled as e:
+        return generation_cancelled(e)
     except Exception as e:
-        print(f"❌ Course from PDF error: {e}")
+        logger.exception("Partial regeneration error: %s", e)
         return JSONResponse({"detail": str(e)}, status_code=500)
 
 
+def chunks_of_sections(chunks, sections, wanted) -> list:
+    return [chunk.text for chunk, section in zip(chunks, sections) if section in wanted]
+
+
+@app.post("/api/courses/{course_id}/sections/{index}/regenerate")
+async def regenerate_section(course_id: int, index: int, request: Request):
+    def build(content, chunks, sections):
+        titles = [section.get("title", "") for section in content.get("sections") or [] if isinstance(section, dict)]
+        query = titles[index] if 0 <= index < len(titles) else ""
+        return section_task(content, index, source_excerpt(chunks_of_sections(chunks, sections, {index}), query))
+
+    return await regenerate_course_part(request, course_id, build)
+
+
+@app.post("/api/courses/{course_id}/summary/regenerate")
+async def regenerate_summary(course_id: int, request: Request):
+    def build(content, chunks, sections):
+        return summary_task(content, source_excerpt([chunk.text for chunk in chunks], content.get("title", "")))
+
+    return await regenerate_course_part(request, course_id, build)
+
+
+@app.post("/api/courses/{course_id}/quizzes/regenerate")
+async def regenerate_quizzes(
+    course_id: int, request: Request, indices: Optional[str] = Form(None), count: Optional[int] = Form(None)
+):
+    try:
+        wanted = [int(value) for value in indices.split(",") if value.strip()] if indices else None
+    except ValueError:
+        return JSONResponse({"detail": "indices — номера вопросов через запятую"}, status_code=400)
+
+    def build(content, chunks, sections):
+        texts = [chunk.text for chunk in chunks]
+        if wanted:
+            owners = quiz_owners(content)
+            about = {owners[index] for index in wanted if 0 <= index < len(owners)}
+            texts = chunks_of_sections(chunks, sections, about) or texts
+        return quiz_task(content, wanted, count, source_excerpt(texts, content.get("title", "")))
+
+    return await regenerate_course_part(request, course_id, build)
+
+
+@app.get("/api/jobs")
+async def list_generation_jobs(request: Request):
+    """Active generation jobs of the current user (queued or running)."""
+    current_user = await get_current_user(request)
+    if not current_user:
+        return JSONResponse({"detail": "Authentication required"}, status_code=401)
+    jobs = await run_in_threadpool(generation_admission.jobs, current_user["id"])
+    return JSONResponse({"jobs": jobs})
+
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_generation_job(job_id: int, request: Request):
+    """Cancel a queued or running generation; its model request is aborted and nothing is stored."""
+    current_user = await get_current_user(request)
+    if not current_user:
+        return JSONResponse({"detail": "Authentication required"}, status_code=401)
+    if not await generation_admission.cancel(job_id, current_user["id"]):
+        return JSONResponse({"detail": "Активной задачи с таким id нет"}, status_code=404)
+    logger.info("Generation job cancelled", extra={"job_id": job_id, "user_id": current_user["id"]})
+    return JSONResponse({"success": True, "job_id": job_id, "status": "cancelled"})
+
+
+# Ключи содержимого курса можно запрашивать без префикса content.
+COURSE_FIELD_ALIASES = {
+    "sections": "content.sections",
+    "quizzes": "content.quizzes",
+    "summary": "content.summary",
+}
+# Поля ответа /api/courses/<id> и ключи содержимого курса для проверки ?fields=
+COURSE_CONTENT_FIELDS = ("title", "description", "sections", "quizzes", "summary", "is_pdf", "is_fallback", "video_url")
+COURSE_FIELDS = {
+    **dict.fromkeys(
+        ("id", "title", "description", "video_url", "video_title", "created_at", "version", "parent_id", "status")
+    ),
+    "content": COURSE_CONTENT_FIELDS,
+}
+
+
 @app.get("/api/courses/{course_id}")
-async def get_course_detail(course_id: int, request: Request):
+async def get_course_detail(course_id: int, request: Request, fields: Optional[str] = None):
     try:
+        try:
+            field_tree = parse_fields(fields, COURSE_FIELD_ALIASES, COURSE_FIELDS)
+        except InvalidFields as e:
+            return JSONResponse({"detail": str(e)}, status_code=400)
         current_user = await get_current_user(request)
         if not current_user:
             return JSONResponse({"detail": "Authentication required"}, status_code=401)
         user_id = current_user["id"]
-        conn = sqlite3.connect("coursegen.db")
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT id, title, description, video_url, video_title, content, created_at 
-            FROM courses WHERE id = ? AND user_id = ?
-        """,
-            (course_id, user_id),
-        )
-        course = cursor.fetchone()
-        conn.close()
+        with stage_timer("db_read"):
+            conn = sqlite3.connect(DB_PATH)
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT id, title, description, video_url, video_title, content, created_at, version, parent_id, status
+                FROM courses WHERE id = ? AND user_id = ?
+            """,
+                (course_id, user_id),
+            )
+            course = cursor.fetchone()
+            conn.close()
         if not course:
             return JSONResponse({"detail": "Course not found"}, status_code=404)
         course_data = {
@@ -637,13 +1289,18 @@ async def get_course_detail(course_id: int, request: Request):
             "description": course[2],
             "video_url": course[3],
             "video_title": course[4],
-            "content": course[5],
             "created_at": course[6],
+            "version": course[7],
+            "parent_id": course[8],
+            # pending_upgrade — шаблон, который заменится настоящим содержимым; клиент опрашивает курс
+            "status": course[9],
         }
-        print(f"✅ Course details loaded: {course_data['title']}")
-        return JSONResponse(course_data)
+        if field_tree is None or "content" in field_tree:
+            course_data["content"] = parse_course_content(course[5], course[1])
+        logger.debug("Course details loaded", extra={"course_id": course_id})
+        return json_response_with_etag(request, project(course_data, field_tree))
     except Exception as e:
-        print(f"❌ Error loading course details: {e}")
+        logger.exception("Error loading course details: %s", e)
         return JSONResponse({"detail": str(e)}, status_code=500)
 
 @app.get("/api/courses/{course_id}/pdf")
@@ -653,11 +1310,11 @@ async def get_course_pdf(course_id: int, request: Request):
         if not current_user:
             return JSONResponse({"detail": "Authentication required"}, status_code=401)
         user_id = current_user["id"]
-        conn = sqlite3.connect("coursegen.db")
+        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         cursor.execute(
             """
-            SELECT title, content FROM courses WHERE id = ? AND user_id = ?
+            SELECT title, content, created_at FROM courses WHERE id = ? AND user_id = ?
         """,
             (course_id, user_id),
         )
@@ -665,85 +1322,180 @@ async def get_course_pdf(course_id: int, request: Request):
         conn.close()
         if not course:
             return JSONResponse({"detail": "Course not found"}, status_code=404)
-        course_title = course[0]
-        course_content_raw = course[1]
-        try:
-            course_content = json.loads(course_content_raw)
-        except:
-            course_content = {
-                "title": course_title,
-                "description": "Автоматически сгенерированный курс",
-                "sections": [],
-                "summary": "Курс создан на основе видео материала",
-            }
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <title>{course_content.get('title', course_title)}</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; line-height: 1.6; margin: 40px; }}
-                h1 {{ color: #2C3E50; border-bottom: 2px solid #a3ff00; padding-bottom: 10px; }}
-                h2 {{ color: #2C3E50; margin-top: 30px; }}
-                .section {{ margin-bottom: 30px; }}
-                .quiz {{ border: 1px solid #ddd; padding: 15px; margin: 10px 0; border-radius: 5px; }}
-                .summary {{ background: #e8f5e8; padding: 20px; border-radius: 5px; margin: 20px 0; }}
-                .pdf-preview {{ margin: 12px 0; }}
-                .pdf-preview img {{ max-width: 180px; max-height: 260px; border-radius: 5px; box-shadow: 0 1px 12px #ccc; margin: 0 4px; }}
-            </style>
-        </head>
-        <body>
-            <h1>{course_content.get('title', course_title)}</h1>
-            <p><strong>Описание:</strong> {course_content.get('description', 'Автоматически сгенерированный курс')}</p>
-            <p><em>Сгенерировано с помощью AI: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}</em></p>
-            <div class="content">
-        """
-        sections = course_content.get("sections", [])
-        for i, section in enumerate(sections, 1):
-            html_content += f"""
-                <div class="section">
-                    <h2>{i}. {section.get('title', f'Раздел {i}')}</h2>
-                    <p>{section.get('content', 'Содержание раздела')}</p>
-                </div>
-            """
-        quizzes = course_content.get("quizzes", [])
-        if quizzes:
-            html_content += "<h2>Тесты для проверки знаний</h2>"
-            for i, quiz in enumerate(quizzes, 1):
-                html_content += f"""
-                    <div class="quiz">
-                        <h3>Вопрос {i}: {quiz.get('question', 'Вопрос')}</h3>
-                        <ol>
-                            {"".join(f'<li>{option}</li>' for option in quiz.get('options', []))}
-                        </ol>
-                    </div>
-                """
-        summary = course_content.get("summary")
-        if summary:
-            html_content += f"""
-                <div class="summary">
-                    <h2>Итоговое резюме</h2>
-                    <p>{summary}</p>
-                </div>
-            """
-        html_content += """
-            </div>
-        </body>
-        </html>
-        """
-        os.makedirs("courses", exist_ok=True)
-        pdf_path = f"courses/course_{course_id}.html"
-        with open(pdf_path, "w", encoding="utf-8") as f:
-            f.write(html_content)
-        return FileResponse(
-            pdf_path, filename=f"{course_title}.html", media_type="text/html"
+        course_title, course_content_raw, created_at = course
+        etag = export_cache.etag_for(course_id, course_title, course_content_raw, created_at)
+        if pdf_renderer.available():
+            pdf_etag = etag[:-1] + '.pdf"'
+            pdf_headers = {"ETag": pdf_etag, "Cache-Control": "private, no-cache"}
+            cached = not_modified(request, pdf_etag)
+            if cached is not None:
+                return cached
+            try:
+                pdf_path = await pdf_renderer.get(
+                    course_id, course_title, course_content_raw, created_at
+                )
+                return FileResponse(
+                    pdf_path,
+                    filename=f"{course_title}.pdf",
+                    media_type="application/pdf",
+                    headers=pdf_headers,
+                )
+            except Exception as e:
+                logger.warning("PDF не готов (%s), отдаём HTML", e, extra={"course_id": course_id})
+        cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        cached = not_modified(request, etag)
+        if cached is not None:
+            return cached
+        _, html_body = export_cache.get_or_render(
+            course_id, course_title, course_content_raw, created_at
+        )
+        return Response(
+            html_body,
+            media_type="text/html",
+            headers={
+                **cache_headers,
+                "Content-Disposition": attachment_header(f"{course_title}.html"),
+            },
         )
     except Exception as e:
-        print(f"❌ Error generating PDF: {e}")
+        logger.exception("Error generating PDF: %s", e)
         return JSONResponse({"detail": str(e)}, status_code=500)
 
 
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "16"))
+EXPORT_TICKET_SECONDS = 120
+
+
+def create_export_ticket(email: str):
+    token_data = {
+        "sub": email,
+        "scope": "export",
+        "exp": datetime.datetime.utcnow()
+        + datetime.timedelta(seconds=EXPORT_TICKET_SECONDS),
+    }
+    return jwt.encode(token_data, SECRET_KEY, algorithm="HS256")
+
+
+def load_courses_page(user_id: int, after_id: int, limit: int):
+    conn = sqlite3.connect(DB_PATH)
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT id, title, description, video_url, video_title, content, created_at
+        FROM courses WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?
+    """,
+        (user_id, after_id, limit),
+    )
+    rows = cursor.fetchall()
+    conn.close()
+    return rows
+
+
+async def render_export_entry(course):
+    course_id, title, _, _, _, content, created_at = course
+    _, html_body = await run_in_threadpool(
+        export_cache.get_or_render, course_id, title, content, created_at
+    )
+    pdf_path = None
+    if pdf_renderer.available():
+        try:
+            pdf_path = await pdf_renderer.get(course_id, title, content, created_at)
+        except Exception as e:
+            logger.warning("PDF не попадёт в архив: %s", e, extra={"course_id": course_id})
+    return html_body, pdf_path
+
+
+async def stream_courses_zip(user_id: int):
+    archive = ZipStream()
+    after_id = 0
+    page = load_courses_page(user_id, after_id, EXPORT_PAGE_SIZE)
+    pending = [asyncio.ensure_future(render_export_entry(c)) for c in page]
+    next_pending = []
+    try:
+        while page:
+            # Следующая страница рендерится, пока текущая уходит клиенту
+            after_id = page[-1][0]
+            next_page = load_courses_page(user_id, after_id, EXPORT_PAGE_SIZE)
+            next_pending = [
+                asyncio.ensure_future(render_export_entry(c)) for c in next_page
+            ]
+            for course, task in zip(page, pending):
+                course_id, title, description, video_url, video_title, content, created_at = course
+                html_body, pdf_path = await task
+                folder = f"{course_id:05d}_{safe_name(title)}"
+                metadata = {
+                    "id": course_id,
+                    "title": title,
+                    "description": description,
+                    "video_url": video_url,
+                    "video_title": video_title,
+                    "created_at": created_at,
+                    "content": parse_course_content(content, title),
+                }
+                yield archive.add_bytes(
+                    f"{folder}/course.json",
+                    json.dumps(metadata, ensure_ascii=False, indent=2).encode("utf-8"),
+                    created_at,
+                )
+                yield archive.add_bytes(f"{folder}/course.html", html_body, created_at)
+                if pdf_path:
+                    yield await run_in_threadpool(
+                        archive.add_file, f"{folder}/course.pdf", pdf_path
+                    )
+            page, pending = next_page, next_pending
+        yield archive.close()
+    finally:
+        for task in pending + next_pending:
+            task.cancel()
+
+
+@app.post("/api/export/ticket")
+async def create_courses_export_ticket(request: Request):
+    current_user = await get_current_user(request)
+    if not current_user:
+        return JSONResponse({"detail": "Authentication required"}, status_code=401)
+    ticket = create_export_ticket(current_user["email"])
+    return JSONResponse(
+        {
+            "url": f"/api/export/courses.zip?ticket={ticket}",
+            "expires_in": EXPORT_TICKET_SECONDS,
+        }
+    )
+
+
+@app.get("/api/export/courses.zip")
+async def export_courses_zip(request: Request, ticket: Optional[str] = None):
+    """Все курсы пользователя одним ZIP, который отдаётся потоком.
+
+    Браузер не может передать Authorization при обычной навигации, поэтому
+    кроме заголовка принимается короткоживущий билет из /api/export/ticket.
+    """
+    current_user = await get_current_user(request)
+    if not current_user and ticket:
+        payload = decode_token(ticket)
+        if payload and payload.get("scope") == "export":
+            conn = sqlite3.connect(DB_PATH)
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, email FROM users WHERE email = ?", (payload.get("sub"),)
+            )
+            user = cursor.fetchone()
+            conn.close()
+            if user:
+                current_user = {"id": user[0], "email": user[1]}
+    if not current_user:
+        return JSONResponse({"detail": "Authentication required"}, status_code=401)
+    logger.info("Export of all courses", extra={"user_id": current_user["id"]})
+    return StreamingResponse(
+        stream_courses_zip(current_user["id"]),
+        media_type="application/zip",
+        headers={
+            "Content-Disposition": attachment_header("coursegen_courses.zip"),
+            "Cache-Control": "no-store",
+        },
+    )
+
+
 @app.get("/api/health")
 async def health_check():
     lm_status = "available" if is_lm_studio_available() else "unavailable"
@@ -761,7 +1513,7 @@ async def health_check():
 async def debug():
     import sqlite3
 
-    conn = sqlite3.connect("coursegen.db")
+    conn = sqlite3.connect(DB_PATH)
     cursor = conn.cursor()
     cursor.execute("SELECT id, email, first_name, last_name FROM users")
     users = cursor.fetchall()
@@ -776,13 +1528,62 @@ async def debug():
                 {"id": u[0], "email": u[1], "name": f"{u[2]} {u[3]}"} for u in users
             ],
             "courses": [{"id": c[0], "title": c[1], "user_id": c[2]} for c in courses],
-            "database_exists": os.path.exists("coursegen.db"),
+            "database_exists": os.path.exists(DB_PATH),
+            "db_writer": db_writer.stats(),
+            "auth_cache": token_cache.stats(),
+            "cache_sync": cache_sync.stats(),
+            "generation_admission": generation_admission.stats(),
+            "export_cache": export_cache.stats(),
+            "pdf_renderer": pdf_renderer.stats(),
+            "dedup": source_index.stats(),
+            "llm_routes": model_router.stats(),
+            "upgrades": upgrade_queue.stats(),
+            "logging": logging_stats(),
             "lm_studio_status": lm_status,
             "current_directory": os.getcwd(),
         }
     )
 
 
+@app.get("/metrics")
+async def metrics():
+    # Счётчики всех воркеров; очередь генераций — общая, из базы
+    admission = await run_in_threadpool(generation_admission.stats)
+    gauges = [
+        ("coursegen_generation_running", "Generations holding a model slot", admission["running"]),
+        ("coursegen_generation_queued", "Generations waiting for a model slot", admission["queued"]),
+    ]
+    body = registry.render(metrics_snapshots.collect(), gauges)
+    return Response(body, media_type="text/plain; version=0.0.4")
+
+
+def load_profile(profile_id: str, extension: str):
+    # Части профиля: сам запрос и фоновые задачи (например, .pdf_render)
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    parts = []
+    for name in sorted(os.listdir(PROFILE_DIR)):
+        if name.split(".", 1)[0] == profile_id and name.endswith(extension):
+            with open(os.path.join(PROFILE_DIR, name), encoding="utf-8") as f:
+                parts.append(f.read())
+    return parts
+
+
+@app.get("/api/profiles/{profile_id}")
+async def get_profile(profile_id: str, request: Request, format: str = "json"):
+    current_user = await get_current_user(request)
+    if not current_user or not is_admin_email(current_user["email"]):
+        return JSONResponse({"detail": "Admin access required"}, status_code=403)
+    if not profile_id.isalnum() or format not in ("json", "collapsed"):
+        return JSONResponse({"detail": "Invalid profile request"}, status_code=400)
+    parts = await run_in_threadpool(load_profile, profile_id, "." + format)
+    if not parts:
+        return JSONResponse({"detail": "Profile not found"}, status_code=404)
+    if format == "collapsed":
+        return Response("".join(parts), media_type="text/plain")
+    return JSONResponse({"id": profile_id, "parts": [json.loads(part) for part in parts]})
+
+
 @app.get("/api/ai-status")
 async def ai_status():
     status = is_lm_studio_available()
@@ -790,11 +1591,7 @@ async def ai_status():
         {
             "ai_available": status,
             "model": "Qwen2.5-4B",
-            "endpoint": (
-                os.getenv("QWEN_API_URL", "http://127.0.0.1:1234/v1")
-                if status
-                else "unavailable"
-            ),
+            "endpoint": model_router.route("course").url if status else "unavailable",
         }
     )
 
@@ -806,7 +1603,7 @@ async def delete_course(course_id: int, request: Request):
         if not current_user:
             return JSONResponse({"detail": "Authentication required"}, status_code=401)
         user_id = current_user["id"]
-        conn = sqlite3.connect("coursegen.db")
+        conn = sqlite3.connect(DB_PATH)
         cursor = conn.cursor()
         cursor.execute(
             """
@@ -819,15 +1616,55 @@ async def delete_course(course_id: int, request: Request):
             conn.close()
             return JSONResponse({"detail": "Course not found"}, status_code=404)
         cursor.execute("DELETE FROM courses WHERE id = ?", (course_id,))
+        source_index.remove(conn, course_id)
+        remove_course_chunks(conn, course_id)
+        upgrade_queue.remove(conn, course_id)
         conn.commit()
         conn.close()
-        print(f"✅ Course deleted: {course_id} by user: {current_user['email']}")
+        await cache_sync.publish("export", course_id)
+        pdf_renderer.remove_course(course_id)
+        logger.info("Course deleted", extra={"course_id": course_id, "user_id": current_user["id"]})
         return JSONResponse({"success": True, "message": "Курс успешно удален"})
     except Exception as e:
-        print(f"❌ Error deleting course: {e}")
+        logger.exception("Error deleting course: %s", e)
         return JSONResponse({"detail": str(e)}, status_code=500)
 
 
+def web_concurrency() -> int:
+    if os.getenv("WEB_CONCURRENCY"):
+        return int(os.environ["WEB_CONCURRENCY"])
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def run_production():
+    """Several worker processes, app preloaded once, no reloader."""
+    os.environ["COURSEGEN_ENV"] = "production"
+    root_dir = os.path.dirname(os.path.abspath(__file__))
+    if sys.platform != "win32":
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            logger.warning("gunicorn не установлен, запускаем воркеры uvicorn без preload")
+        else:
+            os.chdir(root_dir)
+            os.execvp(
+                sys.executable,
+                [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "start:app"],
+            )
+    import uvicorn
+
+    uvicorn.run(
+        "start:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=web_concurrency(),
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_TIMEOUT", "420")),
+    )
+
+
 if __name__ == "__main__":
     print("🚀 CourseGen Server started!")
     print("📁 Current directory:", os.getcwd())
@@ -839,4 +1676,10 @@ if __name__ == "__main__":
         print("✅ Qwen2.5-4B доступен через LM Studio!")
     else:
         print("⚠️  LM Studio недоступен, будут использоваться шаблонные курсы")
-    uvicorn.run("start:app", host="0.0.0.0", port=8000, reload=True)
+    if "--production" in sys.argv or os.getenv("COURSEGEN_ENV") == "production":
+        run_production()
+    else:
+        import uvicorn
+
+        os.environ.setdefault("COURSEGEN_ENV", "development")
+        uvicorn.run("start:app", host="0.0.0.0", port=8000, reload=True)